@@ -1,3 +1,8 @@
+from dotenv import load_dotenv
+
+# Load .env before the app modules: the DB engine reads DATABASE_URL on import.
+load_dotenv()
+
 from fastapi import FastAPI
 from app.routes.ingest import router as ingest_router
 from app.routes.search import router as search_router
@@ -7,21 +12,40 @@ from app.routes.instructor import router as instructor_router
 
 from app.services.db import init_db
 from app.services.backfill_embeddings import backfill_embeddings
-
-from dotenv import load_dotenv
-
+from app.services.write_behind import write_behind
+from app.services.archive import archive_scheduler
+from app.services.memory import summarizer
+from app.services.confusion_model import confusion_model
+from app.services.backfill_confusion import confusion_backfill
+from app.services.confusion_training import online_trainer
+from app.services.context_packer import warm_encoder
 
 
-load_dotenv()
-
 app = FastAPI()
 
 @app.on_event("startup")
 def _startup():
     init_db()
+    write_behind.start()
+    summarizer.start()
+    archive_scheduler.start()
+    # Load (or start training) the confusion model before the first question.
+    confusion_model.get()
+    online_trainer.start()
+    warm_encoder()
     # Best-effort backfill on startup; if API key missing, it will no-op.
     backfill_embeddings(batch_size=64)
 
+@app.on_event("shutdown")
+def _shutdown():
+    archive_scheduler.stop()
+    # An interrupted backfill resumes from its checkpoint next time.
+    confusion_backfill.stop()
+    online_trainer.stop()
+    summarizer.stop()
+    # Commit anything still queued before the process exits.
+    write_behind.stop()
+
 @app.get("/health")
 def health():
     return {"status": "ok"}
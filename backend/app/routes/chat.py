@@ -1,17 +1,32 @@
-from fastapi import APIRouter
+import asyncio
+import json
+import logging
+import time
+from dataclasses import dataclass
+
+from fastapi import APIRouter, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel, Field
-from typing import List, Literal, Optional
+from typing import AsyncIterator, Awaitable, List, Literal, Optional, Set, Tuple
 
-from app.services.store import course_store
-from app.services.llm import generate_answer_with_openai
-from app.services.citation_guard import needs_fix, all_citations_valid
-from app.services.llm import generate_answer_with_openai, fix_citations_with_openai
-from app.services.question_log import log_question
+from app.services.store import StoredChunk, course_store
+from app.services.answer_cache import CachedAnswer, answer_cache
+from app.services.embeddings import embed_query
+from app.services.citation_repair import repair_citations
+from app.services.citation_guard import needs_fix, all_citations_valid, StreamingCitationChecker
+from app.services.llm_gateway import gateway
+from app.services.llm import answer_messages, has_openai_key, generate_answer_async, fix_citations_async, stream_answer_async
+from app.services.context_packer import PROMPT_TOKEN_BUDGET, PackedPrompt, count_tokens, pack_context, record_prompt
+from app.services.confusion_score import compute_confusion
+from app.services.confusion_training import add_label
+from app.services.question_log import record_question
 from app.services.memory import add_turn, get_recent_turns
+from app.services.memory import get_memory as get_conversation_memory
 from app.services.mastery import extract_concepts, update_student_mastery
 
-
-
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -24,6 +39,13 @@ class ChatRequest(BaseModel):
     message: str
     mode: Mode = Field("normal")
 
+class FeedbackRequest(BaseModel):
+    course_id: str
+    lecture_id: Optional[str] = None
+    user_id: str
+    message: str
+    confused: bool
+
 class Citation(BaseModel):
     source_name: str
     chunk_id: str
@@ -70,30 +92,67 @@ def synthesize_answer(question: str, contexts: List[str], mode: str) -> str:
     )
 
 
-@router.post("/", response_model=ChatResponse)
-def chat(req: ChatRequest):
-    memory = get_recent_turns(
-        req.course_id,
-        req.user_id,
-        lecture_id=req.lecture_id,
-        limit=6,
-    )
-    confusion = log_question(req.course_id, req.user_id, req.message, lecture_id=req.lecture_id)
-    add_turn(
-        req.course_id,
-        req.user_id,
-        role="user",
-        content=req.message,
-        lecture_id=req.lecture_id,
+@dataclass
+class _Retrieval:
+    hits: List[StoredChunk]
+    citations: List[Citation]
+    allowed_ids: Set[str]
+    # Texts used for mastery tracking (top hits, or the cached answer's).
+    context_texts: List[str]
+    query_embedding: Optional[List[float]] = None
+    # Lecture content version the answer is grounded in (answer cache key).
+    content_version: Optional[Tuple[int, float]] = None
+    cached: Optional[CachedAnswer] = None
+
+
+@dataclass
+class _Turn:
+    retrieval: _Retrieval
+    # Rolling summary plus the last turn or two verbatim (memory.get_memory).
+    summary: str
+    memory: List[dict]
+    confusion: float
+    asked_at: float
+    # Contexts and memory packed to the prompt token budget.
+    prompt: PackedPrompt
+    llm_used: bool = False
+    # Set once the answer is final; read by the bookkeeping task.
+    answer: Optional[str] = None
+
+
+async def _search(req: ChatRequest, memory: Awaitable[Tuple[str, List[dict]]]) -> _Retrieval:
+    # One embedding serves both the answer cache lookup and retrieval.
+    query_embedding, content_version = await asyncio.gather(
+        run_in_threadpool(embed_query, req.message),
+        run_in_threadpool(course_store.content_version, req.course_id, req.lecture_id),
     )
-    hits = course_store.search(
+    summary, turns = await memory
+    cached = None
+    # Cached answers are stand-alone first-turn answers (see _cache_answer);
+    # a follow-up needs this student's own context.
+    if not (turns or summary):
+        cached = answer_cache.lookup(
+            req.course_id, req.lecture_id, req.mode, req.message, query_embedding, content_version
+        )
+    if cached is not None:
+        return _Retrieval(
+            hits=[],
+            citations=[Citation(**c) for c in cached.citations],
+            allowed_ids=set(),
+            context_texts=cached.context_texts,
+            query_embedding=query_embedding,
+            content_version=content_version,
+            cached=cached,
+        )
+
+    hits = await run_in_threadpool(
+        course_store.search,
         req.course_id,
         req.message,
         k=5,
         lecture_id=req.lecture_id,
+        query_embedding=query_embedding,
     )
-    allowed_ids = {h.chunk_id for h in hits}
-
 
     citations = [
         Citation(
@@ -104,64 +163,306 @@ def chat(req: ChatRequest):
         for h in hits
     ]
 
-    contexts = [
-        f"[{h.source_name} | {h.chunk_id}]\n{h.text}"
-        for h in hits
-    ]
+    return _Retrieval(
+        hits=hits,
+        citations=citations,
+        allowed_ids={h.chunk_id for h in hits},
+        context_texts=[h.text for h in hits[:3]],
+        query_embedding=query_embedding,
+        content_version=content_version,
+    )
+
+
+def _pack_prompt(req: ChatRequest, retrieval: _Retrieval, summary: str, memory: List[dict]) -> PackedPrompt:
+    return pack_context(
+        retrieval.hits,
+        memory,
+        budget=PROMPT_TOKEN_BUDGET - count_tokens(req.message),
+        summary=summary,
+    )
+
+
+async def _prepare(req: ChatRequest) -> _Turn:
+    # Memory, confusion scoring and retrieval don't depend on each other, so
+    # they run concurrently (blocking parts in the threadpool) and the
+    # request waits only for the slowest; only the LLM call needs them all.
+    asked_at = time.time()
+    memory_task = asyncio.ensure_future(
+        run_in_threadpool(get_conversation_memory, req.course_id, req.user_id, lecture_id=req.lecture_id)
+    )
+    (summary, memory), confusion, retrieval = await asyncio.gather(
+        memory_task,
+        run_in_threadpool(compute_confusion, req.message),
+        _search(req, memory_task),
+    )
+    # Token counting is CPU work, so it stays off the event loop too.
+    prompt = await run_in_threadpool(_pack_prompt, req, retrieval, summary, memory)
+    return _Turn(
+        retrieval=retrieval,
+        summary=summary,
+        memory=memory,
+        confusion=confusion,
+        asked_at=asked_at,
+        prompt=prompt,
+    )
+
+
+def _record_turn(req: ChatRequest, t: _Turn) -> None:
+    """
+    Bookkeeping writes, run as a background task once the response is sent:
+    question log, conversation turns, and student mastery.
+    """
+    record_question(
+        req.course_id,
+        req.user_id,
+        req.message,
+        t.confusion,
+        lecture_id=req.lecture_id,
+        timestamp=t.asked_at,
+    )
+    add_turn(req.course_id, req.user_id, role="user", content=req.message, lecture_id=req.lecture_id)
+    if t.answer is not None:
+        add_turn(req.course_id, req.user_id, role="assistant", content=t.answer, lecture_id=req.lecture_id)
 
     # Update student mastery from question + retrieved context
-    concept_texts = [req.message] + [h.text for h in hits[:3]]
-    concepts = extract_concepts(concept_texts)
+    concepts = extract_concepts([req.message] + t.retrieval.context_texts)
     update_student_mastery(
         req.course_id,
         req.user_id,
         concepts,
-        confusion,
+        t.confusion,
         lecture_id=req.lecture_id,
     )
 
-    llm_answer = generate_answer_with_openai(req.message, contexts, req.mode, memory_turns=memory)
-
-    # If LLM is enabled, enforce citation rules
-    if llm_answer is not None:
-        if needs_fix(llm_answer, allowed_ids):
-            repaired = fix_citations_with_openai(llm_answer, contexts)
-            if repaired is not None and all_citations_valid(repaired, allowed_ids):
-                answer = repaired
-                note = "LLM enabled: answer repaired to enforce valid citations"
-            else:
-                # fallback
-                answer = synthesize_answer(req.message, [h.text for h in hits], req.mode)
-                note = "LLM enabled but citation validation failed: fallback used"
-        else:
-            answer = llm_answer
-            note = "LLM enabled: RAG (retrieve + generate)"
-    else:
-        answer = synthesize_answer(req.message, [h.text for h in hits], req.mode)
-        note = "LLM not configured: retrieval + template fallback"
+    if t.llm_used:
+        record_prompt(
+            req.course_id,
+            req.lecture_id,
+            "chat",
+            t.prompt,
+            answer_messages(
+                req.message,
+                t.prompt.contexts,
+                req.mode,
+                t.prompt.memory_turns,
+                t.prompt.summary,
+            ),
+        )
 
 
-    add_turn(
+async def _settle_answer(
+    req: ChatRequest,
+    t: _Turn,
+    llm_answer: Optional[str],
+    answer_needs_fix: Optional[bool] = None,
+) -> Tuple[str, str, bool]:
+    """
+    Enforce citation rules on the LLM answer; returns (answer, note, grounded),
+    where grounded means an LLM answer with valid citations.
+    answer_needs_fix lets the streaming path pass in its incremental verdict.
+    """
+    r = t.retrieval
+    if llm_answer is None:
+        answer = synthesize_answer(req.message, [h.text for h in r.hits], req.mode)
+        if has_openai_key():
+            return answer, "LLM unavailable (deadline or provider error): template fallback", False
+        return answer, "LLM not configured: retrieval + template fallback", False
+
+    if answer_needs_fix is None:
+        answer_needs_fix = needs_fix(llm_answer, r.allowed_ids)
+    if not answer_needs_fix:
+        return llm_answer, "LLM enabled: RAG (retrieve + generate)", True
+
+    # Local, deterministic repair first; a second completion is the last resort.
+    repaired = await run_in_threadpool(
+        repair_citations, llm_answer, req.course_id, r.hits, req.lecture_id
+    )
+    if repaired is not None and all_citations_valid(repaired, r.allowed_ids):
+        return repaired, "LLM enabled: citations repaired locally", True
+
+    repaired = await fix_citations_async(llm_answer, t.prompt.contexts)
+    if repaired is not None and all_citations_valid(repaired, r.allowed_ids):
+        return repaired, "LLM enabled: answer repaired to enforce valid citations", True
+
+    # fallback
+    answer = synthesize_answer(req.message, [h.text for h in r.hits], req.mode)
+    return answer, "LLM enabled but citation validation failed: fallback used", False
+
+
+def _cache_answer(req: ChatRequest, t: _Turn, answer: str, note: str) -> None:
+    # Only first-turn answers are cached: they can't lean on conversation
+    # memory, so they stand on their own for other students.
+    if t.memory or t.summary:
+        return
+    r = t.retrieval
+    answer_cache.store(
         req.course_id,
-        req.user_id,
-        role="assistant",
-        content=answer,
-        lecture_id=req.lecture_id,
+        req.lecture_id,
+        req.mode,
+        req.message,
+        r.query_embedding,
+        answer,
+        [c.model_dump() for c in r.citations],
+        note,
+        r.context_texts,
+        r.content_version,
     )
 
+
+def _cached_note(cached: CachedAnswer) -> str:
+    return f"{cached.note} (answer cache hit)"
+
+
+@router.post("/", response_model=ChatResponse)
+async def chat(req: ChatRequest, background_tasks: BackgroundTasks):
+    t = await _prepare(req)
+    r = t.retrieval
+
+    if r.cached is not None:
+        answer, note = r.cached.answer, _cached_note(r.cached)
+    else:
+        llm_answer = await generate_answer_async(
+            req.message,
+            t.prompt.contexts,
+            req.mode,
+            memory_turns=t.prompt.memory_turns,
+            summary=t.prompt.summary,
+        )
+        t.llm_used = llm_answer is not None
+        answer, note, grounded = await _settle_answer(req, t, llm_answer)
+        if grounded:
+            _cache_answer(req, t, answer, note)
+
+    t.answer = answer
+    background_tasks.add_task(_record_turn, req, t)
+
     return ChatResponse(
         answer=answer,
-        citations=citations,
+        citations=r.citations,
         note=note,
     )
 
 
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _stream_events(req: ChatRequest, t: _Turn) -> AsyncIterator[str]:
+    r = t.retrieval
+    yield _sse("citations", [c.model_dump() for c in r.citations])
+
+    if r.cached is not None:
+        t.answer = r.cached.answer
+        yield _sse("token", {"text": r.cached.answer})
+        yield _sse("final", {"answer": r.cached.answer, "note": _cached_note(r.cached), "replaced": False})
+        return
+
+    checker = StreamingCitationChecker(r.allowed_ids)
+    llm_answer = None
+    # The gateway deadline covers the whole stream, not just opening it.
+    deadline = asyncio.get_running_loop().time() + gateway.deadline
+    deltas = None
+    try:
+        deltas = await stream_answer_async(
+            req.message,
+            t.prompt.contexts,
+            req.mode,
+            memory_turns=t.prompt.memory_turns,
+            summary=t.prompt.summary,
+        )
+        t.llm_used = deltas is not None
+        if deltas is not None:
+            while True:
+                remaining = deadline - asyncio.get_running_loop().time()
+                try:
+                    delta = await asyncio.wait_for(anext(deltas), max(remaining, 0.0))
+                except StopAsyncIteration:
+                    break
+                yield _sse("token", {"text": delta})
+                for source_name, chunk_id, valid in checker.feed(delta):
+                    yield _sse(
+                        "citation",
+                        {"source_name": source_name, "chunk_id": chunk_id, "valid": valid},
+                    )
+            llm_answer = checker.text
+    except asyncio.TimeoutError:
+        logger.warning("chat stream exceeded %.1fs deadline", gateway.deadline)
+    except Exception:
+        logger.exception("chat stream failed")
+    finally:
+        if deltas is not None:
+            await deltas.aclose()
+
+    # An interrupted stream leaves llm_answer None: a cut-off answer is never
+    # kept (or cached), and the final event replaces it with the fallback.
+    answer, note, grounded = await _settle_answer(req, t, llm_answer, checker.needs_fix())
+    if grounded:
+        _cache_answer(req, t, answer, note)
+    t.answer = answer
+    # replaced tells the client to swap the streamed text for this answer.
+    yield _sse(
+        "final",
+        {"answer": answer, "note": note, "replaced": answer != checker.text},
+    )
+
+
+@router.post("/stream")
+async def chat_stream(req: ChatRequest):
+    """
+    Server-Sent Events: a citations event as soon as retrieval finishes,
+    token events as the answer is generated (plus a citation event each
+    time one is completed and checked), then a final event with the
+    answer to keep.
+    """
+    t = await _prepare(req)
+    return StreamingResponse(
+        _stream_events(req, t),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        # Runs after the stream ends, even if the client disconnected early.
+        background=BackgroundTask(_record_turn, req, t),
+    )
+
+
+@router.get("/cache_stats")
+def get_cache_stats():
+    return answer_cache.stats()
+
+
+@router.get("/llm_stats")
+def get_llm_stats():
+    return gateway.stats()
+
+
+@router.post("/feedback")
+def post_feedback(req: FeedbackRequest):
+    """
+    Student says whether a question of theirs was really a confused one;
+    feeds the confusion model's online training.
+    """
+    try:
+        label_id = add_label(
+            req.course_id,
+            req.confused,
+            "student",
+            question=req.message,
+            lecture_id=req.lecture_id,
+            user_id=req.user_id,
+        )
+    except ValueError as e:
+        return {"error": str(e)}
+    return {"label_id": label_id}
+
+
 @router.get("/memory")
 def get_memory(course_id: str, user_id: str, lecture_id: str | None = None):
     turns = get_recent_turns(course_id, user_id, lecture_id=lecture_id, limit=6)
+    # get_recent_turns already merged in other workers' turns, if enabled.
+    summary, _ = get_conversation_memory(course_id, user_id, lecture_id=lecture_id, check_db=False)
     return {
         "course_id": course_id,
         "user_id": user_id,
         "lecture_id": lecture_id,
+        "summary": summary,
         "turns": turns,
     }
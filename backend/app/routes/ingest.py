@@ -1,10 +1,15 @@
-from fastapi import APIRouter
-from pydantic import BaseModel
-from typing import Optional
+import asyncio
+import logging
+from fastapi import APIRouter, Request
+from fastapi.concurrency import run_in_threadpool
+from pydantic import BaseModel, ValidationError
+from typing import Dict, List, Optional
 from app.services.chunking import chunk_text
 from app.services.store import course_store
 
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
 class IngestRequest(BaseModel):
@@ -16,18 +21,159 @@ class IngestRequest(BaseModel):
 @router.post("/")
 def ingest(req: IngestRequest):
     chunks = chunk_text(req.text)
-    added = course_store.add_chunks(
-        req.course_id,
-        req.source_name,
-        chunks,
-        lecture_id=req.lecture_id,
-    )
+    diff = course_store.add_documents(
+        [
+            {
+                "course_id": req.course_id,
+                "lecture_id": req.lecture_id,
+                "source_name": req.source_name,
+                "chunks": chunks,
+            }
+        ]
+    )[0]
     first_preview = chunks[0][:120] if chunks else ""
 
     return {
         "course_id": req.course_id,
         "lecture_id": req.lecture_id,
         "source_name": req.source_name,
-        "chunks_added": added,
+        "chunks_added": diff["added"],
+        "chunks_removed": diff["removed"],
+        "chunks_unchanged": diff["unchanged"],
         "first_chunk_preview": first_preview,
     }
+
+
+@router.delete("/document")
+def delete_document(course_id: str, source_name: str, lecture_id: Optional[str] = None):
+    """
+    Removes a document (or every page of an ingested PDF) and its embeddings.
+    """
+    removed = course_store.delete_document(course_id, source_name, lecture_id=lecture_id)
+    return {
+        "course_id": course_id,
+        "lecture_id": lecture_id,
+        "source_name": source_name,
+        **removed,
+    }
+
+
+@router.delete("/lecture")
+def delete_lecture(course_id: str, lecture_id: str):
+    removed = course_store.delete_lecture(course_id, lecture_id)
+    return {
+        "course_id": course_id,
+        "lecture_id": lecture_id,
+        **removed,
+    }
+
+
+def _parse_line(line_no: int, raw: bytes) -> Dict:
+    try:
+        req = IngestRequest.model_validate_json(raw)
+    except ValidationError as e:
+        return {"line": line_no, "error": e.errors(include_url=False)[0]["msg"]}
+    return {
+        "line": line_no,
+        "course_id": req.course_id,
+        "lecture_id": req.lecture_id,
+        "source_name": req.source_name,
+        "chunks": chunk_text(req.text),
+    }
+
+
+def _parse_lines(first_line_no: int, lines: List[bytes]) -> List[Dict]:
+    return [_parse_line(first_line_no + i, raw) for i, raw in enumerate(lines) if raw.strip()]
+
+
+@router.post("/bulk")
+async def ingest_bulk(request: Request, batch_docs: int = 64, batch_chunks: int = 1024):
+    """
+    Bulk ingest from newline-delimited JSON (one IngestRequest per line).
+    Lines are parsed and chunked in the threadpool (one call per received
+    part) while the previous batch is written, each batch is one
+    transaction + batched embedding calls, and the search cache is
+    invalidated once at the end.
+    """
+    results: List[Dict] = []
+    touched_courses = set()
+    pending: List[Dict] = []
+    pending_chunks = 0
+    in_flight: Optional[asyncio.Task] = None
+
+    async def write(batch: List[Dict]) -> None:
+        # A failed batch rolls back on its own; earlier batches are already
+        # committed, so report it per document instead of failing the request.
+        try:
+            diffs = await run_in_threadpool(course_store.add_documents, batch, False)
+        except Exception as e:
+            logger.exception("bulk ingest batch of %d documents failed", len(batch))
+            for doc in batch:
+                doc["result"]["error"] = f"write failed: {e}"
+            return
+        for doc, diff in zip(batch, diffs):
+            doc["result"]["chunks_added"] = diff["added"]
+            doc["result"]["chunks_removed"] = diff["removed"]
+            doc["result"]["chunks_unchanged"] = diff["unchanged"]
+
+    async def flush() -> None:
+        nonlocal in_flight, pending, pending_chunks
+        if in_flight is not None:
+            await in_flight
+            in_flight = None
+        if pending:
+            in_flight = asyncio.create_task(write(pending))
+            pending = []
+            pending_chunks = 0
+
+    def accept(parsed: Dict) -> None:
+        nonlocal pending_chunks
+        if "error" in parsed:
+            results.append(parsed)
+            return
+        result = {
+            "line": parsed["line"],
+            "course_id": parsed["course_id"],
+            "lecture_id": parsed["lecture_id"],
+            "source_name": parsed["source_name"],
+            "chunks_added": 0,
+        }
+        results.append(result)
+        parsed["result"] = result
+        pending.append(parsed)
+        pending_chunks += len(parsed["chunks"])
+        touched_courses.add(parsed["course_id"])
+
+    buf = b""
+    line_no = 0
+    try:
+        async for part in request.stream():
+            buf += part
+            *lines, buf = buf.split(b"\n")
+            if not lines:
+                continue
+            # Validation and chunking are CPU work: keep them off the event loop.
+            for parsed in await run_in_threadpool(_parse_lines, line_no + 1, lines):
+                accept(parsed)
+                if len(pending) >= batch_docs or pending_chunks >= batch_chunks:
+                    await flush()
+            line_no += len(lines)
+        if buf:
+            for parsed in await run_in_threadpool(_parse_lines, line_no + 1, [buf]):
+                accept(parsed)
+        await flush()
+        await flush()
+    finally:
+        # Even if reading the body failed, let the last batch commit before
+        # invalidating, or the search cache could reload without it.
+        if in_flight is not None:
+            await in_flight
+        course_store.invalidate_courses(touched_courses)
+
+    errors = sum(1 for r in results if "error" in r)
+    return {
+        "documents": len(results) - errors,
+        "errors": errors,
+        "chunks_added": sum(r.get("chunks_added", 0) for r in results),
+        "results": results,
+    }
@@ -34,8 +34,8 @@ def ingest_pdf(
     # Extract page text
     pages = extract_pdf_text_by_page(saved_path)
 
-    total_chunks = 0
     pages_ingested = 0
+    docs = []
 
     for page_num, page_text in pages:
         if not page_text:
@@ -43,23 +43,35 @@ def ingest_pdf(
 
         pages_ingested += 1
 
-        # chunk per page so citations can point to a page
-        chunks = chunk_text(page_text)
-
-        # we embed page into the source_name for citations
-        page_source = f"{source_name} (page {page_num})"
-        total_chunks += course_store.add_chunks(
-            course_id,
-            page_source,
-            chunks,
-            lecture_id=lecture_id,
+        # chunk per page so citations can point to a page; re-uploads then
+        # only re-embed the pages whose text actually changed
+        docs.append(
+            {
+                "course_id": course_id,
+                "lecture_id": lecture_id,
+                # we embed page into the source_name for citations
+                "source_name": f"{source_name} (page {page_num})",
+                "chunks": chunk_text(page_text),
+            }
         )
 
+    diffs = course_store.add_documents(docs)
+    # pages that disappeared (or went blank) since the last upload
+    stale = course_store.delete_document(
+        course_id,
+        source_name,
+        lecture_id=lecture_id,
+        keep=[d["source_name"] for d in docs],
+        pages_only=True,
+    )
+
     return {
         "course_id": course_id,
         "lecture_id": lecture_id,
         "source_name": source_name,
         "pages_total": len(pages),
         "pages_ingested": pages_ingested,
-        "chunks_added": total_chunks
+        "chunks_added": sum(d["added"] for d in diffs),
+        "chunks_removed": sum(d["removed"] for d in diffs) + stale["chunks_deleted"],
+        "chunks_unchanged": sum(d["unchanged"] for d in diffs),
     }
@@ -1,29 +1,150 @@
 from fastapi import APIRouter
+from pydantic import BaseModel
+from typing import Literal, Optional
 from app.services.question_log import get_questions
 from app.services.question_cluster import cluster_questions
 from app.services.confusion_trend import compute_confusion_trend
+from app.services.confusion_rollups import resolution_for, rollup_trend
 from app.services.db import db_conn, student_concepts
 from sqlalchemy import select
 from app.services.alerts import detect_confusion_spike, create_alert, recent_alert_exists, list_alerts, debug_alert_metrics
 from app.services.recommendations import generate_recommendations
+from app.services.archive import list_archived_terms, load_archived_questions, load_archived_turns, run_archive
+from app.services.confusion_training import add_label, online_trainer
+from app.services.backfill_confusion import BACKFILL_BATCH_SIZE, BACKFILL_WORKERS, confusion_backfill
 
 
 
 router = APIRouter()
 
 @router.get("/questions")
-def get_course_questions(course_id: str, lecture_id: str | None = None):
+def get_course_questions(
+    course_id: str,
+    lecture_id: str | None = None,
+    include_archived: bool = False,
+    term: str | None = None,
+):
     """
     Instructor endpoint:
     Returns all student questions for a course.
+    Archived questions are only read when include_archived is set.
+    """
+    qs = get_questions(course_id, lecture_id=lecture_id)
+    if include_archived:
+        qs = load_archived_questions(course_id, lecture_id=lecture_id, term=term) + qs
+    return {
+        "course_id": course_id,
+        "lecture_id": lecture_id,
+        "total_questions": len(qs),
+        "questions": qs
+    }
+
+
+@router.get("/archive")
+def get_archive(course_id: str):
+    return {
+        "course_id": course_id,
+        "terms": list_archived_terms(course_id),
+    }
+
+
+@router.get("/archive/turns")
+def get_archived_turns(
+    course_id: str,
+    user_id: str | None = None,
+    lecture_id: str | None = None,
+    term: str | None = None,
+):
+    """
+    Conversation turns moved out of the hot table by archiving.
     """
+    turns = load_archived_turns(course_id, user_id=user_id, lecture_id=lecture_id, term=term)
     return {
         "course_id": course_id,
+        "user_id": user_id,
         "lecture_id": lecture_id,
-        "total_questions": len(get_questions(course_id, lecture_id=lecture_id)),
-        "questions": get_questions(course_id, lecture_id=lecture_id)
+        "total_turns": len(turns),
+        "turns": turns,
     }
 
+
+@router.post("/archive/run")
+def post_archive_run(horizon_days: float | None = None, max_batches: int = 20):
+    """
+    Runs one bounded archival pass now instead of waiting for the scheduler.
+    """
+    return {"moved": run_archive(horizon_days=horizon_days, max_batches=max_batches)}
+
+
+@router.post("/backfill/confusion")
+def post_confusion_backfill(
+    batch_size: int = BACKFILL_BATCH_SIZE,
+    workers: int = BACKFILL_WORKERS,
+    restart: bool = False,
+):
+    """
+    Starts rescoring all questions with the current confusion model in the
+    background (resuming an interrupted run unless restart is set).
+    """
+    started = confusion_backfill.start(batch_size=batch_size, workers=workers, restart=restart)
+    return {"started": started, **confusion_backfill.status()}
+
+
+@router.get("/backfill/confusion")
+def get_confusion_backfill():
+    return confusion_backfill.status()
+
+
+@router.post("/backfill/confusion/stop")
+def post_confusion_backfill_stop():
+    confusion_backfill.stop()
+    return confusion_backfill.status()
+
+class ConfusionLabelRequest(BaseModel):
+    course_id: str
+    lecture_id: Optional[str] = None
+    # Either a stored question's id or the question text.
+    question_id: Optional[int] = None
+    question: Optional[str] = None
+    confused: bool
+    user_id: Optional[str] = None
+    source: Literal["instructor", "student"] = "instructor"
+
+
+@router.post("/confusion_labels")
+def post_confusion_label(req: ConfusionLabelRequest):
+    """
+    Labels a question as confused or not; the online trainer folds it into
+    the confusion model shortly after.
+    """
+    try:
+        label_id = add_label(
+            req.course_id,
+            req.confused,
+            req.source,
+            question=req.question,
+            question_id=req.question_id,
+            lecture_id=req.lecture_id,
+            user_id=req.user_id,
+        )
+    except ValueError as e:
+        return {"error": str(e)}
+    return {"label_id": label_id}
+
+
+@router.get("/confusion_model")
+def get_confusion_model():
+    return online_trainer.status()
+
+
+@router.post("/confusion_model/train")
+def post_confusion_model_train():
+    """
+    Applies pending labels now instead of waiting for the trainer.
+    """
+    return {"applied": online_trainer.train_pending(), **online_trainer.status()}
+
+
 @router.get("/clusters")
 def get_question_clusters(course_id: str, lecture_id: str | None = None):
     """
@@ -40,9 +161,25 @@ def get_question_clusters(course_id: str, lecture_id: str | None = None):
     }
 
 @router.get("/confusion_trend")
-def get_confusion_trend(course_id: str, lecture_id: str | None = None):
-    qs = get_questions(course_id, lecture_id=lecture_id)
-    trend = compute_confusion_trend(qs)
+def get_confusion_trend(
+    course_id: str,
+    lecture_id: str | None = None,
+    bucket_minutes: float = 1,
+    since: float | None = None,
+):
+    """
+    Instructor endpoint:
+    Average confusion per time bucket, read from the rollups when
+    bucket_minutes is one of their resolutions (0.25, 1, 5, 60).
+    """
+    resolution = resolution_for(bucket_minutes)
+    if resolution is not None:
+        trend = rollup_trend(course_id, lecture_id, resolution, since=since)
+    else:
+        qs = get_questions(course_id, lecture_id=lecture_id)
+        if since is not None:
+            qs = [q for q in qs if q["timestamp"] >= since]
+        trend = compute_confusion_trend(qs, bucket_minutes=bucket_minutes)
     return {
         "course_id": course_id,
         "lecture_id": lecture_id,
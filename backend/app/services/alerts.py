@@ -1,9 +1,10 @@
 import time
 from typing import List, Dict, Optional, Tuple
 
+from app.services.confusion_rollups import resolution_for, rollup_totals, rollup_trend
 from app.services.confusion_trend import compute_confusion_trend
 from app.services.db import db_conn, alerts
-from app.services.question_log import get_questions
+from app.services.question_log import get_questions, get_recent_questions
 
 
 def _compute_slope(points: List[Dict]) -> float:
@@ -19,6 +20,18 @@ def _compute_slope(points: List[Dict]) -> float:
     return num / den
 
 
+def _recent_trend(course_id: str, lecture_id: Optional[str], bucket_minutes: float, last: int) -> List[Dict]:
+    """
+    The last `last` non-empty trend buckets, from the rollups when
+    bucket_minutes matches one of their resolutions.
+    """
+    resolution = resolution_for(bucket_minutes)
+    if resolution is not None:
+        return rollup_trend(course_id, lecture_id, resolution, last=last)
+    qs = get_questions(course_id, lecture_id=lecture_id)
+    return compute_confusion_trend(qs, bucket_minutes=bucket_minutes)[-last:]
+
+
 def detect_confusion_spike(
     course_id: str,
     lecture_id: Optional[str] = None,
@@ -29,12 +42,11 @@ def detect_confusion_spike(
     bucket_minutes: float = 0.25,
     min_questions: int = 6,
 ) -> Optional[Tuple[Dict, float, float]]:
-    qs = get_questions(course_id, lecture_id=lecture_id)
-    trend = compute_confusion_trend(qs, bucket_minutes=bucket_minutes)
+    trend = _recent_trend(course_id, lecture_id, bucket_minutes, max(window, min_points))
     if len(trend) < min_points:
         # Fallback: if enough recent questions are confusing, trigger a medium alert.
-        if len(qs) >= min_questions:
-            recent = qs[-min_questions:]
+        recent = get_recent_questions(course_id, lecture_id=lecture_id, limit=min_questions)
+        if len(recent) >= min_questions:
             avg_conf = sum(q.get("confusion", 0.0) for q in recent) / max(len(recent), 1)
             if avg_conf >= avg_threshold:
                 alert = {
@@ -78,9 +90,15 @@ def debug_alert_metrics(
     bucket_minutes: float = 0.25,
     min_questions: int = 6,
 ) -> Dict:
-    qs = get_questions(course_id, lecture_id=lecture_id)
-    trend = compute_confusion_trend(qs, bucket_minutes=bucket_minutes)
-    recent_qs = qs[-min_questions:] if qs else []
+    resolution = resolution_for(bucket_minutes)
+    if resolution is not None:
+        total_questions, trend_points = rollup_totals(course_id, lecture_id, resolution)
+        trend = rollup_trend(course_id, lecture_id, resolution, last=6)
+    else:
+        qs = get_questions(course_id, lecture_id=lecture_id)
+        trend = compute_confusion_trend(qs, bucket_minutes=bucket_minutes)
+        total_questions, trend_points = len(qs), len(trend)
+    recent_qs = get_recent_questions(course_id, lecture_id=lecture_id, limit=min_questions)
     avg_recent = (
         sum(q.get("confusion", 0.0) for q in recent_qs) / max(len(recent_qs), 1)
         if recent_qs
@@ -88,8 +106,8 @@ def debug_alert_metrics(
     )
     slope = _compute_slope(trend[-6:]) if len(trend) >= 2 else 0.0
     return {
-        "total_questions": len(qs),
-        "trend_points": len(trend),
+        "total_questions": total_questions,
+        "trend_points": trend_points,
         "recent_count": len(recent_qs),
         "avg_recent_confusion": round(avg_recent, 3),
         "slope_recent": round(slope, 3),
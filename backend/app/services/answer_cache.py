@@ -0,0 +1,175 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+# Cosine similarity between question embeddings needed for a semantic hit.
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "86400"))
+# Entries kept per (course, lecture, mode); least recently used go first.
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "256"))
+
+Key = Tuple[str, Optional[str], str]
+# CourseStore.content_version of the lecture the answer was grounded in.
+Version = Tuple[int, float]
+
+
+def normalize_question(text: str) -> str:
+    return " ".join(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    embedding: Optional[np.ndarray]
+    answer: str
+    citations: List[Dict[str, str]]
+    note: str
+    # Top retrieved chunk texts, so mastery tracking still works on a hit.
+    context_texts: List[str]
+    version: Optional[Version] = None
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+class AnswerCache:
+    """
+    Per-process cache of grounded answers, keyed by (course, lecture, mode).
+    A question hits if its normalized text matches a cached one exactly, or
+    if its embedding is within ANSWER_CACHE_THRESHOLD cosine similarity.
+    CourseStore invalidates a lecture's entries (and the course-wide ones)
+    whenever that lecture's chunks change in this process; changes made by
+    other workers are caught by the content version each entry is stored
+    with, which lookup compares against the caller's.
+    """
+    def __init__(
+        self,
+        threshold: float = ANSWER_CACHE_THRESHOLD,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+    ):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._buckets: Dict[Key, "OrderedDict[str, CachedAnswer]"] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "exact_hits": 0,
+            "semantic_hits": 0,
+            "misses": 0,
+            "stores": 0,
+            "invalidations": 0,
+            "stale": 0,
+        }
+
+    def lookup(
+        self,
+        course_id: str,
+        lecture_id: Optional[str],
+        mode: str,
+        question: str,
+        embedding: Optional[List[float]] = None,
+        version: Optional[Version] = None,
+    ) -> Optional[CachedAnswer]:
+        norm = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            bucket = self._buckets.get((course_id, lecture_id, mode))
+            if bucket:
+                for k in [k for k, e in bucket.items() if now - e.created_at > self.ttl_seconds]:
+                    del bucket[k]
+                if version is not None:
+                    stale = [k for k, e in bucket.items() if e.version != version]
+                    for k in stale:
+                        del bucket[k]
+                    self._stats["stale"] += len(stale)
+
+            entry, kind = None, None
+            if bucket:
+                entry = bucket.get(norm)
+                kind = "exact_hits"
+                if entry is None and embedding is not None:
+                    entry = self._nearest(bucket, np.asarray(embedding, dtype=np.float32))
+                    kind = "semantic_hits"
+
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            bucket.move_to_end(normalize_question(entry.question))
+            entry.hits += 1
+            self._stats[kind] += 1
+            return entry
+
+    def _nearest(self, bucket: "OrderedDict[str, CachedAnswer]", q: np.ndarray) -> Optional[CachedAnswer]:
+        entries = [e for e in bucket.values() if e.embedding is not None and e.embedding.shape == q.shape]
+        if not entries:
+            return None
+        mat = np.stack([e.embedding for e in entries])
+        sims = (mat @ q) / (np.linalg.norm(mat, axis=1) * np.linalg.norm(q) + 1e-8)
+        best = int(sims.argmax())
+        return entries[best] if sims[best] >= self.threshold else None
+
+    def store(
+        self,
+        course_id: str,
+        lecture_id: Optional[str],
+        mode: str,
+        question: str,
+        embedding: Optional[List[float]],
+        answer: str,
+        citations: List[Dict[str, str]],
+        note: str,
+        context_texts: List[str],
+        version: Optional[Version] = None,
+    ) -> None:
+        entry = CachedAnswer(
+            question=question,
+            embedding=np.asarray(embedding, dtype=np.float32) if embedding is not None else None,
+            answer=answer,
+            citations=citations,
+            note=note,
+            context_texts=context_texts,
+            version=version,
+        )
+        with self._lock:
+            bucket = self._buckets.setdefault((course_id, lecture_id, mode), OrderedDict())
+            bucket[normalize_question(question)] = entry
+            bucket.move_to_end(normalize_question(question))
+            while len(bucket) > self.max_entries:
+                bucket.popitem(last=False)
+            self._stats["stores"] += 1
+
+    def invalidate(self, course_id: str, lecture_id: Optional[str] = None) -> None:
+        """
+        Drop answers that could cite chunks of this lecture: the lecture's
+        own entries and the course-wide ones. lecture_id=None drops the
+        whole course.
+        """
+        with self._lock:
+            keys = [
+                k for k in self._buckets
+                if k[0] == course_id and (lecture_id is None or k[1] in (lecture_id, None))
+            ]
+            for k in keys:
+                del self._buckets[k]
+            if keys:
+                self._stats["invalidations"] += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            out = dict(self._stats)
+            out["entries"] = sum(len(b) for b in self._buckets.values())
+        hits = out["exact_hits"] + out["semantic_hits"]
+        lookups = hits + out["misses"]
+        out["hits"] = hits
+        out["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        return out
+
+
+answer_cache = AnswerCache()
@@ -0,0 +1,270 @@
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, or_, select
+
+from app.services.confusion_rollups import upsert_rollups
+from app.services.db import db_conn, questions, conversation_turns
+
+
+logger = logging.getLogger(__name__)
+
+_BACKEND_DIR = Path(__file__).resolve().parents[2]
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", str(_BACKEND_DIR / "data" / "archive")))
+# Archiving moves rows out of the hot tables, so the scheduler only runs
+# when a deployment opts in; /instructor/archive/run works either way.
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "0") == "1"
+ARCHIVE_HORIZON_DAYS = float(os.getenv("ARCHIVE_HORIZON_DAYS", "120"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("ARCHIVE_INTERVAL_SECONDS", "3600"))
+# Comma-separated terms to archive regardless of age, e.g. "2025-fall,2026-spring".
+ARCHIVE_CLOSED_TERMS = [t for t in os.getenv("ARCHIVE_CLOSED_TERMS", "").split(",") if t.strip()]
+
+_TABLES = {
+    "questions": questions,
+    "conversation_turns": conversation_turns,
+}
+
+# (term, first month, last month)
+_TERMS = [("spring", 1, 5), ("summer", 6, 7), ("fall", 8, 12)]
+
+
+def term_of(ts: float) -> str:
+    d = datetime.fromtimestamp(ts, tz=timezone.utc)
+    for name, first, last in _TERMS:
+        if first <= d.month <= last:
+            return f"{d.year}-{name}"
+    return f"{d.year}-fall"
+
+
+def term_bounds(term: str) -> Tuple[float, float]:
+    """
+    [start, end) timestamps of a term label such as "2026-spring".
+    """
+    year, name = term.strip().split("-", 1)
+    for n, first, last in _TERMS:
+        if n == name:
+            start = datetime(int(year), first, 1, tzinfo=timezone.utc)
+            end = (
+                datetime(int(year) + 1, 1, 1, tzinfo=timezone.utc)
+                if last == 12
+                else datetime(int(year), last + 1, 1, tzinfo=timezone.utc)
+            )
+            return start.timestamp(), end.timestamp()
+    raise ValueError(f"Unknown term: {term}")
+
+
+def _safe(part: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", part)
+
+
+def _archive_path(table_name: str, course_id: str, term: str) -> Path:
+    return ARCHIVE_DIR / _safe(course_id) / _safe(term) / f"{table_name}.jsonl.gz"
+
+
+def _append(path: Path, rows: List[Dict]) -> None:
+    # Each batch is its own gzip member; gzip readers concatenate them.
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "ab") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb") as f:
+            for r in rows:
+                f.write((json.dumps(r) + "\n").encode("utf-8"))
+        raw.flush()
+        os.fsync(raw.fileno())
+
+
+def archive_batch(
+    table_name: str,
+    cutoff: float,
+    closed_terms: Iterable[str] = (),
+    batch_size: int = 5000,
+) -> int:
+    """
+    Move up to batch_size rows older than cutoff (or in a closed term) from
+    a hot table into the per-course/per-term archive files.
+    Rows are written to the archive before they are deleted, so a crash
+    in between can only duplicate rows (readers drop duplicates by id).
+    """
+    table = _TABLES[table_name]
+    cond = table.c.timestamp < cutoff
+    bounds = [term_bounds(t) for t in closed_terms]
+    if bounds:
+        cond = or_(cond, *[and_(table.c.timestamp >= s, table.c.timestamp < e) for s, e in bounds])
+
+    with db_conn() as conn:
+        rows = conn.execute(
+            select(table).where(cond).order_by(table.c.id.asc()).limit(batch_size)
+        ).fetchall()
+    if not rows:
+        return 0
+
+    groups: Dict[Tuple[str, str], List[Dict]] = {}
+    for r in rows:
+        row = dict(r._mapping)
+        groups.setdefault((row["course_id"], term_of(row["timestamp"])), []).append(row)
+    for (course_id, term), group in groups.items():
+        _append(_archive_path(table_name, course_id, term), group)
+
+    delete = table.delete().where(table.c.id.in_([r[0] for r in rows]))
+    with db_conn() as conn:
+        if table is not questions:
+            conn.execute(delete)
+            return len(rows)
+        # Another archiver (a second worker, or a manual run) may have moved
+        # some of these rows already: only take out of the rollups what this
+        # DELETE removed, in the same transaction.
+        deleted = conn.execute(
+            delete.returning(
+                table.c.course_id, table.c.lecture_id, table.c.timestamp, table.c.confusion
+            )
+        ).fetchall()
+        upsert_rollups(conn, [dict(r._mapping) for r in deleted], sign=-1)
+    return len(deleted)
+
+
+def run_archive(
+    horizon_days: Optional[float] = None,
+    closed_terms: Optional[Iterable[str]] = None,
+    batch_size: int = 5000,
+    max_batches: int = 20,
+) -> Dict[str, int]:
+    """
+    Archive in bounded batches (at most max_batches per table per call) so
+    a run never holds the database for long; the scheduler picks up the
+    rest on its next tick.
+    """
+    horizon = ARCHIVE_HORIZON_DAYS if horizon_days is None else horizon_days
+    terms = ARCHIVE_CLOSED_TERMS if closed_terms is None else list(closed_terms)
+    cutoff = time.time() - horizon * 86400
+    moved = {}
+    for table_name in _TABLES:
+        total = 0
+        for _ in range(max_batches):
+            n = archive_batch(table_name, cutoff, terms, batch_size=batch_size)
+            total += n
+            if n < batch_size:
+                break
+        moved[table_name] = total
+    return moved
+
+
+def list_archived_terms(course_id: str) -> List[str]:
+    course_dir = ARCHIVE_DIR / _safe(course_id)
+    if not course_dir.exists():
+        return []
+    return sorted(p.name for p in course_dir.iterdir() if p.is_dir())
+
+
+def _read_archive(
+    table_name: str,
+    course_id: str,
+    lecture_id: Optional[str] = None,
+    term: Optional[str] = None,
+) -> Iterator[Dict]:
+    # Rows of one course, optionally one lecture and term; a row archived
+    # twice (crash between write and delete) is yielded once.
+    terms = [term] if term else list_archived_terms(course_id)
+    seen = set()
+    for t in terms:
+        path = _archive_path(table_name, course_id, t)
+        if not path.exists():
+            continue
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                r = json.loads(line)
+                if r["id"] in seen or r["course_id"] != course_id:
+                    continue
+                if lecture_id and r.get("lecture_id") != lecture_id:
+                    continue
+                seen.add(r["id"])
+                yield r
+
+
+def load_archived_questions(
+    course_id: str,
+    lecture_id: Optional[str] = None,
+    term: Optional[str] = None,
+) -> List[dict]:
+    """
+    Archived questions in the same shape as question_log.get_questions.
+    """
+    out = [
+        {
+            "id": r["id"],
+            "user_id": r["user_id"],
+            "question": r["question"],
+            "lecture_id": r.get("lecture_id"),
+            "confusion": r["confusion"],
+            "timestamp": r["timestamp"],
+        }
+        for r in _read_archive("questions", course_id, lecture_id, term)
+    ]
+    out.sort(key=lambda q: q["timestamp"])
+    return out
+
+
+def load_archived_turns(
+    course_id: str,
+    user_id: Optional[str] = None,
+    lecture_id: Optional[str] = None,
+    term: Optional[str] = None,
+) -> List[dict]:
+    """
+    Archived conversation turns, oldest first, optionally for one student.
+    """
+    out = [
+        {
+            "id": r["id"],
+            "user_id": r["user_id"],
+            "lecture_id": r.get("lecture_id"),
+            "role": r["role"],
+            "content": r["content"],
+            "timestamp": r["timestamp"],
+        }
+        for r in _read_archive("conversation_turns", course_id, lecture_id, term)
+        if user_id is None or r["user_id"] == user_id
+    ]
+    out.sort(key=lambda t: (t["timestamp"], t["id"]))
+    return out
+
+
+class ArchiveScheduler:
+    def __init__(self, interval: float = ARCHIVE_INTERVAL_SECONDS, enabled: bool = ARCHIVE_ENABLED):
+        self._interval = interval
+        self._enabled = enabled
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if not self._enabled or self._interval <= 0:
+            return
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="archive", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.wait(self._interval):
+            try:
+                moved = run_archive()
+                if any(moved.values()):
+                    logger.info("archived %s", moved)
+            except Exception:
+                logger.exception("archive run failed")
+
+
+archive_scheduler = ArchiveScheduler()
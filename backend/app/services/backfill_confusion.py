@@ -1,19 +1,88 @@
-from typing import List, Tuple, Optional
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Deque, Dict, List, Optional, Tuple
 
-from sqlalchemy import select, bindparam
+from sqlalchemy import bindparam, func, select
 
-from app.services.db import db_conn, questions
-from app.services.confusion_score import compute_confusion
+from app.services.db import backfill_checkpoints, db_conn, dialect_insert, questions
+from app.services.confusion_model import confusion_model
+from app.services.confusion_rollups import upsert_rollups
+from app.services.confusion_score import compute_confusion_batch
 
 
-def _fetch_questions(batch_size: int = 200, last_id: Optional[int] = None) -> List[Tuple[int, str]]:
+logger = logging.getLogger(__name__)
+
+CONFUSION_JOB = "confusion"
+BACKFILL_BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "2000"))
+BACKFILL_WORKERS = int(os.getenv("BACKFILL_WORKERS", str(max(1, (os.cpu_count() or 2) - 1))))
+
+
+def _fetch_questions(
+    batch_size: int = 200,
+    last_id: Optional[int] = None,
+    max_id: Optional[int] = None,
+) -> List[Dict]:
     with db_conn() as conn:
         stmt = select(questions.c.id, questions.c.question)
         if last_id is not None:
             stmt = stmt.where(questions.c.id > last_id)
+        if max_id is not None:
+            stmt = stmt.where(questions.c.id <= max_id)
         stmt = stmt.order_by(questions.c.id.asc()).limit(batch_size)
         rows = conn.execute(stmt).fetchall()
-    return [(r[0], r[1]) for r in rows]
+    return [dict(r._mapping) for r in rows]
+
+
+def _write_scores(conn, batch: List[Dict], scores: List[float]) -> None:
+    # Read the current scores inside this transaction: the page was fetched
+    # a while ago and rows may since have been archived or rescored. The
+    # no-op UPDATE locks the rows (and takes SQLite's write lock) so nothing
+    # can change them between this read and the write below.
+    current = {
+        r.id: r
+        for r in conn.execute(
+            questions.update()
+            .where(questions.c.id.in_([q["id"] for q in batch]))
+            .values(confusion=questions.c.confusion)
+            .returning(
+                questions.c.id,
+                questions.c.course_id,
+                questions.c.lecture_id,
+                questions.c.timestamp,
+                questions.c.confusion,
+            )
+        )
+    }
+    live = [(current[q["id"]], score) for q, score in zip(batch, scores) if q["id"] in current]
+    if not live:
+        return
+    conn.execute(
+        questions.update()
+        .where(questions.c.id == bindparam("b_id"))
+        .values(confusion=bindparam("b_confusion")),
+        [{"b_id": row.id, "b_confusion": score} for row, score in live],
+    )
+    # Move the rollups by the change in score; the counts stay the same.
+    upsert_rollups(
+        conn,
+        [
+            {
+                "course_id": row.course_id,
+                "lecture_id": row.lecture_id,
+                "timestamp": row.timestamp,
+                "count": 0,
+                "confusion": score - row.confusion,
+            }
+            for row, score in live
+        ],
+    )
 
 
 def backfill_confusion(batch_size: int = 200, last_id: Optional[int] = None) -> Tuple[int, Optional[int]]:
@@ -25,16 +94,223 @@ def backfill_confusion(batch_size: int = 200, last_id: Optional[int] = None) ->
     if not batch:
         return 0, last_id
 
-    rows = []
-    for qid, text in batch:
-        rows.append({"b_id": qid, "b_confusion": compute_confusion(text)})
+    # Don't write heuristic scores just because the model is still training.
+    confusion_model.get(wait=True)
+    scores = compute_confusion_batch([q["question"] for q in batch])
 
     with db_conn() as conn:
-        conn.execute(
-            questions.update()
-            .where(questions.c.id == bindparam("b_id"))
-            .values(confusion=bindparam("b_confusion")),
-            rows,
+        _write_scores(conn, batch, scores)
+
+    return len(batch), batch[-1]["id"]
+
+
+def _init_worker() -> None:
+    # Ctrl-C goes to the whole process group; let the parent stop cleanly.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _score_texts(texts: List[str]) -> List[float]:
+    # Runs in pool workers: each loads the model once, on its first batch.
+    confusion_model.get(wait=True)
+    return compute_confusion_batch(texts)
+
+
+def load_checkpoint(job: str = CONFUSION_JOB) -> Optional[Dict]:
+    with db_conn() as conn:
+        row = conn.execute(
+            select(backfill_checkpoints).where(backfill_checkpoints.c.job == job)
+        ).first()
+    return dict(row._mapping) if row is not None else None
+
+
+def _save_checkpoint(conn, checkpoint: Dict) -> None:
+    stmt = dialect_insert(conn, backfill_checkpoints).values(**checkpoint)
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[backfill_checkpoints.c.job],
+            set_={k: stmt.excluded[k] for k in checkpoint if k != "job"},
+        )
+    )
+
+
+@dataclass
+class BackfillProgress:
+    status: str
+    last_id: int
+    target_id: int
+    rows_done: int
+    # Rows and seconds of this run only (rows_done includes resumed runs).
+    rows_this_run: int = 0
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows_this_run / self.elapsed if self.elapsed > 0 else 0.0
+
+    def to_dict(self) -> Dict:
+        out = asdict(self)
+        out["rows_per_sec"] = round(self.rows_per_sec, 1)
+        return out
+
+
+def run_confusion_backfill(
+    batch_size: int = BACKFILL_BATCH_SIZE,
+    workers: int = BACKFILL_WORKERS,
+    restart: bool = False,
+    max_rows: Optional[int] = None,
+    stop: Optional[threading.Event] = None,
+    on_progress: Optional[Callable[[BackfillProgress], None]] = None,
+) -> BackfillProgress:
+    """
+    Rescore every question with the current confusion model.
+
+    Pages through questions by id (keyset, never OFFSET) up to the highest
+    id at the start of the run, scores pages on a process pool while the
+    next ones are fetched, and writes each page's updates together with the
+    checkpoint in one transaction. An interrupted run resumes after the last
+    committed page; a finished one starts over.
+    """
+    now = time.time()
+    ckpt = load_checkpoint(CONFUSION_JOB)
+    if restart or ckpt is None or ckpt["status"] == "done":
+        with db_conn() as conn:
+            target_id = conn.execute(select(func.max(questions.c.id))).scalar() or 0
+        ckpt = {
+            "job": CONFUSION_JOB,
+            "last_id": 0,
+            "target_id": target_id,
+            "rows_done": 0,
+            "started_at": now,
+        }
+    ckpt.update(status="running", updated_at=now)
+    with db_conn() as conn:
+        _save_checkpoint(conn, ckpt)
+
+    progress = BackfillProgress(
+        status="running",
+        last_id=ckpt["last_id"],
+        target_id=ckpt["target_id"],
+        rows_done=ckpt["rows_done"],
+    )
+    # Train/load once here so the workers all just map the same model file.
+    confusion_model.get(wait=True)
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(
+            workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+
+    t0 = time.perf_counter()
+    inflight: Deque[Tuple[List[Dict], Future]] = deque()
+    fetch_from = ckpt["last_id"]
+    exhausted = False
+    try:
+        while True:
+            stopping = (stop is not None and stop.is_set()) or (
+                max_rows is not None and progress.rows_this_run >= max_rows
+            )
+            if stopping:
+                progress.status = "stopped"
+                break
+            while not exhausted and len(inflight) < 2 * max(1, workers):
+                batch = _fetch_questions(batch_size, fetch_from, ckpt["target_id"])
+                if not batch:
+                    exhausted = True
+                    break
+                fetch_from = batch[-1]["id"]
+                texts = [q["question"] for q in batch]
+                if pool is not None:
+                    fut = pool.submit(_score_texts, texts)
+                else:
+                    fut = Future()
+                    fut.set_result(compute_confusion_batch(texts))
+                inflight.append((batch, fut))
+            if not inflight:
+                progress.status = "done"
+                break
+
+            # Write pages in id order so the checkpoint only ever moves forward.
+            batch, fut = inflight.popleft()
+            scores = fut.result()
+            ckpt.update(
+                last_id=batch[-1]["id"],
+                rows_done=ckpt["rows_done"] + len(batch),
+                updated_at=time.time(),
+            )
+            with db_conn() as conn:
+                _write_scores(conn, batch, scores)
+                _save_checkpoint(conn, ckpt)
+
+            progress.last_id = ckpt["last_id"]
+            progress.rows_done = ckpt["rows_done"]
+            progress.rows_this_run += len(batch)
+            progress.elapsed = time.perf_counter() - t0
+            if on_progress is not None:
+                on_progress(progress)
+    except Exception as e:
+        progress.status = "failed"
+        progress.error = repr(e)
+        logger.exception("confusion backfill failed")
+    finally:
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+        progress.elapsed = time.perf_counter() - t0
+        ckpt.update(status=progress.status, updated_at=time.time())
+        with db_conn() as conn:
+            _save_checkpoint(conn, ckpt)
+    return progress
+
+
+class BackfillRunner:
+    """
+    Runs run_confusion_backfill on a background thread for the admin
+    endpoints; at most one run at a time.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._progress: Optional[BackfillProgress] = None
+
+    def start(self, **kwargs) -> bool:
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            self._stop.clear()
+            self._progress = None
+            self._thread = threading.Thread(
+                target=self._run, kwargs=kwargs, name="confusion-backfill", daemon=True
+            )
+            self._thread.start()
+        return True
+
+    def stop(self, timeout: float = 30.0) -> None:
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=timeout)
+
+    def _run(self, **kwargs) -> None:
+        self._progress = run_confusion_backfill(
+            stop=self._stop, on_progress=self._set_progress, **kwargs
         )
 
-    return len(rows), batch[-1][0]
+    def _set_progress(self, progress: BackfillProgress) -> None:
+        self._progress = progress
+
+    def status(self) -> Dict:
+        running = self._thread is not None and self._thread.is_alive()
+        if self._progress is not None:
+            out = self._progress.to_dict()
+        elif running:
+            out = {"status": "starting"}
+        else:
+            out = load_checkpoint(CONFUSION_JOB) or {"status": "idle"}
+        out["running"] = running
+        return out
+
+
+confusion_backfill = BackfillRunner()
@@ -38,3 +38,31 @@ def needs_fix(answer: str, allowed_chunk_ids: Set[str]) -> bool:
     if not all_citations_valid(answer, allowed_chunk_ids):
         return True
     return False
+
+
+class StreamingCitationChecker:
+    """
+    Validates citations incrementally as an answer streams in.
+    feed() returns the citations completed by each delta as
+    (source_name, chunk_id, valid) tuples.
+    """
+    def __init__(self, allowed_chunk_ids: Set[str]):
+        self.allowed = allowed_chunk_ids
+        self.text = ""
+        self.valid: List[Tuple[str, str]] = []
+        self.invalid: List[Tuple[str, str]] = []
+        self._scan_from = 0
+
+    def feed(self, delta: str) -> List[Tuple[str, str, bool]]:
+        self.text += delta
+        found = []
+        for m in CITATION_PATTERN.finditer(self.text, self._scan_from):
+            source, cid = m.group(1).strip(), m.group(2).strip()
+            ok = cid in self.allowed
+            (self.valid if ok else self.invalid).append((source, cid))
+            found.append((source, cid, ok))
+            self._scan_from = m.end()
+        return found
+
+    def needs_fix(self) -> bool:
+        return bool(self.invalid) or not self.valid
@@ -0,0 +1,76 @@
+import re
+from typing import List, Optional
+
+from app.services.citation_guard import CITATION_PATTERN, has_any_citation
+from app.services.store import StoredChunk, course_store
+
+
+# Minimum TF-IDF similarity for a sentence to be attributed to a chunk.
+MIN_SUPPORT_SCORE = 0.08
+# Sentences with fewer words than this (e.g. "Want an example?") are left
+# uncited rather than attributed to a chunk.
+MIN_CLAIM_WORDS = 4
+
+# Sentence boundaries: after terminal punctuation (unless a citation follows
+# it) or after a closing citation that ends a sentence.
+_SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+(?!\[)|(?<=\])\s+(?=[A-Z0-9*\-])")
+_TRAILING_PUNCT = re.compile(r"([.!?:;]+[\"')]*)\s*$")
+
+
+def split_sentences(line: str) -> List[str]:
+    return [p for p in _SENTENCE_BREAK.split(line) if p]
+
+
+def _attach(sentence: str, label: str) -> str:
+    # Put the label before the sentence's closing punctuation.
+    m = _TRAILING_PUNCT.search(sentence)
+    if m is None:
+        return f"{sentence.rstrip()} {label}"
+    return f"{sentence[:m.start()].rstrip()} {label}{m.group(1)}"
+
+
+def repair_citations(
+    answer: str,
+    course_id: str,
+    hits: List[StoredChunk],
+    lecture_id: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Deterministic, local citation repair. Valid citations are kept; invalid
+    ones are dropped, and every uncited claim sentence gets the label of its
+    most similar retrieved chunk (TF-IDF, same vocabulary as retrieval).
+    Returns None if nothing in the answer could be attributed to a chunk.
+    """
+    if not hits or not answer.strip():
+        return None
+    allowed = {h.chunk_id for h in hits}
+
+    # Line breaks always end a sentence, so bullets and lists keep their shape.
+    lines = [split_sentences(line) for line in answer.split("\n")]
+    sentences = [s for line in lines for s in line]
+
+    cleaned, todo = [], []
+    for s in sentences:
+        kept = [m for m in CITATION_PATTERN.finditer(s) if m.group(2).strip() in allowed]
+        text = CITATION_PATTERN.sub(lambda m: m.group(0) if m.group(2).strip() in allowed else "", s)
+        text = re.sub(r"[ \t]+([.!?,;:])", r"\1", re.sub(r"[ \t]{2,}", " ", text)).rstrip()
+        if not kept and len(re.findall(r"\w+", text)) >= MIN_CLAIM_WORDS:
+            todo.append(len(cleaned))
+        cleaned.append(text)
+
+    if todo:
+        sims = course_store.similarity(
+            course_id, [cleaned[i] for i in todo], hits, lecture_id=lecture_id
+        )
+        for row, i in enumerate(todo):
+            best = int(sims[row].argmax())
+            if sims[row, best] >= MIN_SUPPORT_SCORE:
+                h = hits[best]
+                cleaned[i] = _attach(cleaned[i], f"[{h.source_name} | {h.chunk_id}]")
+
+    out_lines, pos = [], 0
+    for line in lines:
+        out_lines.append(" ".join(cleaned[pos:pos + len(line)]))
+        pos += len(line)
+    repaired = "\n".join(out_lines)
+    return repaired if has_any_citation(repaired) else None
@@ -1,14 +1,29 @@
-import os
-import pickle
+import logging
+import threading
+import time
 from pathlib import Path
-from typing import Optional, Tuple, List
+from typing import Optional, Sequence, Tuple, List
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import LogisticRegression
+import numpy as np
+
+from app.services.hashed_text_model import (
+    DEFAULT_N_FEATURES,
+    HashedLinearModel,
+    hash_features,
+    smooth_idf,
+    tfidf_rows,
+)
 
 
 _BACKEND_DIR = Path(__file__).resolve().parents[2]
-MODEL_PATH = _BACKEND_DIR / "data" / "confusion_model.pkl"
+# Flat arrays (see hashed_text_model); the old pickle is no longer read.
+MODEL_PATH = _BACKEND_DIR / "data" / "confusion_model.npz"
+N_FEATURES = DEFAULT_N_FEATURES
+
+logger = logging.getLogger(__name__)
+
+# After a failed training attempt, wait this long before trying again.
+TRAIN_RETRY_SECONDS = 60.0
 
 
 def _build_synthetic_dataset() -> Tuple[List[str], List[int]]:
@@ -57,52 +72,131 @@ def _build_synthetic_dataset() -> Tuple[List[str], List[int]]:
     return texts, labels
 
 
-def _train_model() -> Tuple[TfidfVectorizer, LogisticRegression]:
+def _train_model() -> HashedLinearModel:
+    from scipy.sparse import csr_matrix
+    from sklearn.linear_model import LogisticRegression
+
     texts, labels = _build_synthetic_dataset()
-    vec = TfidfVectorizer(ngram_range=(1, 2), stop_words="english", max_features=8000)
-    X = vec.fit_transform(texts)
+    rows, cols, counts = hash_features(texts, N_FEATURES)
+    idf = smooth_idf(cols, len(texts), N_FEATURES)
+    values = tfidf_rows(rows, cols, counts, idf, len(texts))
+    X = csr_matrix((values, (rows, cols)), shape=(len(texts), N_FEATURES))
     clf = LogisticRegression(max_iter=1000)
     clf.fit(X, labels)
-    return vec, clf
+    return HashedLinearModel(idf, clf.coef_[0].astype(np.float32), clf.intercept_[0])
 
 
-def _save_model(vec: TfidfVectorizer, clf: LogisticRegression) -> None:
-    os.makedirs(MODEL_PATH.parent, exist_ok=True)
-    with open(MODEL_PATH, "wb") as f:
-        pickle.dump({"vectorizer": vec, "model": clf}, f)
+def _save_model(model: HashedLinearModel) -> None:
+    model.save(MODEL_PATH)
 
 
-def _load_model() -> Optional[Tuple[TfidfVectorizer, LogisticRegression]]:
+def _load_model() -> Optional[HashedLinearModel]:
     if not MODEL_PATH.exists():
         return None
     try:
-        with open(MODEL_PATH, "rb") as f:
-            data = pickle.load(f)
-        return data["vectorizer"], data["model"]
+        return HashedLinearModel.load(MODEL_PATH)
     except Exception:
+        logger.exception("loading %s failed", MODEL_PATH)
         return None
 
 
-def load_or_train_model() -> Optional[Tuple[TfidfVectorizer, LogisticRegression]]:
+def load_or_train_model() -> Optional[HashedLinearModel]:
     loaded = _load_model()
     if loaded is not None:
         return loaded
     try:
-        vec, clf = _train_model()
-        _save_model(vec, clf)
-        return vec, clf
+        model = _train_model()
+        _save_model(model)
+        return model
     except Exception:
+        logger.exception("training confusion model failed")
         return None
 
 
+def _mtime() -> Optional[Tuple[int, int]]:
+    # Every save replaces the file, so the inode changes even when two
+    # workers publish within the filesystem's mtime resolution.
+    try:
+        st = MODEL_PATH.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_ino
+
+
+class ConfusionModel:
+    """
+    Process-wide confusion model. Loaded lazily on first use and reloaded
+    when the model file's mtime changes; a missing model is trained on a
+    background thread while callers fall back to the heuristic.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._model: Optional[HashedLinearModel] = None
+        self._mtime: Optional[Tuple[int, int]] = None
+        self._trainer: Optional[threading.Thread] = None
+        self._retry_at = 0.0
+
+    def get(self, wait: bool = False) -> Optional[HashedLinearModel]:
+        """
+        Current model, or None while it's being trained. With
+        wait=True, block until training finishes instead.
+        """
+        mtime = _mtime()
+        if mtime is not None and mtime == self._mtime:
+            return self._model
+
+        with self._lock:
+            if mtime is not None and mtime != self._mtime:
+                loaded = _load_model()
+                if loaded is not None:
+                    self._model, self._mtime = loaded, mtime
+                    return self._model
+            idle = self._trainer is None or not self._trainer.is_alive()
+            if self._model is None and idle and time.monotonic() >= self._retry_at:
+                self._trainer = threading.Thread(target=self._train, name="confusion-train", daemon=True)
+                self._trainer.start()
+            trainer = self._trainer if self._model is None else None
+
+        if wait and trainer is not None:
+            trainer.join()
+        return self._model
+
+    def publish(self, model: HashedLinearModel) -> None:
+        """
+        Atomically replace the model file and swap the new model in, without
+        waiting for the mtime check.
+        """
+        with self._lock:
+            _save_model(model)
+            self._model, self._mtime = model, _mtime()
+
+    def _train(self) -> None:
+        model = load_or_train_model()
+        if model is None:
+            self._retry_at = time.monotonic() + TRAIN_RETRY_SECONDS
+            return
+        with self._lock:
+            self._model, self._mtime = model, _mtime()
+
+
+confusion_model = ConfusionModel()
+
+
 def predict_confusion(question: str) -> Optional[float]:
     """
     Returns confusion probability (0..1) if model available, else None.
     """
-    model = load_or_train_model()
+    model = confusion_model.get()
+    if model is None:
+        return None
+    return float(model.predict_proba([question])[0])
+
+
+def predict_confusion_batch(questions: Sequence[str]) -> Optional[np.ndarray]:
+    """
+    predict_confusion over many questions in one vectorized pass.
+    """
+    model = confusion_model.get()
     if model is None:
         return None
-    vec, clf = model
-    X = vec.transform([question])
-    proba = clf.predict_proba(X)[0][1]
-    return float(proba)
+    return model.predict_proba(questions)
@@ -0,0 +1,133 @@
+"""
+Confusion trend rollups: (course, lecture, resolution, bucket_start) ->
+(count, confusion_sum), kept in step with the questions table by every path
+that writes it (question inserts, confusion rescoring, archiving).
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from app.services.db import CONFUSION_ROLLUP_KEY, confusion_rollups, db_conn, dialect_insert
+
+
+# Bucket sizes in seconds: 15s, 1m, 5m, 1h.
+ROLLUP_RESOLUTIONS = (15, 60, 300, 3600)
+
+
+def resolution_for(bucket_minutes: float) -> Optional[int]:
+    """
+    The rollup resolution matching a bucket size, or None if there isn't one.
+    """
+    seconds = bucket_minutes * 60
+    for r in ROLLUP_RESOLUTIONS:
+        if abs(seconds - r) < 1e-6:
+            return r
+    return None
+
+
+def upsert_rollups(conn, items: Iterable[Dict], sign: int = 1) -> None:
+    """
+    Add questions (course_id, lecture_id, timestamp, confusion) to every
+    resolution's buckets; sign=-1 takes them out again. An item may carry
+    "count" (default 1), e.g. count 0 with a confusion delta for a rescore.
+    """
+    agg: Dict[Tuple, List[float]] = {}
+    for item in items:
+        count = item.get("count", 1)
+        for r in ROLLUP_RESOLUTIONS:
+            key = (item["course_id"], item.get("lecture_id"), r, int(item["timestamp"] // r) * r)
+            acc = agg.setdefault(key, [0, 0.0])
+            acc[0] += sign * count
+            acc[1] += sign * item["confusion"]
+    if not agg:
+        return
+    stmt = dialect_insert(conn, confusion_rollups).values(
+        [
+            {
+                "course_id": course_id,
+                "lecture_id": lecture_id,
+                "resolution": r,
+                "bucket_start": start,
+                "count": count,
+                "confusion_sum": total,
+            }
+            for (course_id, lecture_id, r, start), (count, total) in agg.items()
+        ]
+    )
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=list(CONFUSION_ROLLUP_KEY),
+            set_={
+                "count": confusion_rollups.c.count + stmt.excluded.count,
+                "confusion_sum": confusion_rollups.c.confusion_sum + stmt.excluded.confusion_sum,
+            },
+        )
+    )
+    if sign < 0:
+        conn.execute(confusion_rollups.delete().where(confusion_rollups.c.count <= 0))
+
+
+def _bucket_query(course_id: str, lecture_id: Optional[str], resolution: int):
+    count = func.sum(confusion_rollups.c.count).label("count")
+    stmt = (
+        select(
+            confusion_rollups.c.bucket_start,
+            count,
+            func.sum(confusion_rollups.c.confusion_sum).label("confusion_sum"),
+        )
+        .where(confusion_rollups.c.course_id == course_id)
+        .where(confusion_rollups.c.resolution == resolution)
+        .group_by(confusion_rollups.c.bucket_start)
+        .having(count > 0)
+    )
+    if lecture_id:
+        # Same expression as the unique key, so the lookup can use it.
+        stmt = stmt.where(CONFUSION_ROLLUP_KEY[1] == lecture_id)
+    return stmt
+
+
+def _point(bucket_start: int, count: int, confusion_sum: float) -> Dict:
+    # Same shape as confusion_trend.compute_confusion_trend.
+    return {
+        "time": datetime.fromtimestamp(bucket_start).isoformat(),
+        "avg_confusion": round(confusion_sum / count, 3),
+        "count": int(count),
+    }
+
+
+def rollup_trend(
+    course_id: str,
+    lecture_id: Optional[str] = None,
+    resolution: int = 60,
+    since: Optional[float] = None,
+    last: Optional[int] = None,
+) -> List[Dict]:
+    """
+    Trend points from the rollups, oldest first: buckets from since on,
+    and/or only the last `last` non-empty buckets.
+    """
+    stmt = _bucket_query(course_id, lecture_id, resolution)
+    if since is not None:
+        stmt = stmt.where(confusion_rollups.c.bucket_start >= int(since // resolution) * resolution)
+    if last is not None:
+        stmt = stmt.order_by(confusion_rollups.c.bucket_start.desc()).limit(last)
+    else:
+        stmt = stmt.order_by(confusion_rollups.c.bucket_start.asc())
+    with db_conn() as conn:
+        rows = conn.execute(stmt).fetchall()
+    if last is not None:
+        rows = rows[::-1]
+    return [_point(*r) for r in rows]
+
+
+def rollup_totals(course_id: str, lecture_id: Optional[str] = None, resolution: int = 60) -> Tuple[int, int]:
+    """
+    (number of questions, number of non-empty buckets at resolution).
+    """
+    buckets = _bucket_query(course_id, lecture_id, resolution).subquery()
+    with db_conn() as conn:
+        total, n = conn.execute(
+            select(func.coalesce(func.sum(buckets.c.count), 0), func.count()).select_from(buckets)
+        ).first()
+    return int(total), int(n)
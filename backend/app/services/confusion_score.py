@@ -1,6 +1,9 @@
-from typing import Dict
+import re
+from typing import List, Sequence
 
-from app.services.confusion_model import predict_confusion
+import numpy as np
+
+from app.services.confusion_model import predict_confusion_batch
 
 CONFUSION_KEYWORDS = [
     "why",
@@ -14,27 +17,44 @@ CONFUSION_KEYWORDS = [
     "help"
 ]
 
-def compute_confusion(question: str) -> float:
-    """
-    Returns a confusion score between 0 and 1.
-    Uses ML model if available; falls back to heuristic.
-    """
-    model_score = predict_confusion(question)
-    if model_score is not None:
-        return max(0.0, min(model_score, 1.0))
-
-    q = question.lower()
-    score = 0.0
+def _heuristic_batch(questions: Sequence[str]) -> np.ndarray:
+    lowered = [q.lower() for q in questions]
+    lengths = np.fromiter(map(len, lowered), dtype=np.int64, count=len(lowered))
+    # Search one newline-joined string per keyword instead of every question,
+    # then map match offsets back to question indices.
+    text = "\n".join(lowered)
+    starts = np.concatenate(([0], np.cumsum(lengths[:-1] + 1)))
+    score = np.zeros(len(lowered))
 
     # Keyword-based signal
     for kw in CONFUSION_KEYWORDS:
-        if kw in q:
-            score += 0.15
+        hits = [m.start() for m in re.finditer(re.escape(kw), text)]
+        if hits:
+            rows = np.searchsorted(starts, hits, side="right") - 1
+            score[np.unique(rows)] += 0.15
 
     # Length-based signal
-    if len(q) > 80:
-        score += 0.2
-    if len(q) > 120:
-        score += 0.2
+    score += 0.2 * (lengths > 80) + 0.2 * (lengths > 120)
+
+    return np.minimum(score, 1.0)
+
 
-    return min(score, 1.0)
+def compute_confusion_batch(questions: Sequence[str]) -> List[float]:
+    """
+    Confusion scores (0..1) for many questions at once: one model call over
+    the whole batch, or the keyword/length heuristic as array operations.
+    """
+    if len(questions) == 0:
+        return []
+    scores = predict_confusion_batch(questions)
+    if scores is None:
+        scores = _heuristic_batch(questions)
+    return np.clip(scores, 0.0, 1.0).tolist()
+
+
+def compute_confusion(question: str) -> float:
+    """
+    Returns a confusion score between 0 and 1.
+    Uses ML model if available; falls back to heuristic.
+    """
+    return compute_confusion_batch([question])[0]
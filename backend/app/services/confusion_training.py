@@ -0,0 +1,256 @@
+"""
+Online updates of the confusion model from labelled questions.
+
+Labels are stored in confusion_labels and folded into the live model in id
+order by mini-batch SGD (HashedLinearModel.partial_fit). Each update is a
+new model version: it is checkpointed under data/confusion_models/ and then
+published over MODEL_PATH with os.replace, so scoring never stops and never
+sees a half-written model. The model file records the last label id it has
+absorbed, so a freshly trained model replays every stored label.
+
+Every worker runs a trainer, but a file lock next to MODEL_PATH lets only
+one of them update the model at a time, always starting from the latest
+published version.
+"""
+import fcntl
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import func, select
+
+from app.services.confusion_model import MODEL_PATH, confusion_model
+from app.services.db import confusion_labels, db_conn, questions
+from app.services.hashed_text_model import HashedLinearModel
+
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DIR = MODEL_PATH.parent / "confusion_models"
+TRAIN_LOCK_PATH = MODEL_PATH.with_name(MODEL_PATH.name + ".lock")
+# Keep this many versioned checkpoints for rollback/inspection.
+CHECKPOINT_KEEP = int(os.getenv("CONFUSION_CHECKPOINT_KEEP", "10"))
+TRAIN_BATCH_SIZE = int(os.getenv("CONFUSION_TRAIN_BATCH_SIZE", "64"))
+TRAIN_INTERVAL_SECONDS = float(os.getenv("CONFUSION_TRAIN_INTERVAL_SECONDS", "30"))
+LEARNING_RATE = float(os.getenv("CONFUSION_LEARNING_RATE", "0.3"))
+L2_ALPHA = float(os.getenv("CONFUSION_L2_ALPHA", "1e-4"))
+PUBLISH_EVERY_BATCHES = 20
+
+# Students labelling their own questions are noisier than instructors.
+LABEL_WEIGHTS = {"instructor": 1.0, "student": 0.5}
+
+
+def add_label(
+    course_id: str,
+    label: bool,
+    source: str,
+    question: Optional[str] = None,
+    question_id: Optional[int] = None,
+    lecture_id: Optional[str] = None,
+    user_id: Optional[str] = None,
+) -> int:
+    """
+    Store a label for question text or a stored question (question_id) and
+    wake the trainer. Returns the label id.
+    """
+    if source not in LABEL_WEIGHTS:
+        raise ValueError(f"Unknown label source: {source}")
+    with db_conn() as conn:
+        if question_id is not None:
+            row = conn.execute(
+                select(questions.c.question, questions.c.lecture_id)
+                .where(questions.c.id == question_id)
+                .where(questions.c.course_id == course_id)
+            ).first()
+            if row is None:
+                raise ValueError(f"Unknown question id: {question_id}")
+            question = row[0]
+            lecture_id = lecture_id if lecture_id is not None else row[1]
+        if not question or not question.strip():
+            raise ValueError("question or question_id is required")
+        label_id = conn.execute(
+            confusion_labels.insert().values(
+                course_id=course_id,
+                lecture_id=lecture_id,
+                user_id=user_id,
+                question_id=question_id,
+                question=question,
+                label=1 if label else 0,
+                source=source,
+                created_at=time.time(),
+            )
+        ).inserted_primary_key[0]
+    online_trainer.notify()
+    return label_id
+
+
+def _fetch_labels(after_id: int, limit: int) -> List[Dict]:
+    with db_conn() as conn:
+        rows = conn.execute(
+            select(
+                confusion_labels.c.id,
+                confusion_labels.c.question,
+                confusion_labels.c.label,
+                confusion_labels.c.source,
+            )
+            .where(confusion_labels.c.id > after_id)
+            .order_by(confusion_labels.c.id.asc())
+            .limit(limit)
+        ).fetchall()
+    return [dict(r._mapping) for r in rows]
+
+
+def _checkpoint_path(version: int) -> Path:
+    return CHECKPOINT_DIR / f"confusion_model-v{version:06d}.npz"
+
+
+def list_checkpoints() -> List[str]:
+    if not CHECKPOINT_DIR.exists():
+        return []
+    return sorted(p.name for p in CHECKPOINT_DIR.glob("confusion_model-v*.npz"))
+
+
+def _prune_checkpoints() -> None:
+    for name in list_checkpoints()[:-CHECKPOINT_KEEP]:
+        try:
+            (CHECKPOINT_DIR / name).unlink()
+        except OSError:
+            pass
+
+
+@contextmanager
+def _training_lock() -> Iterator[bool]:
+    """
+    Cross-process lock on the model: yields True if this process holds it,
+    False if another process is training right now.
+    """
+    os.makedirs(TRAIN_LOCK_PATH.parent, exist_ok=True)
+    with open(TRAIN_LOCK_PATH, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class OnlineTrainer:
+    """
+    Background thread that folds new labels into the model: on notify() (or
+    every TRAIN_INTERVAL_SECONDS) it applies pending labels in mini-batches.
+    """
+    def __init__(self, interval: float = TRAIN_INTERVAL_SECONDS, batch_size: int = TRAIN_BATCH_SIZE):
+        self._interval = interval
+        self._batch_size = batch_size
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        # Serializes updates so two can't both build on the same version.
+        self._train_lock = threading.Lock()
+        self._last_trained_at: Optional[float] = None
+
+    def start(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="confusion-online", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=30)
+            self._thread = None
+
+    def notify(self) -> None:
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self._interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            try:
+                self.train_pending()
+            except Exception:
+                logger.exception("online confusion training failed")
+
+    def _publish(self, model: HashedLinearModel) -> None:
+        model.save(_checkpoint_path(model.version))
+        confusion_model.publish(model)
+
+    def train_pending(self) -> int:
+        """
+        Apply labels newer than the live model's trained_through. Returns
+        the number of labels applied; 0 if another worker is training (it
+        picks up new labels as it goes, and any left over are applied on
+        the next tick).
+        """
+        applied = 0
+        with self._train_lock, _training_lock() as held:
+            if not held:
+                return 0
+            # Under the lock the file is the latest version; get() reloads it
+            # if another worker published since we last looked.
+            model = confusion_model.get(wait=True)
+            if model is None:
+                return 0
+            published = model
+            batches = 0
+            while True:
+                labels = _fetch_labels(model.trained_through, self._batch_size)
+                if not labels:
+                    break
+                model = model.partial_fit(
+                    [l["question"] for l in labels],
+                    [l["label"] for l in labels],
+                    weights=[LABEL_WEIGHTS.get(l["source"], 1.0) for l in labels],
+                    learning_rate=LEARNING_RATE,
+                    alpha=L2_ALPHA,
+                    trained_through=labels[-1]["id"],
+                )
+                applied += len(labels)
+                batches += 1
+                # A long replay still publishes progress as it goes.
+                if batches % PUBLISH_EVERY_BATCHES == 0:
+                    self._publish(model)
+                    published = model
+            if model is not published:
+                self._publish(model)
+            if applied:
+                self._last_trained_at = time.time()
+                _prune_checkpoints()
+                logger.info("confusion model v%d: applied %d labels", model.version, applied)
+        return applied
+
+    def status(self) -> Dict:
+        model = confusion_model.get()
+        with db_conn() as conn:
+            total = conn.execute(select(func.count()).select_from(confusion_labels)).scalar()
+            pending = 0
+            if model is not None:
+                pending = conn.execute(
+                    select(func.count())
+                    .select_from(confusion_labels)
+                    .where(confusion_labels.c.id > model.trained_through)
+                ).scalar()
+        return {
+            "version": model.version if model is not None else None,
+            "trained_through": model.trained_through if model is not None else None,
+            "labels": total,
+            "pending": pending,
+            "last_trained_at": self._last_trained_at,
+            "checkpoints": list_checkpoints(),
+        }
+
+
+online_trainer = OnlineTrainer()
@@ -0,0 +1,196 @@
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from app.services.db import prompt_log
+from app.services.store import StoredChunk
+from app.services.write_behind import write_behind
+
+
+# Tokens available for course context + conversation memory in one prompt.
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "2500"))
+# At most this share of the budget goes to conversation memory.
+MEMORY_BUDGET_SHARE = float(os.getenv("PROMPT_MEMORY_SHARE", "0.25"))
+# Each remembered turn is cut to this many tokens (long previous answers).
+MAX_TURN_TOKENS = int(os.getenv("PROMPT_MAX_TURN_TOKENS", "200"))
+MAX_TURNS = 6
+# A chunk is only truncated to fit if at least this many tokens remain.
+MIN_CHUNK_TOKENS = 48
+# chunking.chunk_text overlaps consecutive chunks by this many characters.
+CHUNK_OVERLAP_CHARS = 80
+
+_encoder = None
+_encoder_loaded = False
+_encoder_lock = threading.Lock()
+
+
+def _get_encoder():
+    """
+    tiktoken encoder for the chat model, or None if tiktoken isn't
+    installed or its encoding can't be loaded (it downloads on first use).
+    """
+    global _encoder, _encoder_loaded
+    if _encoder_loaded:
+        return _encoder
+    with _encoder_lock:
+        if not _encoder_loaded:
+            try:
+                import tiktoken
+
+                _encoder = tiktoken.encoding_for_model("gpt-4o-mini")
+            except Exception:
+                _encoder = None
+            _encoder_loaded = True
+    return _encoder
+
+
+def warm_encoder() -> None:
+    # Loading can take seconds (and may download); do it at startup rather
+    # than on the first request.
+    _get_encoder()
+
+
+def count_tokens(text: str) -> int:
+    enc = _get_encoder()
+    if enc is None:
+        # ~4 characters per token for English text
+        return math.ceil(len(text) / 4)
+    return len(enc.encode(text))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    if max_tokens <= 0:
+        return ""
+    enc = _get_encoder()
+    if enc is None:
+        if len(text) <= max_tokens * 4:
+            return text
+        return text[:max_tokens * 4].rstrip() + "…"
+    ids = enc.encode(text)
+    if len(ids) <= max_tokens:
+        return text
+    return enc.decode(ids[:max_tokens]).rstrip() + "…"
+
+
+def _trim_overlap(text: str, neighbours: List[str], max_overlap: int = CHUNK_OVERLAP_CHARS) -> str:
+    """
+    Drop text repeated from an adjacent chunk of the same document: a prefix
+    that another packed chunk ends with, or a suffix it starts with.
+    """
+    for other in neighbours:
+        for n in range(min(max_overlap, len(other), len(text)), 15, -1):
+            if other.endswith(text[:n]):
+                text = text[n:].lstrip()
+                break
+        for n in range(min(max_overlap, len(other), len(text)), 15, -1):
+            if other.startswith(text[-n:]):
+                text = text[:-n].rstrip()
+                break
+    return text
+
+
+@dataclass
+class PackedPrompt:
+    contexts: List[str]
+    memory_turns: List[Dict[str, str]]
+    summary: str = ""
+    context_tokens: int = 0
+    memory_tokens: int = 0
+    chunks_used: int = 0
+    chunks_dropped: int = 0
+    overlap_chars_trimmed: int = 0
+    chunk_ids: List[str] = field(default_factory=list)
+
+
+def pack_context(
+    hits: List[StoredChunk],
+    memory_turns: Optional[List[Dict[str, str]]] = None,
+    budget: int = PROMPT_TOKEN_BUDGET,
+    summary: str = "",
+) -> PackedPrompt:
+    """
+    Fill the token budget with conversation memory (the rolling summary, up
+    to half the memory share, then the newest turns, each truncated) and
+    then retrieved chunks in score order, labelled
+    "[source | chunk_id]". Chunks that don't fit are truncated if enough room
+    is left, otherwise skipped in favour of smaller, lower-ranked ones.
+    """
+    memory_budget = int(budget * MEMORY_BUDGET_SHARE)
+    kept_turns: List[Dict[str, str]] = []
+    memory_tokens = 0
+    if summary:
+        summary = truncate_tokens(summary, memory_budget // 2)
+        memory_tokens += count_tokens(summary) + 6
+    for t in reversed((memory_turns or [])[-MAX_TURNS:]):
+        content = truncate_tokens(t["content"], MAX_TURN_TOKENS)
+        # +4 for the "Role: " prefix and newline
+        n = count_tokens(content) + 4
+        if memory_tokens + n > memory_budget:
+            break
+        kept_turns.append({"role": t["role"], "content": content})
+        memory_tokens += n
+    kept_turns.reverse()
+
+    remaining = budget - memory_tokens
+    packed = PackedPrompt(
+        contexts=[],
+        memory_turns=kept_turns,
+        summary=summary,
+        memory_tokens=memory_tokens,
+    )
+    texts_by_source: Dict[str, List[str]] = {}
+    for h in hits:
+        neighbours = texts_by_source.get(h.source_name, [])
+        text = _trim_overlap(h.text, neighbours)
+        packed.overlap_chars_trimmed += len(h.text) - len(text)
+
+        label = f"[{h.source_name} | {h.chunk_id}]"
+        # +2 for the blank line between contexts
+        n = count_tokens(label) + count_tokens(text) + 2
+        if n > remaining:
+            room = remaining - count_tokens(label) - 2
+            if room < MIN_CHUNK_TOKENS:
+                packed.chunks_dropped += 1
+                continue
+            text = truncate_tokens(text, room)
+            n = count_tokens(label) + count_tokens(text) + 2
+
+        packed.contexts.append(f"{label}\n{text}")
+        packed.chunk_ids.append(h.chunk_id)
+        texts_by_source.setdefault(h.source_name, []).append(h.text)
+        packed.context_tokens += n
+        packed.chunks_used += 1
+        remaining -= n
+    return packed
+
+
+def _insert_prompt_log(conn, items: List[Dict]) -> None:
+    conn.execute(prompt_log.insert(), items)
+
+
+def record_prompt(
+    course_id: str,
+    lecture_id: Optional[str],
+    endpoint: str,
+    packed: PackedPrompt,
+    messages: List[Dict[str, str]],
+) -> None:
+    prompt = "\n".join(m["content"] for m in messages)
+    write_behind.submit(
+        _insert_prompt_log,
+        {
+            "course_id": course_id,
+            "lecture_id": lecture_id,
+            "endpoint": endpoint,
+            "prompt_chars": len(prompt),
+            "prompt_tokens": count_tokens(prompt),
+            "context_tokens": packed.context_tokens,
+            "memory_tokens": packed.memory_tokens,
+            "chunks_used": packed.chunks_used,
+            "chunks_dropped": packed.chunks_dropped,
+            "timestamp": time.time(),
+        },
+    )
@@ -33,3 +33,29 @@ def embed_texts(
         return [d.embedding for d in resp.data]
     except Exception:
         return None
+
+
+def embed_texts_batched(
+    texts: List[str],
+    model: str = DEFAULT_EMBEDDING_MODEL,
+    batch_size: int = 256,
+) -> List[Optional[List[float]]]:
+    """
+    Embed a large list in request-sized batches.
+    Returns one entry per input; entries are None where a batch failed
+    (backfill_embeddings picks those up later).
+    """
+    out: List[Optional[List[float]]] = []
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+        vectors = embed_texts(batch, model=model)
+        if vectors is None:
+            out.extend([None] * len(batch))
+        else:
+            out.extend(vectors)
+    return out
+
+
+def embed_query(text: str, model: str = DEFAULT_EMBEDDING_MODEL) -> Optional[List[float]]:
+    vectors = embed_texts([text], model=model)
+    return vectors[0] if vectors else None
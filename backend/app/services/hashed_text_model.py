@@ -0,0 +1,212 @@
+"""
+Pickle-free linear text classifier: hashed n-gram features, IDF weights and
+logistic-regression coefficients stored as flat arrays in an uncompressed
+.npz, memory-mapped on load and scored with NumPy alone.
+"""
+import os
+import re
+import struct
+import zipfile
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+FORMAT_VERSION = 1
+DEFAULT_N_FEATURES = 2 ** 18
+
+# Same tokens as sklearn's default token_pattern.
+_TOKEN = re.compile(r"(?u)\b\w\w+\b")
+
+
+def tokenize(text: str, ngram_range: Tuple[int, int] = (1, 2)) -> List[str]:
+    words = _TOKEN.findall(text.lower())
+    lo, hi = ngram_range
+    grams = []
+    for n in range(lo, hi + 1):
+        grams.extend(" ".join(words[i:i + n]) for i in range(len(words) - n + 1))
+    return grams
+
+
+def hash_features(
+    texts: Sequence[str],
+    n_features: int = DEFAULT_N_FEATURES,
+    ngram_range: Tuple[int, int] = (1, 2),
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Term counts of hashed n-grams as COO triplets (rows, cols, counts), one
+    entry per distinct (text, bucket). n_features must be a power of two.
+    """
+    mask = n_features - 1
+    rows: List[int] = []
+    cols: List[int] = []
+    for i, text in enumerate(texts):
+        for g in tokenize(text, ngram_range):
+            rows.append(i)
+            cols.append(zlib.crc32(g.encode("utf-8")) & mask)
+    if not rows:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0, np.float32)
+    keys = np.asarray(rows, np.int64) * n_features + np.asarray(cols, np.int64)
+    keys, counts = np.unique(keys, return_counts=True)
+    return keys // n_features, keys % n_features, counts.astype(np.float32)
+
+
+def smooth_idf(cols: np.ndarray, n_docs: int, n_features: int) -> np.ndarray:
+    # cols holds one entry per (doc, bucket), so bincount is document frequency.
+    df = np.bincount(cols, minlength=n_features)
+    return (np.log((1.0 + n_docs) / (1.0 + df)) + 1.0).astype(np.float32)
+
+
+def tfidf_rows(
+    rows: np.ndarray, cols: np.ndarray, counts: np.ndarray, idf: np.ndarray, n_rows: int
+) -> np.ndarray:
+    """
+    L2-normalised TF-IDF values aligned with (rows, cols).
+    """
+    w = counts * idf[cols]
+    norms = np.sqrt(np.bincount(rows, weights=w * w, minlength=n_rows))
+    return w / np.maximum(norms[rows], 1e-12)
+
+
+def _mmap_npz(path: Path) -> Dict[str, np.ndarray]:
+    """
+    np.load ignores mmap_mode for .npz; stored (uncompressed) members are
+    plain .npy files inside the zip, so map each one at its data offset.
+    """
+    arrays: Dict[str, np.ndarray] = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else info.filename
+            if info.compress_type != zipfile.ZIP_STORED:
+                with zf.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member)
+                continue
+            f.seek(info.header_offset)
+            name_len, extra_len = struct.unpack("<HH", f.read(30)[26:30])
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            arrays[name] = np.memmap(
+                path, dtype=dtype, mode="r", offset=f.tell(), shape=shape, order="F" if fortran else "C"
+            )
+    return arrays
+
+
+class HashedLinearModel:
+    def __init__(
+        self,
+        idf: np.ndarray,
+        coef: np.ndarray,
+        intercept: float,
+        ngram_range: Tuple[int, int] = (1, 2),
+        version: int = 0,
+        trained_through: int = 0,
+    ):
+        self.idf = idf
+        self.coef = coef
+        self.intercept = float(intercept)
+        self.ngram_range = ngram_range
+        self.version = version
+        # Id of the last labelled example folded in by partial_fit.
+        self.trained_through = trained_through
+
+    @property
+    def n_features(self) -> int:
+        return len(self.coef)
+
+    def features(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (rows, cols, tfidf values) for texts.
+        """
+        rows, cols, counts = hash_features(texts, self.n_features, self.ngram_range)
+        return rows, cols, tfidf_rows(rows, cols, counts, self.idf, len(texts))
+
+    def decision_function(self, texts: Sequence[str]) -> np.ndarray:
+        rows, cols, values = self.features(texts)
+        dots = np.bincount(rows, weights=values * self.coef[cols], minlength=len(texts))
+        return dots + self.intercept
+
+    def predict_proba(self, texts: Sequence[str]) -> np.ndarray:
+        """
+        Probability of the positive class for each text.
+        """
+        return 1.0 / (1.0 + np.exp(-self.decision_function(texts)))
+
+    def partial_fit(
+        self,
+        texts: Sequence[str],
+        labels: Sequence[int],
+        weights: Optional[Sequence[float]] = None,
+        learning_rate: float = 0.3,
+        alpha: float = 1e-4,
+        trained_through: Optional[int] = None,
+    ) -> "HashedLinearModel":
+        """
+        One SGD step on the logistic loss over a mini-batch, returned as a
+        new model (version + 1); this one is left untouched, so it can keep
+        serving while the update is computed. L2 decay is applied lazily to
+        the touched features only, and the intercept moves at 1% of the rate
+        as in sklearn's SGDClassifier on sparse input.
+        """
+        n = len(texts)
+        y = np.asarray(labels, dtype=np.float64)
+        w = np.ones(n) if weights is None else np.asarray(weights, dtype=np.float64)
+        rows, cols, values = self.features(texts)
+        # Copy: the live coefficients may be a read-only memmap.
+        coef = np.array(self.coef, dtype=np.float32)
+
+        z = np.bincount(rows, weights=values * coef[cols], minlength=n) + self.intercept
+        g = (1.0 / (1.0 + np.exp(-z)) - y) * w
+        touched = np.unique(cols)
+        coef[touched] *= 1.0 - learning_rate * alpha
+        np.add.at(coef, cols, (-learning_rate * g[rows] * values).astype(np.float32))
+        intercept = self.intercept - 0.01 * learning_rate * float(g.sum())
+
+        return HashedLinearModel(
+            self.idf,
+            coef,
+            intercept,
+            self.ngram_range,
+            version=self.version + 1,
+            trained_through=self.trained_through if trained_through is None else trained_through,
+        )
+
+    def save(self, path: Path) -> None:
+        # Uncompressed so load() can memory-map it; written then renamed so
+        # readers never see a partial file. The temp name is per process, as
+        # several workers may save the initial model at once.
+        os.makedirs(path.parent, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                spec=np.array([FORMAT_VERSION, self.n_features, *self.ngram_range], dtype=np.int64),
+                idf=np.asarray(self.idf, dtype=np.float32),
+                coef=np.asarray(self.coef, dtype=np.float32),
+                intercept=np.array([self.intercept], dtype=np.float64),
+                state=np.array([self.version, self.trained_through], dtype=np.int64),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "HashedLinearModel":
+        arrays = _mmap_npz(path)
+        version, n_features, lo, hi = (int(x) for x in arrays["spec"])
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported model format version {version}")
+        if len(arrays["coef"]) != n_features or len(arrays["idf"]) != n_features:
+            raise ValueError("Model arrays don't match the feature spec")
+        state = arrays.get("state", (0, 0))
+        version, trained_through = (int(x) for x in state)
+        return cls(
+            arrays["idf"],
+            arrays["coef"],
+            float(arrays["intercept"][0]),
+            (lo, hi),
+            version=version,
+            trained_through=trained_through,
+        )
@@ -1,38 +1,56 @@
+import asyncio
 import os
-from typing import List, Optional, Dict
+from typing import AsyncIterator, List, Optional, Dict
+
+from app.services.llm_gateway import gateway, request_key
+
+MODEL = "gpt-4o-mini"
+
 
 def has_openai_key() -> bool:
     return bool(os.getenv("OPENAI_API_KEY"))
 
-def generate_answer_with_openai(
-    question: str,
-    contexts: List[str],
-    mode: str,
-    memory_turns: Optional[List[Dict[str, str]]] = None,
-) -> Optional[str]:
+
+_async_client = None
+_async_client_loop = None
+
+
+def _get_async_client():
     """
-    Returns a generated answer string if OpenAI is configured.
-    Returns None if not configured (so we can fall back).
+    One AsyncOpenAI client per event loop, so its connection pool is reused
+    across requests. Returns None if OpenAI isn't configured or installed.
     """
+    global _async_client, _async_client_loop
     if not has_openai_key():
         return None
-
-    # Import inside the function so the app still runs even if openai isn't installed
     try:
-        from openai import OpenAI
+        from openai import AsyncOpenAI
     except Exception:
         return None
 
-    client = OpenAI()
+    loop = asyncio.get_running_loop()
+    if _async_client is None or _async_client_loop is not loop:
+        _async_client = AsyncOpenAI()
+        _async_client_loop = loop
+    return _async_client
+
 
-    # Keep context short-ish for now (MVP). We’ll improve later.
-    context_block = "\n\n".join(contexts[:4])
-    memory_block = ""
-    if memory_turns:
-        lines = []
-        for t in memory_turns[-6:]:
-            lines.append(f"{t['role'].capitalize()}: {t['content']}")
-        memory_block = "\n".join(lines)
+def answer_messages(
+    question: str,
+    contexts: List[str],
+    mode: str,
+    memory_turns: Optional[List[Dict[str, str]]] = None,
+    summary: Optional[str] = None,
+) -> List[Dict[str, str]]:
+    # contexts and memory_turns arrive already packed to the token budget
+    # (see context_packer.pack_context).
+    context_block = "\n\n".join(contexts)
+    lines = []
+    if summary:
+        lines.append(f"Summary of earlier conversation:\n{summary}")
+    for t in memory_turns or []:
+        lines.append(f"{t['role'].capitalize()}: {t['content']}")
+    memory_block = "\n".join(lines)
 
     system = (
     "You are an academic tutor.\n"
@@ -62,79 +80,186 @@ def generate_answer_with_openai(
     "Important: Put citations at the end of each sentence that depends on the context.\n"
     )
 
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
 
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": user},
-        ],
-        temperature=0.2,
+def _fix_messages(original_answer: str, contexts: List[str]) -> List[Dict[str, str]]:
+    context_block = "\n\n".join(contexts)
+
+    system = (
+        "You are a strict editor.\n"
+        "Rewrite the answer so that EVERY sentence includes an inline citation in this exact format: [source_name | chunk_id].\n"
+        "You MUST ONLY use citations that appear in the provided COURSE CONTEXT labels.\n"
+        "Do not introduce any new facts that aren't supported by the context.\n"
+        "Keep the meaning the same but make it properly cited."
     )
 
-    return resp.choices[0].message.content
+    user = (
+        f"COURSE CONTEXT (with allowed citation labels):\n{context_block}\n\n"
+        f"ORIGINAL ANSWER:\n{original_answer}\n\n"
+        "Return ONLY the corrected answer text."
+    )
 
-def fix_citations_with_openai(original_answer: str, contexts: List[str]) -> Optional[str]:
-    """
-    Ask the LLM to rewrite the answer so that every sentence has valid citations.
-    Returns None if OpenAI not configured.
-    """
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+
+
+def _complete(messages: List[Dict[str, str]], temperature: float) -> Optional[str]:
     if not has_openai_key():
         return None
 
+    # Import inside the function so the app still runs even if openai isn't installed
     try:
         from openai import OpenAI
     except Exception:
         return None
 
-    try:
+    def call() -> str:
         client = OpenAI()
-    except Exception:
-        return None
+        resp = client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=temperature,
+        )
+        return resp.choices[0].message.content
 
-    context_block = "\n\n".join(contexts[:4])
+    return gateway.run_sync(request_key(MODEL, messages, temperature), call)
 
-    system = (
-        "You are a strict editor.\n"
-        "Rewrite the answer so that EVERY sentence includes an inline citation in this exact format: [source_name | chunk_id].\n"
-        "You MUST ONLY use citations that appear in the provided COURSE CONTEXT labels.\n"
-        "Do not introduce any new facts that aren't supported by the context.\n"
-        "Keep the meaning the same but make it properly cited."
-    )
 
-    user = (
-        f"COURSE CONTEXT (with allowed citation labels):\n{context_block}\n\n"
-        f"ORIGINAL ANSWER:\n{original_answer}\n\n"
-        "Return ONLY the corrected answer text."
-    )
+async def _complete_async(messages: List[Dict[str, str]], temperature: float) -> Optional[str]:
+    client = _get_async_client()
+    if client is None:
+        return None
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": user},
-        ],
-        temperature=0.0,
-    )
+    async def call() -> str:
+        resp = await client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            temperature=temperature,
+        )
+        return resp.choices[0].message.content
 
-    return resp.choices[0].message.content
+    return await gateway.run(request_key(MODEL, messages, temperature), call)
 
 
-def generate_recommendations_with_openai(
-    cluster_summary: str,
+def generate_answer_with_openai(
+    question: str,
     contexts: List[str],
+    mode: str,
+    memory_turns: Optional[List[Dict[str, str]]] = None,
+    summary: Optional[str] = None,
 ) -> Optional[str]:
-    if not has_openai_key():
+    """
+    Returns a generated answer string if OpenAI is configured.
+    Returns None if not configured (so we can fall back), or if the
+    gateway gave up on the call.
+    """
+    return _complete(answer_messages(question, contexts, mode, memory_turns, summary), 0.2)
+
+
+async def generate_answer_async(
+    question: str,
+    contexts: List[str],
+    mode: str,
+    memory_turns: Optional[List[Dict[str, str]]] = None,
+    summary: Optional[str] = None,
+) -> Optional[str]:
+    """
+    Async variant of generate_answer_with_openai: the request awaits the
+    provider without holding a worker thread.
+    """
+    return await _complete_async(answer_messages(question, contexts, mode, memory_turns, summary), 0.2)
+
+
+async def stream_answer_async(
+    question: str,
+    contexts: List[str],
+    mode: str,
+    memory_turns: Optional[List[Dict[str, str]]] = None,
+    summary: Optional[str] = None,
+) -> Optional[AsyncIterator[str]]:
+    """
+    Streams the answer as text deltas. Returns None if OpenAI isn't
+    configured, like generate_answer_async, or if the stream doesn't open
+    within the gateway deadline. Streams aren't coalesced or hedged.
+    """
+    client = _get_async_client()
+    if client is None:
         return None
 
     try:
-        from openai import OpenAI
-    except Exception:
+        stream = await asyncio.wait_for(
+            client.chat.completions.create(
+                model=MODEL,
+                messages=answer_messages(question, contexts, mode, memory_turns, summary),
+                temperature=0.2,
+                stream=True,
+            ),
+            gateway.deadline,
+        )
+    except asyncio.TimeoutError:
         return None
 
-    client = OpenAI()
-    context_block = "\n\n".join(contexts[:4])
+    async def _deltas() -> AsyncIterator[str]:
+        try:
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            # Also on cancellation or an early aclose(): drop the connection.
+            await stream.close()
+
+    return _deltas()
+
+
+def fix_citations_with_openai(original_answer: str, contexts: List[str]) -> Optional[str]:
+    """
+    Ask the LLM to rewrite the answer so that every sentence has valid citations.
+    Returns None if OpenAI not configured.
+    """
+    return _complete(_fix_messages(original_answer, contexts), 0.0)
+
+
+async def fix_citations_async(original_answer: str, contexts: List[str]) -> Optional[str]:
+    return await _complete_async(_fix_messages(original_answer, contexts), 0.0)
+
+
+def summary_messages(previous_summary: str, turns: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    transcript = "\n".join(f"{t['role'].capitalize()}: {t['content']}" for t in turns)
+
+    system = (
+        "You maintain a running summary of a tutoring conversation.\n"
+        "Merge the new turns into the existing summary.\n"
+        "Keep what the student asked, what was explained, and what still confuses them.\n"
+        "Drop citations, examples and wording details. At most 8 short bullet points."
+    )
+
+    user = (
+        f"EXISTING SUMMARY:\n{previous_summary or '(none)'}\n\n"
+        f"NEW TURNS:\n{transcript}\n\n"
+        "Return ONLY the updated summary."
+    )
+
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
+
+
+def summarize_conversation_with_openai(
+    previous_summary: str,
+    turns: List[Dict[str, str]],
+) -> Optional[str]:
+    return _complete(summary_messages(previous_summary, turns), 0.0)
+
+
+def recommendation_messages(cluster_summary: str, contexts: List[str]) -> List[Dict[str, str]]:
+    context_block = "\n\n".join(contexts)
 
     system = (
         "You are an expert teaching assistant.\n"
@@ -150,13 +275,14 @@ def generate_recommendations_with_openai(
         "Return recommendations as short bullet points."
     )
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": user},
-        ],
-        temperature=0.2,
-    )
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user},
+    ]
 
-    return resp.choices[0].message.content
+
+def generate_recommendations_with_openai(
+    cluster_summary: str,
+    contexts: List[str],
+) -> Optional[str]:
+    return _complete(recommendation_messages(cluster_summary, contexts), 0.2)
@@ -0,0 +1,248 @@
+"""
+Gateway between app.services.llm and the provider.
+
+- Single-flight: identical requests (same model, messages, temperature)
+  already in flight are coalesced into one upstream call.
+- Hedging (optional): if an attempt hasn't finished after the observed p95
+  latency, a duplicate is sent and whichever finishes first wins.
+- Deadlines: a caller waits at most LLM_DEADLINE_SECONDS and then gets None,
+  which the callers already treat as "fall back to the template answer".
+  Provider errors are treated the same way.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeout
+from concurrent.futures import wait as futures_wait
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "30"))
+LLM_HEDGE = os.getenv("LLM_HEDGE", "0").lower() in ("1", "true", "yes")
+# Never hedge sooner than this, and only once enough latencies are known.
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_GATEWAY_THREADS = int(os.getenv("LLM_GATEWAY_THREADS", "32"))
+
+
+def request_key(model: str, messages: List[Dict[str, str]], temperature: float) -> str:
+    payload = json.dumps([model, messages, temperature], sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMGateway:
+    def __init__(
+        self,
+        deadline: float = LLM_DEADLINE_SECONDS,
+        hedge: bool = LLM_HEDGE,
+        hedge_min_delay: float = LLM_HEDGE_MIN_DELAY,
+        hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        threads: int = LLM_GATEWAY_THREADS,
+    ):
+        self.deadline = deadline
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self._threads = threads
+        self._latencies: Deque[float] = deque(maxlen=500)
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self._inflight_sync: Dict[str, Future] = {}
+        # Separate pools so a leader waiting on its attempts can't starve them.
+        self._leaders: Optional[ThreadPoolExecutor] = None
+        self._attempts: Optional[ThreadPoolExecutor] = None
+        self._stats = {
+            "calls": 0,
+            "upstream": 0,
+            "coalesced": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "deadline_exceeded": 0,
+            "errors": 0,
+        }
+
+    # -- latency tracking ---------------------------------------------------
+
+    def _hedge_delay(self) -> Optional[float]:
+        if not self.hedge:
+            return None
+        with self._lock:
+            if len(self._latencies) < self.hedge_min_samples:
+                return None
+            ordered = sorted(self._latencies)
+        p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+        return max(self.hedge_min_delay, p95)
+
+    def _observe(self, seconds: float) -> None:
+        with self._lock:
+            self._latencies.append(seconds)
+            self._stats["upstream"] += 1
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            out = dict(self._stats)
+            ordered = sorted(self._latencies)
+        if ordered:
+            out["p50_ms"] = round(1000 * ordered[len(ordered) // 2], 1)
+            out["p95_ms"] = round(1000 * ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))], 1)
+        out["hedge_enabled"] = self.hedge
+        out["deadline_seconds"] = self.deadline
+        return out
+
+    # -- async --------------------------------------------------------------
+
+    async def run(self, key: str, call: Callable[[], Awaitable[str]]) -> Optional[str]:
+        """
+        Await call() through the gateway. Returns None on deadline or error.
+        """
+        self._count("calls")
+        task = self._inflight.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self._count("coalesced")
+        else:
+            task = asyncio.ensure_future(self._hedged(call))
+            self._inflight[key] = task
+            self._waiters[key] = 0
+            task.add_done_callback(lambda t: self._forget(key, t))
+        self._waiters[key] += 1
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), self.deadline)
+        except asyncio.TimeoutError:
+            self._count("deadline_exceeded")
+            logger.warning("LLM call exceeded %.1fs deadline", self.deadline)
+            return None
+        except Exception:
+            self._count("errors")
+            logger.exception("LLM call failed")
+            return None
+        finally:
+            if self._inflight.get(key) is task:
+                self._waiters[key] -= 1
+                # Nobody is waiting any more: stop paying for the upstream call.
+                if self._waiters[key] <= 0 and not task.done():
+                    task.cancel()
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+            self._waiters.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # mark retrieved; waiters already logged it
+
+    async def _timed(self, call: Callable[[], Awaitable[str]]) -> str:
+        t0 = time.perf_counter()
+        result = await call()
+        self._observe(time.perf_counter() - t0)
+        return result
+
+    async def _hedged(self, call: Callable[[], Awaitable[str]]) -> str:
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._timed(call)
+
+        first = asyncio.ensure_future(self._timed(call))
+        done, _ = await asyncio.wait({first}, timeout=delay)
+        if done:
+            return first.result()
+
+        self._count("hedged")
+        second = asyncio.ensure_future(self._timed(call))
+        pending = {first, second}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for t in done:
+                    if t.exception() is None:
+                        if t is second:
+                            self._count("hedge_wins")
+                        return t.result()
+            return first.result()  # both failed: raise the first error
+        finally:
+            for t in pending:
+                t.cancel()
+
+    # -- sync ---------------------------------------------------------------
+
+    def _pools(self) -> Tuple[ThreadPoolExecutor, ThreadPoolExecutor]:
+        with self._lock:
+            if self._leaders is None:
+                self._leaders = ThreadPoolExecutor(self._threads, thread_name_prefix="llm-leader")
+                self._attempts = ThreadPoolExecutor(self._threads, thread_name_prefix="llm-attempt")
+            return self._leaders, self._attempts
+
+    def run_sync(self, key: str, call: Callable[[], str]) -> Optional[str]:
+        """
+        Blocking counterpart of run() for the sync code paths.
+        """
+        leaders, _ = self._pools()
+        with self._lock:
+            self._stats["calls"] += 1
+            fut = self._inflight_sync.get(key)
+            if fut is None:
+                fut = leaders.submit(self._hedged_sync, call)
+                self._inflight_sync[key] = fut
+                fut.add_done_callback(lambda f: self._forget_sync(key, f))
+            else:
+                self._stats["coalesced"] += 1
+
+        try:
+            return fut.result(timeout=self.deadline)
+        except FuturesTimeout:
+            self._count("deadline_exceeded")
+            logger.warning("LLM call exceeded %.1fs deadline", self.deadline)
+            return None
+        except Exception:
+            self._count("errors")
+            logger.exception("LLM call failed")
+            return None
+
+    def _forget_sync(self, key: str, fut: Future) -> None:
+        with self._lock:
+            if self._inflight_sync.get(key) is fut:
+                del self._inflight_sync[key]
+
+    def _timed_sync(self, call: Callable[[], str]) -> str:
+        t0 = time.perf_counter()
+        result = call()
+        self._observe(time.perf_counter() - t0)
+        return result
+
+    def _hedged_sync(self, call: Callable[[], str]) -> str:
+        _, attempts = self._pools()
+        delay = self._hedge_delay()
+        if delay is None:
+            return self._timed_sync(call)
+
+        first = attempts.submit(self._timed_sync, call)
+        done, _ = futures_wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        # A thread can't be cancelled once running; the loser just finishes.
+        self._count("hedged")
+        second = attempts.submit(self._timed_sync, call)
+        pending = {first, second}
+        while pending:
+            done, pending = futures_wait(pending, return_when=FIRST_COMPLETED)
+            for f in done:
+                if f.exception() is None:
+                    if f is second:
+                        self._count("hedge_wins")
+                    return f.result()
+        return first.result()
+
+
+gateway = LLMGateway()
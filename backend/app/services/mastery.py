@@ -1,11 +1,11 @@
 import re
 import time
-from typing import List, Optional
+from typing import Dict, List, Optional
 
-from sqlalchemy import select
 from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
 
-from app.services.db import db_conn, ensure_course, ensure_lecture, student_concepts
+from app.services.db import STUDENT_CONCEPT_KEY, dialect_insert, student_concepts
+from app.services.write_behind import write_behind
 
 
 _TOKEN_RE = re.compile(r"[a-zA-Z]{3,}")
@@ -29,6 +29,47 @@ def extract_concepts(texts: List[str], max_terms: int = 6) -> List[str]:
     return [w for w, _ in ranked[:max_terms]]
 
 
+def _apply_mastery(conn, items: List[dict], max_rows: int = 1000) -> None:
+    """
+    One multi-row upsert for every (student, concept) touched by the batch.
+    Repeats within the batch are merged first, since one statement may not
+    update the same row twice.
+    """
+    merged: Dict[tuple, dict] = {}
+    for item in items:
+        for concept in item["concepts"]:
+            key = (item["course_id"], item["user_id"], item["lecture_id"], concept)
+            row = merged.get(key)
+            if row is None:
+                merged[key] = {
+                    "course_id": item["course_id"],
+                    "lecture_id": item["lecture_id"],
+                    "user_id": item["user_id"],
+                    "concept": concept,
+                    "count": 1,
+                    "confusion_sum": item["confusion"],
+                    "last_updated": item["timestamp"],
+                }
+            else:
+                row["count"] += 1
+                row["confusion_sum"] += item["confusion"]
+                row["last_updated"] = max(row["last_updated"], item["timestamp"])
+
+    rows = list(merged.values())
+    for start in range(0, len(rows), max_rows):
+        stmt = dialect_insert(conn, student_concepts).values(rows[start:start + max_rows])
+        conn.execute(
+            stmt.on_conflict_do_update(
+                index_elements=list(STUDENT_CONCEPT_KEY),
+                set_={
+                    "count": student_concepts.c.count + stmt.excluded.count,
+                    "confusion_sum": student_concepts.c.confusion_sum + stmt.excluded.confusion_sum,
+                    "last_updated": stmt.excluded.last_updated,
+                },
+            )
+        )
+
+
 def update_student_mastery(
     course_id: str,
     user_id: str,
@@ -39,45 +80,14 @@ def update_student_mastery(
     if not concepts:
         return
 
-    with db_conn() as conn:
-        ensure_course(conn, course_id)
-        ensure_lecture(conn, course_id, lecture_id)
-
-        for concept in concepts:
-            row = conn.execute(
-                select(
-                    student_concepts.c.id,
-                    student_concepts.c.count,
-                    student_concepts.c.confusion_sum,
-                )
-                .where(student_concepts.c.course_id == course_id)
-                .where(student_concepts.c.user_id == user_id)
-                .where(student_concepts.c.concept == concept)
-                .where(student_concepts.c.lecture_id == lecture_id)
-            ).first()
-
-            now = time.time()
-            if row is None:
-                conn.execute(
-                    student_concepts.insert().values(
-                        course_id=course_id,
-                        lecture_id=lecture_id,
-                        user_id=user_id,
-                        concept=concept,
-                        count=1,
-                        confusion_sum=confusion,
-                        last_updated=now,
-                    )
-                )
-            else:
-                new_count = int(row[1]) + 1
-                new_sum = float(row[2]) + confusion
-                conn.execute(
-                    student_concepts.update()
-                    .where(student_concepts.c.id == row[0])
-                    .values(
-                        count=new_count,
-                        confusion_sum=new_sum,
-                        last_updated=now,
-                    )
-                )
+    write_behind.submit(
+        _apply_mastery,
+        {
+            "course_id": course_id,
+            "lecture_id": lecture_id,
+            "user_id": user_id,
+            "concepts": concepts,
+            "confusion": confusion,
+            "timestamp": time.time(),
+        },
+    )
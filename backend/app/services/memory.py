@@ -1,9 +1,202 @@
+import os
+import threading
 import time
-from typing import List, Optional, Dict
+from collections import OrderedDict, deque
+from typing import Deque, List, Optional, Dict, Tuple
 
-from sqlalchemy import select
+from sqlalchemy import func, select
 
-from app.services.db import db_conn, ensure_course, ensure_lecture, conversation_turns
+from app.services.db import db_conn, conversation_summaries, conversation_turns
+from app.services.summaries import SUMMARY_MIN_TURNS, Summarizer, load_summary, summarize, upsert_summaries
+from app.services.write_behind import write_behind
+
+
+MAX_TURNS = 6
+# Turns sent to the prompt verbatim; older ones reach it via the summary.
+VERBATIM_TURNS = int(os.getenv("MEMORY_VERBATIM_TURNS", "2"))
+# Conversations kept in memory; least recently used ones are dropped and
+# reloaded from the DB on their next turn.
+MAX_BUFFERED_CONVERSATIONS = int(os.getenv("MEMORY_MAX_CONVERSATIONS", "50000"))
+# Turns past max_turns are only evicted once the summary covers them; if
+# summarizing falls this far behind, the oldest go anyway.
+MAX_UNSUMMARIZED_FACTOR = 4
+# Check the DB for turns written by other workers before serving memory.
+# Off by default, so a chat turn reads memory without a DB round-trip; turn
+# it on for multi-worker deployments that don't pin each conversation to
+# one worker (sticky sessions).
+MEMORY_CHECK_DB = os.getenv("MEMORY_CHECK_DB", "0") == "1"
+
+Key = Tuple[str, str, Optional[str]]
+
+
+class _Conversation:
+    def __init__(
+        self,
+        turns: List[Dict],
+        max_turns: int,
+        summary: str = "",
+        covered_until: float = 0.0,
+    ):
+        # Turns carry their timestamp so the summary can track what it covers.
+        self.turns: Deque[Dict] = deque(turns)
+        self.max_turns = max_turns
+        self.since_trim = 0
+        self.summary = summary
+        self.covered_until = covered_until
+
+    def evict(self) -> None:
+        """
+        Drop the oldest turns beyond max_turns that the summary already
+        covers, so no turn leaves memory before it has been summarized.
+        """
+        hard_cap = self.max_turns * MAX_UNSUMMARIZED_FACTOR
+        while len(self.turns) > self.max_turns and (
+            self.turns[0]["timestamp"] <= self.covered_until or len(self.turns) > hard_cap
+        ):
+            self.turns.popleft()
+
+    def unsummarized(self) -> List[Dict]:
+        """
+        Turns that have left the verbatim window but aren't in the summary yet.
+        """
+        older = list(self.turns)[:-VERBATIM_TURNS] if VERBATIM_TURNS else list(self.turns)
+        return [t for t in older if t["timestamp"] > self.covered_until]
+
+
+# Per-(course, user, lecture) ring buffers, written through to the DB.
+# Each process serves memory from its own buffers; with MEMORY_CHECK_DB,
+# reads first check the newest stored turn and merge in any that other
+# workers wrote.
+_conversations: "OrderedDict[Key, _Conversation]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _key_filter(stmt, course_id: str, user_id: str, lecture_id: Optional[str]):
+    return (
+        stmt.where(conversation_turns.c.course_id == course_id)
+        .where(conversation_turns.c.user_id == user_id)
+        .where(conversation_turns.c.lecture_id == lecture_id)
+    )
+
+
+def _load_turns(course_id: str, user_id: str, lecture_id: Optional[str], limit: int) -> List[Dict]:
+    with db_conn() as conn:
+        stmt = _key_filter(
+            select(conversation_turns.c.role, conversation_turns.c.content, conversation_turns.c.timestamp),
+            course_id,
+            user_id,
+            lecture_id,
+        ).order_by(conversation_turns.c.id.desc()).limit(limit)
+        rows = conn.execute(stmt).fetchall()
+
+    # Return in chronological order
+    rows.reverse()
+    return [{"role": r[0], "content": r[1], "timestamp": r[2]} for r in rows]
+
+
+def _conversation(course_id: str, user_id: str, lecture_id: Optional[str], max_turns: int) -> _Conversation:
+    key = (course_id, user_id, lecture_id)
+    with _lock:
+        conv = _conversations.get(key)
+        if conv is not None:
+            _conversations.move_to_end(key)
+            return conv
+
+    # The DB also keeps turns the summary doesn't cover yet; evict() drops
+    # the covered ones beyond max_turns.
+    turns = _load_turns(course_id, user_id, lecture_id, max_turns * MAX_UNSUMMARIZED_FACTOR)
+    summary, covered_until = load_summary(course_id, user_id, lecture_id)
+    with _lock:
+        conv = _conversations.get(key)
+        if conv is None:
+            conv = _Conversation(turns, max_turns, summary, covered_until)
+            conv.evict()
+            _conversations[key] = conv
+            while len(_conversations) > MAX_BUFFERED_CONVERSATIONS:
+                _conversations.popitem(last=False)
+        return conv
+
+
+def _newest_stored(course_id: str, user_id: str, lecture_id: Optional[str]) -> Optional[float]:
+    with db_conn() as conn:
+        return conn.execute(
+            _key_filter(select(func.max(conversation_turns.c.timestamp)), course_id, user_id, lecture_id)
+        ).scalar()
+
+
+def _current(
+    course_id: str,
+    user_id: str,
+    lecture_id: Optional[str],
+    check_db: bool = MEMORY_CHECK_DB,
+) -> _Conversation:
+    """
+    The buffered conversation; with check_db, first merged with any newer
+    turns (and a newer summary) that another worker has stored.
+    """
+    conv = _conversation(course_id, user_id, lecture_id, MAX_TURNS)
+    if not check_db:
+        return conv
+    newest = _newest_stored(course_id, user_id, lecture_id)
+    with _lock:
+        mine = conv.turns[-1]["timestamp"] if conv.turns else 0.0
+    # Our own unflushed writes can only make the DB look older, never newer.
+    if newest is None or newest <= mine:
+        return conv
+
+    turns = _load_turns(course_id, user_id, lecture_id, conv.max_turns * MAX_UNSUMMARIZED_FACTOR)
+    summary, covered_until = load_summary(course_id, user_id, lecture_id)
+    with _lock:
+        seen = {(t["timestamp"], t["role"], t["content"]) for t in conv.turns}
+        merged = list(conv.turns) + [
+            t for t in turns if (t["timestamp"], t["role"], t["content"]) not in seen
+        ]
+        merged.sort(key=lambda t: t["timestamp"])
+        conv.turns = deque(merged)
+        if covered_until > conv.covered_until:
+            conv.summary = summary
+            conv.covered_until = covered_until
+        conv.evict()
+    return conv
+
+
+def _insert_turns(conn, items: List[Dict]) -> None:
+    conn.execute(
+        conversation_turns.insert(),
+        [
+            {k: v for k, v in item.items() if k not in ("max_turns", "trim")}
+            for item in items
+        ],
+    )
+
+    # Amortized trim: one range delete per conversation every max_turns
+    # inserts, keeping rows newer than the max_turns-th most recent id and
+    # any the stored summary doesn't cover yet.
+    trimmed = set()
+    for item in items:
+        key = (item["course_id"], item["user_id"], item["lecture_id"])
+        if not item["trim"] or key in trimmed:
+            continue
+        trimmed.add(key)
+        cutoff = (
+            _key_filter(select(conversation_turns.c.id), *key)
+            .order_by(conversation_turns.c.id.desc())
+            .offset(item["max_turns"] - 1)
+            .limit(1)
+            .scalar_subquery()
+        )
+        covered_until = (
+            select(conversation_summaries.c.covered_until)
+            .where(conversation_summaries.c.course_id == key[0])
+            .where(conversation_summaries.c.user_id == key[1])
+            .where(conversation_summaries.c.lecture_id == key[2])
+            .scalar_subquery()
+        )
+        conn.execute(
+            _key_filter(conversation_turns.delete(), *key)
+            .where(conversation_turns.c.id < cutoff)
+            .where(conversation_turns.c.timestamp <= func.coalesce(covered_until, 0.0))
+        )
 
 
 def add_turn(
@@ -12,36 +205,35 @@ def add_turn(
     role: str,
     content: str,
     lecture_id: Optional[str] = None,
-    max_turns: int = 6,
+    max_turns: int = MAX_TURNS,
 ) -> None:
-    with db_conn() as conn:
-        ensure_course(conn, course_id)
-        ensure_lecture(conn, course_id, lecture_id)
-        conn.execute(
-            conversation_turns.insert().values(
-                course_id=course_id,
-                lecture_id=lecture_id,
-                user_id=user_id,
-                role=role,
-                content=content,
-                timestamp=time.time(),
-            )
-        )
+    conv = _conversation(course_id, user_id, lecture_id, max_turns)
+    now = time.time()
+    with _lock:
+        conv.turns.append({"role": role, "content": content, "timestamp": now})
+        conv.evict()
+        conv.since_trim += 1
+        trim = conv.since_trim >= max_turns
+        if trim:
+            conv.since_trim = 0
+        fold = len(conv.unsummarized()) >= SUMMARY_MIN_TURNS
 
-        # Keep only the most recent max_turns per user/course/lecture.
-        stmt = (
-            select(conversation_turns.c.id)
-            .where(conversation_turns.c.course_id == course_id)
-            .where(conversation_turns.c.user_id == user_id)
-            .where(conversation_turns.c.lecture_id == lecture_id)
-            .order_by(conversation_turns.c.timestamp.desc())
-            .offset(max_turns)
-        )
-        old_ids = [r[0] for r in conn.execute(stmt).fetchall()]
-        if old_ids:
-            conn.execute(
-                conversation_turns.delete().where(conversation_turns.c.id.in_(old_ids))
-            )
+    if fold:
+        summarizer.submit((course_id, user_id, lecture_id))
+
+    write_behind.submit(
+        _insert_turns,
+        {
+            "course_id": course_id,
+            "lecture_id": lecture_id,
+            "user_id": user_id,
+            "role": role,
+            "content": content,
+            "timestamp": now,
+            "max_turns": max_turns,
+            "trim": trim,
+        },
+    )
 
 
 def get_recent_turns(
@@ -50,20 +242,73 @@ def get_recent_turns(
     lecture_id: Optional[str] = None,
     limit: int = 6,
 ) -> List[Dict[str, str]]:
-    with db_conn() as conn:
-        stmt = (
-            select(
-                conversation_turns.c.role,
-                conversation_turns.c.content,
-            )
-            .where(conversation_turns.c.course_id == course_id)
-            .where(conversation_turns.c.user_id == user_id)
-            .where(conversation_turns.c.lecture_id == lecture_id)
-            .order_by(conversation_turns.c.timestamp.desc())
-            .limit(limit)
-        )
-        rows = conn.execute(stmt).fetchall()
+    if limit > MAX_TURNS:
+        return _load_turns(course_id, user_id, lecture_id, limit)
 
-    # Return in chronological order
-    rows.reverse()
-    return [{"role": r[0], "content": r[1]} for r in rows]
+    conv = _current(course_id, user_id, lecture_id)
+    with _lock:
+        turns = list(conv.turns)
+    return [{"role": t["role"], "content": t["content"]} for t in turns[-limit:]]
+
+
+def get_memory(
+    course_id: str,
+    user_id: str,
+    lecture_id: Optional[str] = None,
+    check_db: bool = MEMORY_CHECK_DB,
+) -> Tuple[str, List[Dict[str, str]]]:
+    """
+    Prompt memory: (rolling summary, recent turns). Recent turns are the last
+    VERBATIM_TURNS plus any older ones the summarizer hasn't folded in yet.
+    """
+    conv = _current(course_id, user_id, lecture_id, check_db)
+    with _lock:
+        recent = conv.unsummarized() + list(conv.turns)[-VERBATIM_TURNS:] if VERBATIM_TURNS else conv.unsummarized()
+        summary = conv.summary
+    return summary, [{"role": t["role"], "content": t["content"]} for t in recent]
+
+
+def _fold_summary(key: Key, llm: bool = True) -> None:
+    """
+    Fold the turns that left the verbatim window into the rolling summary.
+    Runs on a summarizer worker; the LLM call happens outside the lock.
+    """
+    with _lock:
+        conv = _conversations.get(key)
+        if conv is None:
+            return
+        todo = conv.unsummarized()
+        previous = conv.summary
+    if not todo:
+        return
+
+    summary = summarize(previous, todo, llm=llm)
+    covered_until = todo[-1]["timestamp"]
+    with _lock:
+        if conv.summary != previous or conv.covered_until >= covered_until:
+            # Another worker folded this conversation meanwhile; retry on top.
+            retry = True
+        else:
+            conv.summary = summary
+            conv.covered_until = covered_until
+            conv.evict()
+            retry = False
+    if retry:
+        summarizer.submit(key)
+        return
+
+    course_id, user_id, lecture_id = key
+    write_behind.submit(
+        upsert_summaries,
+        {
+            "course_id": course_id,
+            "lecture_id": lecture_id,
+            "user_id": user_id,
+            "summary": summary,
+            "covered_until": covered_until,
+            "updated_at": time.time(),
+        },
+    )
+
+
+summarizer = Summarizer(_fold_summary)
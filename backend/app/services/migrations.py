@@ -0,0 +1,174 @@
+"""
+Versioned schema migrations.
+
+metadata.create_all() builds fresh databases with the current schema; the
+migrations below bring databases created by older versions up to date.
+Each one runs once in its own transaction and is recorded in
+schema_migrations. They must stay idempotent, since on a fresh database
+create_all() has already done most of the work.
+"""
+import time
+from typing import Callable, List, Tuple
+
+from sqlalchemy import inspect, select, text
+
+from app.services.db import insert_ignore, schema_migrations
+
+
+# Arbitrary key for the PostgreSQL advisory lock held while migrating.
+_LOCK_KEY = 4242001
+
+
+def _add_column(conn, table_name: str, column_name: str, column_type: str) -> None:
+    existing = {c["name"] for c in inspect(conn).get_columns(table_name)}
+    if column_name in existing:
+        return
+    conn.execute(
+        text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type}")
+    )
+
+
+def _create_index(conn, name: str, table_name: str, columns: str, unique: bool = False) -> None:
+    # Raw DDL rather than the Index objects on the tables, so a migration
+    # keeps doing what it did even after the table definitions move on.
+    conn.execute(
+        text(
+            f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS "
+            f"{name} ON {table_name} ({columns})"
+        )
+    )
+
+
+def _m1_lecture_columns(conn) -> None:
+    _add_column(conn, "documents", "lecture_id", "TEXT")
+    _add_column(conn, "questions", "lecture_id", "TEXT")
+
+
+def _m2_chunk_content_hash(conn) -> None:
+    _add_column(conn, "chunks", "content_hash", "TEXT")
+
+
+def _m3_hot_path_indexes(conn) -> None:
+    _create_index(conn, "ix_documents_course_lecture_source", "documents", "course_id, lecture_id, source_name")
+    _create_index(conn, "ix_chunks_document_id", "chunks", "document_id")
+    _create_index(conn, "ix_questions_course_timestamp", "questions", "course_id, timestamp")
+    _create_index(conn, "ix_questions_course_lecture_timestamp", "questions", "course_id, lecture_id, timestamp")
+    _create_index(conn, "ix_student_concepts_key", "student_concepts", "course_id, user_id, lecture_id, concept")
+    _create_index(conn, "ix_conversation_turns_key", "conversation_turns", "course_id, user_id, lecture_id, timestamp")
+    _create_index(conn, "ix_alerts_course_created", "alerts", "course_id, created_at")
+
+
+def _m4_unique_student_concepts(conn) -> None:
+    # Merge duplicate concept rows left by the old SELECT-then-INSERT path.
+    dups = conn.execute(
+        text(
+            "SELECT MIN(id), SUM(count), SUM(confusion_sum), MAX(last_updated), "
+            "course_id, user_id, COALESCE(lecture_id, ''), concept "
+            "FROM student_concepts "
+            "GROUP BY course_id, user_id, COALESCE(lecture_id, ''), concept "
+            "HAVING COUNT(*) > 1"
+        )
+    ).fetchall()
+    for keep_id, count, confusion_sum, last_updated, course_id, user_id, lecture_key, concept in dups:
+        conn.execute(
+            text(
+                "DELETE FROM student_concepts WHERE course_id = :c AND user_id = :u "
+                "AND COALESCE(lecture_id, '') = :l AND concept = :k AND id != :id"
+            ),
+            {"c": course_id, "u": user_id, "l": lecture_key, "k": concept, "id": keep_id},
+        )
+        conn.execute(
+            text(
+                "UPDATE student_concepts SET count = :n, confusion_sum = :s, "
+                "last_updated = :t WHERE id = :id"
+            ),
+            {"n": count, "s": confusion_sum, "t": last_updated, "id": keep_id},
+        )
+    conn.execute(text("DROP INDEX IF EXISTS ix_student_concepts_key"))
+    _create_index(
+        conn,
+        "ux_student_concepts_key",
+        "student_concepts",
+        "course_id, user_id, coalesce(lecture_id, ''), concept",
+        unique=True,
+    )
+
+
+def _m5_confusion_rollups(conn) -> None:
+    # create_all() has made the (empty) table; fill it from the existing
+    # questions, a page at a time so memory stays bounded.
+    resolutions = (15, 60, 300, 3600)
+    conn.execute(text("DELETE FROM confusion_rollups"))
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            text(
+                "SELECT id, course_id, lecture_id, timestamp, confusion FROM questions "
+                "WHERE id > :last ORDER BY id LIMIT 10000"
+            ),
+            {"last": last_id},
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        agg = {}
+        for _, course_id, lecture_id, ts, confusion in rows:
+            for r in resolutions:
+                acc = agg.setdefault((course_id, lecture_id, r, int(ts // r) * r), [0, 0.0])
+                acc[0] += 1
+                acc[1] += confusion
+        conn.execute(
+            text(
+                "INSERT INTO confusion_rollups "
+                "(course_id, lecture_id, resolution, bucket_start, count, confusion_sum) "
+                "VALUES (:c, :l, :r, :b, :n, :s) "
+                "ON CONFLICT (course_id, coalesce(lecture_id, ''), resolution, bucket_start) "
+                "DO UPDATE SET count = confusion_rollups.count + excluded.count, "
+                "confusion_sum = confusion_rollups.confusion_sum + excluded.confusion_sum"
+            ),
+            [
+                {"c": c, "l": l, "r": r, "b": b, "n": n, "s": total}
+                for (c, l, r, b), (n, total) in agg.items()
+            ],
+        )
+
+
+MIGRATIONS: List[Tuple[int, str, Callable]] = [
+    (1, "lecture_id columns", _m1_lecture_columns),
+    (2, "chunk content hash", _m2_chunk_content_hash),
+    (3, "hot path indexes", _m3_hot_path_indexes),
+    (4, "unique student concept key", _m4_unique_student_concepts),
+    (5, "confusion rollups", _m5_confusion_rollups),
+]
+
+
+def run_migrations(engine) -> List[int]:
+    """
+    Apply pending migrations in order. Returns the versions applied.
+    """
+    with engine.begin() as conn:
+        done = {r[0] for r in conn.execute(select(schema_migrations.c.version)).fetchall()}
+
+    applied = []
+    for version, name, fn in MIGRATIONS:
+        if version in done:
+            continue
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                # Several workers may start at once; serialize and re-check.
+                conn.execute(text("SELECT pg_advisory_xact_lock(:k)"), {"k": _LOCK_KEY})
+                already = conn.execute(
+                    select(schema_migrations.c.version).where(schema_migrations.c.version == version)
+                ).first()
+                if already is not None:
+                    continue
+            fn(conn)
+            conn.execute(
+                insert_ignore(conn, schema_migrations).values(
+                    version=version,
+                    name=name,
+                    applied_at=time.time(),
+                )
+            )
+        applied.append(version)
+    return applied
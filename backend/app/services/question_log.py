@@ -3,8 +3,36 @@ import time
 
 from sqlalchemy import select
 
-from app.services.confusion_score import compute_confusion
+from app.services.confusion_rollups import upsert_rollups
+from app.services.confusion_score import compute_confusion, compute_confusion_batch
 from app.services.db import db_conn, ensure_course, ensure_lecture, questions
+from app.services.write_behind import write_behind
+
+
+def _insert_questions(conn, items: List[dict]) -> None:
+    conn.execute(questions.insert(), items)
+    upsert_rollups(conn, items)
+
+
+def record_question(
+    course_id: str,
+    user_id: str,
+    question: str,
+    confusion: float,
+    lecture_id: Optional[str] = None,
+    timestamp: Optional[float] = None,
+) -> None:
+    write_behind.submit(
+        _insert_questions,
+        {
+            "course_id": course_id,
+            "lecture_id": lecture_id,
+            "user_id": user_id,
+            "question": question,
+            "confusion": confusion,
+            "timestamp": timestamp if timestamp is not None else time.time(),
+        },
+    )
 
 
 def log_question(
@@ -14,27 +42,45 @@ def log_question(
     lecture_id: Optional[str] = None,
 ):
     confusion = compute_confusion(question)
-    ts = time.time()
-    with db_conn() as conn:
-        ensure_course(conn, course_id)
-        ensure_lecture(conn, course_id, lecture_id)
-        conn.execute(
-            questions.insert().values(
-                course_id=course_id,
-                lecture_id=lecture_id,
-                user_id=user_id,
-                question=question,
-                confusion=confusion,
-                timestamp=ts,
-            )
-        )
+    record_question(course_id, user_id, question, confusion, lecture_id=lecture_id)
     return confusion
 
 
+def import_questions(items: List[dict], batch_size: int = 1000) -> int:
+    """
+    Bulk-load historical questions (dicts with course_id, user_id, question,
+    timestamp and optionally lecture_id/confusion). Missing confusion scores
+    are computed in batches. Returns the number of rows inserted.
+    """
+    for start in range(0, len(items), batch_size):
+        batch = items[start:start + batch_size]
+        todo = [i for i, item in enumerate(batch) if item.get("confusion") is None]
+        scores = compute_confusion_batch([batch[i]["question"] for i in todo])
+        scored = {i: s for i, s in zip(todo, scores)}
+        rows = [
+            {
+                "course_id": item["course_id"],
+                "lecture_id": item.get("lecture_id"),
+                "user_id": item["user_id"],
+                "question": item["question"],
+                "confusion": scored.get(i, item.get("confusion")),
+                "timestamp": item["timestamp"],
+            }
+            for i, item in enumerate(batch)
+        ]
+        with db_conn() as conn:
+            for course_id, lecture_id in {(r["course_id"], r["lecture_id"]) for r in rows}:
+                ensure_course(conn, course_id)
+                ensure_lecture(conn, course_id, lecture_id)
+            _insert_questions(conn, rows)
+    return len(items)
+
+
 def get_questions(course_id: str, lecture_id: Optional[str] = None) -> List[dict]:
     with db_conn() as conn:
         stmt = (
             select(
+                questions.c.id,
                 questions.c.user_id,
                 questions.c.question,
                 questions.c.lecture_id,
@@ -50,11 +96,47 @@ def get_questions(course_id: str, lecture_id: Optional[str] = None) -> List[dict
 
     return [
         {
-            "user_id": r[0],
-            "question": r[1],
-            "lecture_id": r[2],
-            "confusion": r[3],
-            "timestamp": r[4],
+            "id": r[0],
+            "user_id": r[1],
+            "question": r[2],
+            "lecture_id": r[3],
+            "confusion": r[4],
+            "timestamp": r[5],
         }
         for r in rows
     ]
+
+
+def get_recent_questions(course_id: str, lecture_id: Optional[str] = None, limit: int = 6) -> List[dict]:
+    """
+    The newest `limit` questions, oldest first (same shape as get_questions).
+    """
+    with db_conn() as conn:
+        stmt = (
+            select(
+                questions.c.id,
+                questions.c.user_id,
+                questions.c.question,
+                questions.c.lecture_id,
+                questions.c.confusion,
+                questions.c.timestamp,
+            )
+            .where(questions.c.course_id == course_id)
+            .order_by(questions.c.timestamp.desc())
+            .limit(limit)
+        )
+        if lecture_id:
+            stmt = stmt.where(questions.c.lecture_id == lecture_id)
+        rows = conn.execute(stmt).fetchall()
+
+    return [
+        {
+            "id": r[0],
+            "user_id": r[1],
+            "question": r[2],
+            "lecture_id": r[3],
+            "confusion": r[4],
+            "timestamp": r[5],
+        }
+        for r in reversed(rows)
+    ]
@@ -3,8 +3,15 @@ from typing import Dict, Optional, List
 from app.services.question_cluster import cluster_questions
 from app.services.question_log import get_questions
 from app.services.store import course_store
-from app.services.llm import generate_recommendations_with_openai, fix_citations_with_openai
+from app.services.llm import (
+    generate_recommendations_with_openai,
+    fix_citations_with_openai,
+    has_openai_key,
+    recommendation_messages,
+)
+from app.services.context_packer import PROMPT_TOKEN_BUDGET, count_tokens, pack_context, record_prompt
 from app.services.citation_guard import needs_fix, all_citations_valid
+from app.services.citation_repair import repair_citations
 
 
 def _cluster_summary(cluster: Dict) -> str:
@@ -45,13 +52,24 @@ def generate_recommendations(
         q.get("question", "") for q in top.get("questions", [])[:2]
     )
     hits = course_store.search(course_id, query, k=5, lecture_id=lecture_id)
-    contexts = [f"[{h.source_name} | {h.chunk_id}]\n{h.text}" for h in hits]
+    packed = pack_context(hits, budget=PROMPT_TOKEN_BUDGET - count_tokens(summary))
+    contexts = packed.contexts
     allowed_ids = {h.chunk_id for h in hits}
+    if has_openai_key():
+        record_prompt(
+            course_id,
+            lecture_id,
+            "recommendations",
+            packed,
+            recommendation_messages(summary, contexts),
+        )
 
     recs = generate_recommendations_with_openai(summary, contexts)
     if recs is not None:
         if needs_fix(recs, allowed_ids):
-            repaired = fix_citations_with_openai(recs, contexts)
+            repaired = repair_citations(recs, course_id, hits, lecture_id=lecture_id)
+            if repaired is None or not all_citations_valid(repaired, allowed_ids):
+                repaired = fix_citations_with_openai(recs, contexts)
             if repaired is not None and all_citations_valid(repaired, allowed_ids):
                 recs = repaired
             else:
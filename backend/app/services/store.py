@@ -1,10 +1,14 @@
+from collections import Counter
 from dataclasses import dataclass
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+import hashlib
 import json
+import threading
 import time
 import uuid
 
 import numpy as np
+import scipy.sparse as sp
 from sqlalchemy import func, select
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
@@ -17,7 +21,14 @@ from app.services.db import (
     chunks as chunks_table,
     chunk_embeddings,
 )
-from app.services.embeddings import embed_texts, DEFAULT_EMBEDDING_MODEL
+from app.services.answer_cache import answer_cache
+from app.services.embeddings import embed_texts, embed_texts_batched, DEFAULT_EMBEDDING_MODEL
+
+
+# Refit TF-IDF once rows appended with a stale vocabulary pass this fraction.
+STALE_REFIT_RATIO = 0.2
+# Compact an index once tombstoned rows pass this fraction.
+TOMBSTONE_COMPACT_RATIO = 0.25
 
 
 @dataclass
@@ -27,16 +38,84 @@ class StoredChunk:
     text: str
 
 
+@dataclass
+class _Index:
+    """
+    Immutable snapshot of one cache key; patches build a new one and swap it in.
+    Rows in `dead` are tombstones: deleted in the DB, masked out at query time
+    until the next compaction drops them from the matrices.
+    """
+    chunks: List[StoredChunk]
+    embeddings: List[Optional[List[float]]]
+    vectorizer: Optional[TfidfVectorizer] = None
+    matrix: Optional[object] = None
+    stale_rows: int = 0
+    dead: FrozenSet[int] = frozenset()
+    alive: Optional[np.ndarray] = None
+
+    @property
+    def live_count(self) -> int:
+        return len(self.chunks) - len(self.dead)
+
+    def needs_compaction(self) -> bool:
+        n = len(self.chunks)
+        return len(self.dead) > TOMBSTONE_COMPACT_RATIO * n or self.stale_rows > STALE_REFIT_RATIO * n
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def _fit(chunks: List[StoredChunk]) -> Tuple[Optional[TfidfVectorizer], Optional[object]]:
+    docs = [c.text for c in chunks]
+    if not docs:
+        return None, None
+    vec = TfidfVectorizer(stop_words="english", max_features=40000)
+    return vec, vec.fit_transform(docs)
+
+
+def _make_index(
+    chunks: List[StoredChunk],
+    embeddings: List[Optional[List[float]]],
+    vectorizer=None,
+    matrix=None,
+    stale_rows: int = 0,
+    dead: FrozenSet[int] = frozenset(),
+) -> _Index:
+    if vectorizer is None or matrix is None:
+        vectorizer, matrix = _fit(chunks)
+        stale_rows = 0
+    alive = np.ones(len(chunks), dtype=bool)
+    if dead:
+        alive[list(dead)] = False
+    return _Index(
+        chunks=chunks,
+        embeddings=embeddings,
+        vectorizer=vectorizer,
+        matrix=matrix,
+        stale_rows=stale_rows,
+        dead=dead,
+        alive=alive,
+    )
+
+
+def _normalize(x: np.ndarray, alive: np.ndarray) -> np.ndarray:
+    lo, hi = float(x[alive].min()), float(x[alive].max())
+    return (x - lo) / (hi - lo + 1e-8)
+
+
 class CourseStore:
     """
     v2 storage: persisted in SQLite with in-memory TF-IDF cache.
+    Documents are keyed by (course_id, lecture_id, source_name); re-ingesting
+    or deleting one patches the cache in place and a background compaction
+    refits it once enough rows are tombstoned or stale.
     """
     def __init__(self):
-        self._vectorizers: Dict[str, TfidfVectorizer] = {}
-        self._matrices: Dict[str, object] = {}
-        self._chunk_cache: Dict[str, List[StoredChunk]] = {}
+        self._indexes: Dict[str, _Index] = {}
         self._chunk_counts: Dict[str, int] = {}
-        self._embedding_cache: Dict[str, List[Optional[List[float]]]] = {}
+        self._compacting: Set[str] = set()
+        self._lock = threading.RLock()
 
     def add_chunks(
         self,
@@ -47,34 +126,129 @@ class CourseStore:
     ) -> int:
         if not chunks:
             return 0
+        return self.add_documents(
+            [
+                {
+                    "course_id": course_id,
+                    "lecture_id": lecture_id,
+                    "source_name": source_name,
+                    "chunks": chunks,
+                }
+            ]
+        )[0]["added"]
+
+    def add_documents(self, docs: List[Dict], invalidate: bool = True) -> List[Dict[str, int]]:
+        """
+        Insert or re-ingest many documents in one transaction.
+        Each doc is {"course_id", "lecture_id", "source_name", "chunks"}.
+        An existing document with the same (course, lecture, source_name) is
+        diffed by chunk content hash: only new chunks are inserted and
+        embedded, and chunks no longer present are deleted. An empty chunk
+        list removes the stored document and all its chunks.
+        Returns {"added", "removed", "unchanged"} per doc; if the same
+        document appears more than once, only the last copy is applied.
+
+        With invalidate=False the in-memory index is left alone and the
+        caller is expected to call invalidate_courses() when done.
+        """
+        diffs = [{"added": 0, "removed": 0, "unchanged": 0} for _ in docs]
+        if not docs:
+            return diffs
+
+        added_by_key: Dict[Tuple[str, Optional[str]], List[StoredChunk]] = {}
+        removed_by_key: Dict[Tuple[str, Optional[str]], Set[str]] = {}
+        emb_by_id: Dict[str, List[float]] = {}
+
+        last = {
+            (d["course_id"], d.get("lecture_id"), d["source_name"]): i
+            for i, d in enumerate(docs)
+        }
+        applied = [
+            i for i, d in enumerate(docs)
+            if last[(d["course_id"], d.get("lecture_id"), d["source_name"])] == i
+        ]
+        # Embedding calls are remote and slow, so they run before the write
+        # transaction (SQLite holds its write lock until commit). A chunk
+        # that a concurrent ingest made new in between is stored without an
+        # embedding for backfill_embeddings to pick up.
+        emb_by_hash = self._embed_new_chunks([docs[i] for i in applied])
 
         with db_conn() as conn:
-            ensure_course(conn, course_id)
-            ensure_lecture(conn, course_id, lecture_id)
-            doc_id = conn.execute(
-                documents.insert().values(
-                    course_id=course_id,
-                    lecture_id=lecture_id,
-                    source_name=source_name,
-                    created_at=time.time(),
+            seen = set()
+            for d in docs:
+                key = (d["course_id"], d.get("lecture_id"))
+                if key in seen or not d["chunks"]:
+                    continue
+                seen.add(key)
+                ensure_course(conn, d["course_id"])
+                ensure_lecture(conn, d["course_id"], d.get("lecture_id"))
+
+            rows = []
+            removed_ids: List[str] = []
+            emptied_doc_ids: List[int] = []
+            for i in applied:
+                d, diff = docs[i], diffs[i]
+                key = (d["course_id"], d.get("lecture_id"))
+                doc_id, existing = self._find_document(conn, *key, d["source_name"])
+                if not d["chunks"]:
+                    if doc_id is None:
+                        continue
+                    # The text is gone: drop the document along with its chunks.
+                    emptied_doc_ids.append(doc_id)
+                elif doc_id is None:
+                    doc_id = conn.execute(
+                        documents.insert().values(
+                            course_id=d["course_id"],
+                            lecture_id=d.get("lecture_id"),
+                            source_name=d["source_name"],
+                            created_at=time.time(),
+                        )
+                    ).inserted_primary_key[0]
+
+                for text in d["chunks"]:
+                    h = content_hash(text)
+                    if existing.get(h):
+                        existing[h].pop()
+                        diff["unchanged"] += 1
+                        continue
+                    row = {
+                        "document_id": doc_id,
+                        "chunk_id": str(uuid.uuid4())[:8],
+                        "text": text,
+                        "content_hash": h,
+                        "created_at": time.time(),
+                    }
+                    rows.append(row)
+                    added_by_key.setdefault(key, []).append(
+                        StoredChunk(chunk_id=row["chunk_id"], source_name=d["source_name"], text=text)
+                    )
+                    diff["added"] += 1
+
+                stale = [cid for ids in existing.values() for cid in ids]
+                if stale:
+                    removed_ids.extend(stale)
+                    removed_by_key.setdefault(key, set()).update(stale)
+                    diff["removed"] += len(stale)
+
+            if removed_ids:
+                conn.execute(
+                    chunk_embeddings.delete().where(chunk_embeddings.c.chunk_id.in_(removed_ids))
+                )
+                conn.execute(
+                    chunks_table.delete().where(chunks_table.c.chunk_id.in_(removed_ids))
                 )
-            ).inserted_primary_key[0]
+            if emptied_doc_ids:
+                conn.execute(documents.delete().where(documents.c.id.in_(emptied_doc_ids)))
 
-            rows = [
-                {
-                    "document_id": doc_id,
-                    "chunk_id": str(uuid.uuid4())[:8],
-                    "text": c,
-                    "created_at": time.time(),
-                }
-                for c in chunks
-            ]
-            conn.execute(chunks_table.insert(), rows)
+            if rows:
+                conn.execute(chunks_table.insert(), rows)
 
-            embeddings = embed_texts([r["text"] for r in rows])
-            if embeddings is not None:
                 emb_rows = []
-                for r, vec in zip(rows, embeddings):
+                for r in rows:
+                    vec = emb_by_hash.get(r["content_hash"])
+                    if vec is None:
+                        continue
+                    emb_by_id[r["chunk_id"]] = vec
                     emb_rows.append(
                         {
                             "chunk_id": r["chunk_id"],
@@ -86,18 +260,245 @@ class CourseStore:
                 if emb_rows:
                     conn.execute(chunk_embeddings.insert(), emb_rows)
 
-        self._invalidate_cache(course_id)
-        return len(chunks)
+        if invalidate:
+            for key in set(added_by_key) | set(removed_by_key):
+                self._patch_cache(
+                    key[0],
+                    key[1],
+                    removed_by_key.get(key, set()),
+                    added_by_key.get(key, []),
+                    emb_by_id,
+                )
+        return diffs
+
+    def _embed_new_chunks(self, docs: List[Dict]) -> Dict[str, Optional[List[float]]]:
+        """
+        Embeddings, by content hash, of the chunks add_documents will insert
+        given what is stored now.
+        """
+        keys = {(d["course_id"], d.get("lecture_id"), d["source_name"]) for d in docs}
+        stored: Dict[Tuple, Counter] = {k: Counter() for k in keys}
+        with db_conn() as conn:
+            rows = conn.execute(
+                select(
+                    documents.c.course_id,
+                    documents.c.lecture_id,
+                    documents.c.source_name,
+                    chunks_table.c.content_hash,
+                )
+                .select_from(chunks_table.join(documents, chunks_table.c.document_id == documents.c.id))
+                .where(documents.c.course_id.in_({k[0] for k in keys}))
+                .where(documents.c.source_name.in_({k[2] for k in keys}))
+            ).fetchall()
+        for course_id, lecture_id, source_name, h in rows:
+            if (course_id, lecture_id, source_name) in stored and h:
+                stored[(course_id, lecture_id, source_name)][h] += 1
+
+        new_texts: Dict[str, str] = {}
+        for d in docs:
+            existing = stored[(d["course_id"], d.get("lecture_id"), d["source_name"])]
+            for text in d["chunks"]:
+                h = content_hash(text)
+                if existing[h] > 0:
+                    existing[h] -= 1
+                else:
+                    new_texts.setdefault(h, text)
+        if not new_texts:
+            return {}
+        vectors = embed_texts_batched(list(new_texts.values()))
+        return dict(zip(new_texts.keys(), vectors))
+
+    def _find_document(
+        self,
+        conn,
+        course_id: str,
+        lecture_id: Optional[str],
+        source_name: str,
+    ) -> Tuple[Optional[int], Dict[str, List[str]]]:
+        """
+        Returns (document id, {content_hash: [chunk_id, ...]}) for an existing
+        document, folding older duplicate documents into the newest one.
+        """
+        doc_ids = [
+            r[0]
+            for r in conn.execute(
+                select(documents.c.id)
+                .where(documents.c.course_id == course_id)
+                .where(documents.c.lecture_id == lecture_id)
+                .where(documents.c.source_name == source_name)
+                .order_by(documents.c.id.desc())
+            ).fetchall()
+        ]
+        if not doc_ids:
+            return None, {}
+
+        rows = conn.execute(
+            select(chunks_table.c.chunk_id, chunks_table.c.text, chunks_table.c.content_hash)
+            .where(chunks_table.c.document_id.in_(doc_ids))
+        ).fetchall()
+        existing: Dict[str, List[str]] = {}
+        for chunk_id, text, h in rows:
+            existing.setdefault(h or content_hash(text), []).append(chunk_id)
+
+        # Documents ingested before re-ingest existed may be duplicated;
+        # their chunks are diffed as one set and re-homed on the newest row.
+        if len(doc_ids) > 1:
+            conn.execute(
+                chunks_table.update()
+                .where(chunks_table.c.document_id.in_(doc_ids[1:]))
+                .values(document_id=doc_ids[0])
+            )
+            conn.execute(documents.delete().where(documents.c.id.in_(doc_ids[1:])))
+        return doc_ids[0], existing
+
+    def invalidate_courses(self, course_ids) -> None:
+        for course_id in course_ids:
+            self._invalidate_cache(course_id)
 
     def _invalidate_cache(self, course_id: str) -> None:
+        answer_cache.invalidate(course_id)
         prefix = f"{course_id}::"
-        keys = [k for k in self._chunk_counts.keys() if k.startswith(prefix)]
-        for k in keys:
-            self._vectorizers.pop(k, None)
-            self._matrices.pop(k, None)
-            self._chunk_cache.pop(k, None)
-            self._chunk_counts.pop(k, None)
-            self._embedding_cache.pop(k, None)
+        with self._lock:
+            keys = [k for k in self._chunk_counts.keys() if k.startswith(prefix)]
+            for k in keys:
+                self._indexes.pop(k, None)
+                self._chunk_counts.pop(k, None)
+
+    def delete_document(
+        self,
+        course_id: str,
+        source_name: str,
+        lecture_id: Optional[str] = None,
+        keep: Iterable[str] = (),
+        pages_only: bool = False,
+    ) -> Dict[str, int]:
+        """
+        Delete a document, including the "(page N)" documents of an ingested
+        PDF with that name; pages_only deletes just those. Source names in
+        `keep` are left alone.
+        """
+        escaped = source_name.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        pages = documents.c.source_name.like(f"{escaped} (page %)", escape="\\")
+        cond = (documents.c.lecture_id == lecture_id) & (
+            pages if pages_only else (documents.c.source_name == source_name) | pages
+        )
+        keep = list(keep)
+        if keep:
+            cond = cond & documents.c.source_name.not_in(keep)
+        return self._delete_documents(course_id, cond)
+
+    def delete_lecture(self, course_id: str, lecture_id: str) -> Dict[str, int]:
+        return self._delete_documents(course_id, documents.c.lecture_id == lecture_id)
+
+    def _delete_documents(self, course_id: str, cond) -> Dict[str, int]:
+        removed_by_key: Dict[Tuple[str, Optional[str]], Set[str]] = {}
+        with db_conn() as conn:
+            docs = conn.execute(
+                select(documents.c.id, documents.c.lecture_id)
+                .where(documents.c.course_id == course_id)
+                .where(cond)
+            ).fetchall()
+            doc_ids = [r[0] for r in docs]
+            if not doc_ids:
+                return {"documents_deleted": 0, "chunks_deleted": 0}
+            lecture_of = {r[0]: r[1] for r in docs}
+
+            rows = conn.execute(
+                select(chunks_table.c.chunk_id, chunks_table.c.document_id)
+                .where(chunks_table.c.document_id.in_(doc_ids))
+            ).fetchall()
+            for chunk_id, doc_id in rows:
+                removed_by_key.setdefault((course_id, lecture_of[doc_id]), set()).add(chunk_id)
+
+            chunk_ids = [r[0] for r in rows]
+            if chunk_ids:
+                conn.execute(
+                    chunk_embeddings.delete().where(chunk_embeddings.c.chunk_id.in_(chunk_ids))
+                )
+            conn.execute(chunks_table.delete().where(chunks_table.c.document_id.in_(doc_ids)))
+            conn.execute(documents.delete().where(documents.c.id.in_(doc_ids)))
+
+        for (cid, lid), removed in removed_by_key.items():
+            self._patch_cache(cid, lid, removed, [], {})
+        return {"documents_deleted": len(doc_ids), "chunks_deleted": len(chunk_ids)}
+
+    def _patch_cache(
+        self,
+        course_id: str,
+        lecture_id: Optional[str],
+        removed_ids: Set[str],
+        added: List[StoredChunk],
+        emb_by_id: Dict[str, List[float]],
+    ) -> None:
+        """
+        Apply a chunk diff to the cached indexes that contain this lecture,
+        without reloading from the DB or refitting. Removed rows become
+        tombstones; new rows are projected onto the existing TF-IDF
+        vocabulary. Compaction happens in the background.
+        """
+        answer_cache.invalidate(course_id, lecture_id)
+        keys = [f"{course_id}::all"]
+        if lecture_id:
+            keys.append(f"{course_id}::{lecture_id}")
+
+        with self._lock:
+            for key in keys:
+                index = self._indexes.get(key)
+                if index is None:
+                    continue
+
+                dead = set(index.dead)
+                if removed_ids:
+                    dead.update(
+                        i for i, c in enumerate(index.chunks) if c.chunk_id in removed_ids
+                    )
+                if len(dead) == len(index.chunks) and not added:
+                    self._indexes.pop(key, None)
+                    self._chunk_counts.pop(key, None)
+                    continue
+
+                mat, stale = index.matrix, index.stale_rows
+                if added:
+                    mat = sp.vstack([mat, index.vectorizer.transform([c.text for c in added])]).tocsr()
+                    stale += len(added)
+
+                patched = _make_index(
+                    index.chunks + added,
+                    index.embeddings + [emb_by_id.get(c.chunk_id) for c in added],
+                    index.vectorizer,
+                    mat,
+                    stale,
+                    frozenset(dead),
+                )
+                self._indexes[key] = patched
+                self._chunk_counts[key] = patched.live_count
+                if patched.needs_compaction() and key not in self._compacting:
+                    self._compacting.add(key)
+                    threading.Thread(target=self._compact, args=(key,), daemon=True).start()
+
+    def _compact(self, key: str) -> None:
+        """
+        Rebuild an index without its tombstones and refit TF-IDF, then swap
+        it in unless a newer patch landed meanwhile (in which case retry).
+        """
+        try:
+            while True:
+                with self._lock:
+                    index = self._indexes.get(key)
+                if index is None:
+                    return
+                live = [i for i in range(len(index.chunks)) if i not in index.dead]
+                compacted = _make_index(
+                    [index.chunks[i] for i in live],
+                    [index.embeddings[i] for i in live],
+                )
+                with self._lock:
+                    if self._indexes.get(key) is index:
+                        self._indexes[key] = compacted
+                        return
+        finally:
+            with self._lock:
+                self._compacting.discard(key)
 
     def _load_chunks(self, course_id: str, lecture_id: Optional[str]) -> List[StoredChunk]:
         with db_conn() as conn:
@@ -153,77 +554,112 @@ class CourseStore:
                 stmt = stmt.where(documents.c.lecture_id == lecture_id)
             return int(conn.execute(stmt).scalar() or 0)
 
-    def _rebuild_index(self, course_id: str, stored_chunks: List[StoredChunk]) -> None:
-        docs = [c.text for c in stored_chunks]
-        if not docs:
-            return
-        vec = TfidfVectorizer(stop_words="english", max_features=40000)
-        mat = vec.fit_transform(docs)
-        self._vectorizers[course_id] = vec
-        self._matrices[course_id] = mat
+    def content_version(self, course_id: str, lecture_id: Optional[str] = None) -> Tuple[int, float]:
+        """
+        (chunk count, newest chunk created_at) of a lecture, or of the whole
+        course: any add, delete or re-ingest, from any process, changes it.
+        """
+        with db_conn() as conn:
+            stmt = (
+                select(func.count(), func.coalesce(func.max(chunks_table.c.created_at), 0.0))
+                .select_from(chunks_table.join(documents, chunks_table.c.document_id == documents.c.id))
+                .where(documents.c.course_id == course_id)
+            )
+            if lecture_id:
+                stmt = stmt.where(documents.c.lecture_id == lecture_id)
+            count, newest = conn.execute(stmt).first()
+        return int(count or 0), float(newest)
 
-    def search(
-        self,
-        course_id: str,
-        query: str,
-        k: int = 5,
-        lecture_id: Optional[str] = None,
-    ) -> List[StoredChunk]:
+    def _get_index(self, course_id: str, lecture_id: Optional[str]) -> Optional[_Index]:
         count = self._get_chunk_count(course_id, lecture_id)
         if count == 0:
-            return []
+            return None
 
         cache_key = f"{course_id}::{lecture_id or 'all'}"
-        cached_count = self._chunk_counts.get(cache_key)
-        if cached_count != count:
-            stored_chunks = self._load_chunks(course_id, lecture_id)
-            self._chunk_cache[cache_key] = stored_chunks
+        with self._lock:
+            index = self._indexes.get(cache_key)
+            if index is not None and self._chunk_counts.get(cache_key) == count:
+                return index
+
+        stored_chunks = self._load_chunks(course_id, lecture_id)
+        emb_map = self._load_embeddings(course_id, lecture_id)
+        index = _make_index(stored_chunks, [emb_map.get(c.chunk_id) for c in stored_chunks])
+        with self._lock:
+            self._indexes[cache_key] = index
             self._chunk_counts[cache_key] = count
-            self._rebuild_index(cache_key, stored_chunks)
-            emb_map = self._load_embeddings(course_id, lecture_id)
-            self._embedding_cache[cache_key] = [
-                emb_map.get(c.chunk_id) for c in stored_chunks
-            ]
-
-        chunks_list = self._chunk_cache.get(cache_key, [])
-        if not chunks_list:
-            return []
-
-        vec = self._vectorizers.get(cache_key)
-        mat = self._matrices.get(cache_key)
-        if vec is None or mat is None:
-            self._rebuild_index(cache_key, chunks_list)
-            vec = self._vectorizers.get(cache_key)
-            mat = self._matrices.get(cache_key)
+        return index
 
-        qv = vec.transform([query])
-        tfidf_sims = cosine_similarity(qv, mat).flatten()
+    def _score(
+        self,
+        index: _Index,
+        query: str,
+        query_embedding: Optional[List[float]] = None,
+    ) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+        """
+        Returns (tfidf_sims, emb_sims); emb_sims is None without embeddings.
+        Pass query_embedding to reuse one the caller already computed.
+        """
+        qv = index.vectorizer.transform([query])
+        tfidf_sims = cosine_similarity(qv, index.matrix).flatten()
 
-        hybrid_sims = tfidf_sims
-        emb_list = self._embedding_cache.get(cache_key, [])
-        if emb_list:
-            q_emb = embed_texts([query])
+        emb_sims = None
+        if index.embeddings:
+            q_emb = [query_embedding] if query_embedding is not None else embed_texts([query])
             if q_emb:
                 q_vec = np.array(q_emb[0], dtype=np.float32)
                 emb_matrix = np.array(
-                    [e if e is not None else np.zeros_like(q_vec) for e in emb_list],
+                    [e if e is not None else np.zeros_like(q_vec) for e in index.embeddings],
                     dtype=np.float32,
                 )
                 # cosine similarity
                 denom = (np.linalg.norm(emb_matrix, axis=1) * np.linalg.norm(q_vec) + 1e-8)
                 emb_sims = (emb_matrix @ q_vec) / denom
+        return tfidf_sims, emb_sims
 
-                # normalize both to 0..1
-                tf_min, tf_max = float(tfidf_sims.min()), float(tfidf_sims.max())
-                em_min, em_max = float(emb_sims.min()), float(emb_sims.max())
-                tf_norm = (tfidf_sims - tf_min) / (tf_max - tf_min + 1e-8)
-                em_norm = (emb_sims - em_min) / (em_max - em_min + 1e-8)
-
-                alpha = 0.6
-                hybrid_sims = alpha * tf_norm + (1.0 - alpha) * em_norm
+    def similarity(
+        self,
+        course_id: str,
+        texts: List[str],
+        chunks: List[StoredChunk],
+        lecture_id: Optional[str] = None,
+    ) -> np.ndarray:
+        """
+        TF-IDF cosine similarity of each text against each of the given
+        chunks (len(texts) x len(chunks)), using the cached index's
+        vocabulary. Chunks missing from the index score 0.
+        """
+        out = np.zeros((len(texts), len(chunks)), dtype=np.float32)
+        if not texts or not chunks:
+            return out
+        index = self._get_index(course_id, lecture_id)
+        if index is None or index.vectorizer is None:
+            return out
+
+        wanted = {c.chunk_id: j for j, c in enumerate(chunks)}
+        rows, cols = [], []
+        for i, c in enumerate(index.chunks):
+            if c.chunk_id in wanted and index.alive[i]:
+                rows.append(i)
+                cols.append(wanted[c.chunk_id])
+        if rows:
+            sims = cosine_similarity(index.vectorizer.transform(texts), index.matrix[rows])
+            out[:, cols] = sims
+        return out
 
-        top_idx = hybrid_sims.argsort()[::-1][:k]
-        return [chunks_list[i] for i in top_idx]
+    def search(
+        self,
+        course_id: str,
+        query: str,
+        k: int = 5,
+        lecture_id: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None,
+    ) -> List[StoredChunk]:
+        return [
+            c
+            for c, _, _, _ in self.search_with_scores(
+                course_id, query, k=k, lecture_id=lecture_id, query_embedding=query_embedding
+            )
+        ]
 
     def search_with_scores(
         self,
@@ -231,73 +667,36 @@ class CourseStore:
         query: str,
         k: int = 5,
         lecture_id: Optional[str] = None,
+        query_embedding: Optional[List[float]] = None,
     ) -> List[Tuple[StoredChunk, float, float, float]]:
         """
         Returns (chunk, tfidf_score, embedding_score, hybrid_score).
         embedding_score is 0 if embeddings are unavailable.
         """
-        count = self._get_chunk_count(course_id, lecture_id)
-        if count == 0:
-            return []
-
-        cache_key = f"{course_id}::{lecture_id or 'all'}"
-        cached_count = self._chunk_counts.get(cache_key)
-        if cached_count != count:
-            stored_chunks = self._load_chunks(course_id, lecture_id)
-            self._chunk_cache[cache_key] = stored_chunks
-            self._chunk_counts[cache_key] = count
-            self._rebuild_index(cache_key, stored_chunks)
-            emb_map = self._load_embeddings(course_id, lecture_id)
-            self._embedding_cache[cache_key] = [
-                emb_map.get(c.chunk_id) for c in stored_chunks
-            ]
-
-        chunks_list = self._chunk_cache.get(cache_key, [])
-        if not chunks_list:
+        index = self._get_index(course_id, lecture_id)
+        if index is None or index.live_count == 0:
             return []
 
-        vec = self._vectorizers.get(cache_key)
-        mat = self._matrices.get(cache_key)
-        if vec is None or mat is None:
-            self._rebuild_index(cache_key, chunks_list)
-            vec = self._vectorizers.get(cache_key)
-            mat = self._matrices.get(cache_key)
-
-        qv = vec.transform([query])
-        tfidf_sims = cosine_similarity(qv, mat).flatten()
-
-        emb_list = self._embedding_cache.get(cache_key, [])
-        emb_sims = None
-        if emb_list:
-            q_emb = embed_texts([query])
-            if q_emb:
-                q_vec = np.array(q_emb[0], dtype=np.float32)
-                emb_matrix = np.array(
-                    [e if e is not None else np.zeros_like(q_vec) for e in emb_list],
-                    dtype=np.float32,
-                )
-                denom = (np.linalg.norm(emb_matrix, axis=1) * np.linalg.norm(q_vec) + 1e-8)
-                emb_sims = (emb_matrix @ q_vec) / denom
-
-        # normalize both to 0..1 for hybrid
-        tf_min, tf_max = float(tfidf_sims.min()), float(tfidf_sims.max())
-        tf_norm = (tfidf_sims - tf_min) / (tf_max - tf_min + 1e-8)
+        tfidf_sims, emb_sims = self._score(index, query, query_embedding)
 
+        # normalize both to 0..1 (over live rows) for hybrid
+        alive = index.alive
+        tf_norm = _normalize(tfidf_sims, alive)
         if emb_sims is not None:
-            em_min, em_max = float(emb_sims.min()), float(emb_sims.max())
-            em_norm = (emb_sims - em_min) / (em_max - em_min + 1e-8)
+            em_norm = _normalize(emb_sims, alive)
         else:
             em_norm = np.zeros_like(tf_norm)
 
         alpha = 0.6
         hybrid = alpha * tf_norm + (1.0 - alpha) * em_norm
+        hybrid[~alive] = -np.inf
 
-        top_idx = hybrid.argsort()[::-1][:k]
+        top_idx = hybrid.argsort()[::-1][:min(k, index.live_count)]
         out: List[Tuple[StoredChunk, float, float, float]] = []
         for i in top_idx:
             out.append(
                 (
-                    chunks_list[i],
+                    index.chunks[i],
                     float(tf_norm[i]),
                     float(em_norm[i]),
                     float(hybrid[i]),
@@ -0,0 +1,154 @@
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from typing import Callable, Dict, Hashable, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+from app.services.citation_guard import CITATION_PATTERN
+from app.services.db import (
+    CONVERSATION_SUMMARY_KEY,
+    conversation_summaries,
+    db_conn,
+    dialect_insert,
+)
+from app.services.llm import summarize_conversation_with_openai
+
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_MAX_CHARS = int(os.getenv("MEMORY_SUMMARY_MAX_CHARS", "1200"))
+SUMMARY_WORKERS = int(os.getenv("MEMORY_SUMMARY_WORKERS", "2"))
+# Fold only once this many turns have left the verbatim window unsummarized,
+# so summarizing costs one LLM call per few exchanges, not one per chat.
+SUMMARY_MIN_TURNS = int(os.getenv("MEMORY_SUMMARY_MIN_TURNS", "4"))
+
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def _first_sentence(text: str, max_chars: int = 160) -> str:
+    text = " ".join(CITATION_PATTERN.sub("", text).split())
+    first = _SENTENCE_END.split(text, maxsplit=1)[0]
+    return first if len(first) <= max_chars else first[:max_chars].rstrip() + "…"
+
+
+def extractive_summary(previous: str, turns: List[Dict[str, str]], max_chars: int = SUMMARY_MAX_CHARS) -> str:
+    """
+    LLM-free fallback: one line per turn (the student's question, the first
+    sentence of each answer), appended to the previous summary and cut from
+    the oldest end to max_chars.
+    """
+    lines = [l for l in previous.split("\n") if l.strip()]
+    for t in turns:
+        who = "Student asked" if t["role"] == "user" else "Tutor explained"
+        lines.append(f"- {who}: {_first_sentence(t['content'])}")
+    while lines and len("\n".join(lines)) > max_chars:
+        lines.pop(0)
+    return "\n".join(lines)
+
+
+def summarize(previous: str, turns: List[Dict[str, str]], llm: bool = True) -> str:
+    if not llm:
+        return extractive_summary(previous, turns)
+    try:
+        summary = summarize_conversation_with_openai(previous, turns)
+    except Exception:
+        logger.exception("summary LLM call failed")
+        summary = None
+    if not summary:
+        return extractive_summary(previous, turns)
+    return summary.strip()[:SUMMARY_MAX_CHARS]
+
+
+def load_summary(course_id: str, user_id: str, lecture_id: Optional[str]) -> Tuple[str, float]:
+    with db_conn() as conn:
+        row = conn.execute(
+            select(conversation_summaries.c.summary, conversation_summaries.c.covered_until)
+            .where(conversation_summaries.c.course_id == course_id)
+            .where(conversation_summaries.c.user_id == user_id)
+            .where(conversation_summaries.c.lecture_id == lecture_id)
+        ).first()
+    if row is None:
+        return "", 0.0
+    return row[0], row[1]
+
+
+def upsert_summaries(conn, items: List[Dict]) -> None:
+    # Keep only the newest summary per conversation in the batch.
+    latest: Dict[tuple, Dict] = {}
+    for item in items:
+        key = (item["course_id"], item["user_id"], item["lecture_id"])
+        if key not in latest or item["updated_at"] >= latest[key]["updated_at"]:
+            latest[key] = item
+    stmt = dialect_insert(conn, conversation_summaries).values(list(latest.values()))
+    conn.execute(
+        stmt.on_conflict_do_update(
+            index_elements=list(CONVERSATION_SUMMARY_KEY),
+            set_={
+                "summary": stmt.excluded.summary,
+                "covered_until": stmt.excluded.covered_until,
+                "updated_at": stmt.excluded.updated_at,
+            },
+        )
+    )
+
+
+class Summarizer:
+    """
+    Background workers that fold conversation turns into rolling summaries,
+    off the request path. submit() queues a conversation key once; the fold
+    callback does the actual work. Without running workers (scripts, tests)
+    submit() folds inline with llm=False, so the caller never waits on an
+    LLM call.
+    """
+    def __init__(self, fold: Callable[..., None], workers: int = SUMMARY_WORKERS):
+        self._fold = fold
+        self._workers = workers
+        self._queue: "queue.Queue[Optional[Hashable]]" = queue.Queue()
+        self._pending: Set[Hashable] = set()
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for i in range(self._workers):
+            t = threading.Thread(target=self._run, name=f"summarizer-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def stop(self, timeout: float = 10.0) -> None:
+        for _ in self._threads:
+            self._queue.put(None)
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(timeout=max(0.0, deadline - time.monotonic()))
+        self._threads = []
+
+    def submit(self, key: Hashable) -> None:
+        if not self._threads:
+            self._safe_fold(key, llm=False)
+            return
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+        self._queue.put(key)
+
+    def _run(self) -> None:
+        while True:
+            key = self._queue.get()
+            if key is None:
+                return
+            with self._lock:
+                self._pending.discard(key)
+            self._safe_fold(key)
+
+    def _safe_fold(self, key: Hashable, llm: bool = True) -> None:
+        try:
+            self._fold(key, llm=llm)
+        except Exception:
+            logger.exception("summarizing %s failed", key)
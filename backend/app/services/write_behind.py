@@ -0,0 +1,176 @@
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.services.db import db_conn, ensure_course, ensure_lecture
+
+
+logger = logging.getLogger(__name__)
+
+# handler(conn, items) writes a group of items inside an open transaction.
+Handler = Callable[[object, List[Dict]], None]
+
+
+class WriteBehind:
+    """
+    Coalesces hot-path inserts/upserts into batched transactions.
+
+    Producers submit (handler, item) pairs; a single writer thread drains the
+    bounded queue every few milliseconds, runs ensure_course/ensure_lecture
+    once per distinct pair and each handler once per batch, then commits.
+    Every item must carry "course_id" and "lecture_id".
+
+    When the queue is full, submit() blocks for up to put_timeout and then
+    writes synchronously in the caller (backpressure). When the writer is
+    not running (scripts, tests) submit() always writes synchronously.
+    """
+    def __init__(
+        self,
+        maxsize: int = 10000,
+        flush_interval: float = 0.005,
+        max_batch: int = 500,
+        put_timeout: float = 2.0,
+    ):
+        self._queue: "queue.Queue" = queue.Queue(maxsize=maxsize)
+        self._flush_interval = flush_interval
+        self._max_batch = max_batch
+        self._put_timeout = put_timeout
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        """
+        Flush everything queued so far, then stop the writer.
+        """
+        if not self.running:
+            return
+        self._stopping.set()
+        self._thread.join(timeout)
+        self._thread = None
+
+    def submit(
+        self,
+        handler: Handler,
+        item: Dict,
+        on_commit: Optional[Callable[[], None]] = None,
+    ) -> None:
+        entry = (handler, item, on_commit)
+        if self.running:
+            try:
+                self._queue.put(entry, timeout=self._put_timeout)
+                return
+            except queue.Full:
+                logger.warning("write-behind queue full; writing synchronously")
+        self._write([entry])
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """
+        Block until everything submitted before this call is committed.
+        """
+        if not self.running:
+            return True
+        done = threading.Event()
+        try:
+            self._queue.put((None, None, done.set), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(timeout)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self._flush_interval
+            while len(batch) < self._max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(
+                        self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                    )
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch: List[Tuple]) -> None:
+        groups: Dict[Handler, List[Dict]] = {}
+        callbacks = []
+        for handler, item, on_commit in batch:
+            if handler is not None:
+                groups.setdefault(handler, []).append(item)
+            if on_commit is not None:
+                callbacks.append(on_commit)
+
+        if groups:
+            try:
+                self._commit(groups)
+                failed = False
+            except Exception:
+                logger.exception("write-behind batch failed; retrying per handler")
+                failed = True
+            if failed:
+                # Retry each group on its own so one bad write doesn't drop the rest.
+                for handler, items in groups.items():
+                    self._retry(handler, items)
+
+        for cb in callbacks:
+            try:
+                cb()
+            except Exception:
+                logger.exception("write-behind on_commit callback failed")
+
+    def _retry(self, handler: Handler, items: List[Dict]) -> None:
+        """
+        Commit a failed group by bisection, in order, until only the items
+        that fail on their own are left; those are logged and dropped.
+        """
+        try:
+            self._commit({handler: items})
+            return
+        except Exception:
+            if len(items) == 1:
+                logger.exception("write-behind dropped 1 item for %s: %r", handler.__name__, items[0])
+                return
+        # Outside the except block, so the halves' tracebacks aren't chained.
+        mid = len(items) // 2
+        self._retry(handler, items[:mid])
+        self._retry(handler, items[mid:])
+
+    def _commit(self, groups: Dict[Handler, List[Dict]]) -> None:
+        with db_conn() as conn:
+            seen = set()
+            for items in groups.values():
+                for item in items:
+                    key = (item["course_id"], item.get("lecture_id"))
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                    ensure_course(conn, key[0])
+                    ensure_lecture(conn, key[0], key[1])
+            for handler, items in groups.items():
+                handler(conn, items)
+
+
+write_behind = WriteBehind(
+    maxsize=int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "10000")),
+    flush_interval=float(os.getenv("WRITE_BEHIND_FLUSH_MS", "5")) / 1000.0,
+)
@@ -0,0 +1,65 @@
+"""
+Rescore every stored question with the current confusion model.
+
+    cd backend && python -m scripts.backfill_confusion --workers 8 --batch-size 5000
+
+Progress is checkpointed after each batch, so an interrupted run (Ctrl-C)
+resumes where it stopped; pass --restart to start over.
+"""
+import argparse
+import signal
+import threading
+import time
+
+from app.services.backfill_confusion import (
+    BACKFILL_BATCH_SIZE,
+    BACKFILL_WORKERS,
+    BackfillProgress,
+    run_confusion_backfill,
+)
+from app.services.db import init_db
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=BACKFILL_WORKERS, help="scoring processes (1 = inline)")
+    parser.add_argument("--restart", action="store_true", help="ignore the checkpoint and start from the first row")
+    parser.add_argument("--max-rows", type=int, default=None, help="stop (resumably) after this many rows")
+    parser.add_argument("--report-every", type=float, default=5.0, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    init_db()
+    last_report = [0.0]
+
+    def report(p: BackfillProgress) -> None:
+        now = time.monotonic()
+        if now - last_report[0] >= args.report_every:
+            last_report[0] = now
+            print(f"id {p.last_id}/{p.target_id}  rows {p.rows_done}  {p.rows_per_sec:.0f} rows/s", flush=True)
+
+    stop = threading.Event()
+
+    def interrupt(signum, frame) -> None:
+        print("stopping after the current batch...", flush=True)
+        stop.set()
+
+    signal.signal(signal.SIGINT, interrupt)
+    p = run_confusion_backfill(
+        batch_size=args.batch_size,
+        workers=args.workers,
+        restart=args.restart,
+        max_rows=args.max_rows,
+        stop=stop,
+        on_progress=report,
+    )
+    print(
+        f"{p.status}: {p.rows_this_run} rows in {p.elapsed:.1f}s ({p.rows_per_sec:.0f} rows/s), "
+        f"last id {p.last_id} of {p.target_id}, {p.rows_done} total"
+    )
+    if p.error:
+        print(p.error)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+OpenAI-compatible stand-in for load testing without API quota.
+
+    cd backend && python -m scripts.fake_openai --port 8100 --latency-median-ms 700
+    OPENAI_API_KEY=fake OPENAI_BASE_URL=http://127.0.0.1:8100/v1 uvicorn app.main:app
+
+Implements POST /v1/chat/completions (plain and stream=true) and
+POST /v1/embeddings. Answers cite the "[source | chunk_id]" labels found in
+the prompt, so they pass the app's citation checks; --bad-citation-rate
+makes some of them cite an unknown chunk to exercise the repair path.
+Embeddings are deterministic hashed bags of words, so similar questions get
+similar vectors. Latency is lognormal with an optional heavy tail, streamed
+tokens arrive at --tokens-per-sec, and --error-rate injects 429/500s.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+import uuid
+import zlib
+from typing import Dict, List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+LABEL_PATTERN = re.compile(r"\[([^\[\]|]+\|\s*[A-Za-z0-9]{6,12})\]")
+WORD_PATTERN = re.compile(r"[a-z0-9]+")
+
+_FILLER = [
+    "This follows directly from the definition covered in lecture",
+    "The key intuition is that each step builds on the previous result",
+    "A concrete example makes the trade-off easier to see",
+    "In practice this is why the method converges under mild assumptions",
+    "Students often confuse this with the closely related idea from earlier",
+]
+
+
+def _latency(cfg: argparse.Namespace, rng: random.Random) -> float:
+    seconds = rng.lognormvariate(0.0, cfg.latency_sigma) * cfg.latency_median_ms / 1000.0
+    if rng.random() < cfg.tail_prob:
+        seconds += cfg.tail_ms / 1000.0
+    return seconds
+
+
+def _answer(messages: List[Dict[str, str]], cfg: argparse.Namespace, rng: random.Random) -> str:
+    prompt = "\n".join(m.get("content", "") for m in messages)
+    labels = list(dict.fromkeys(m.group(1) for m in LABEL_PATTERN.finditer(prompt)))
+    if not labels:
+        return "I don't have enough information in the course content to answer that."
+
+    # Deterministic per prompt, so coalesced/cached answers look alike.
+    local = random.Random(zlib.crc32(prompt.encode("utf-8")))
+    sentences = []
+    for i in range(cfg.answer_sentences):
+        label = labels[i % len(labels)]
+        if rng.random() < cfg.bad_citation_rate:
+            label = f"{label.split('|')[0].strip()} | zz{uuid.uuid4().hex[:6]}"
+        sentences.append(f"{local.choice(_FILLER)} [{label}].")
+    bullets = "recommendations" in prompt.lower()
+    return "\n".join(f"- {s}" for s in sentences) if bullets else " ".join(sentences)
+
+
+def _embed(text: str, dim: int) -> List[float]:
+    vec = np.zeros(dim, dtype=np.float32)
+    for w in WORD_PATTERN.findall(text.lower()):
+        h = int.from_bytes(hashlib.blake2b(w.encode("utf-8"), digest_size=8).digest(), "little")
+        vec[h % dim] += 1.0 if (h >> 63) & 1 else -1.0
+    norm = float(np.linalg.norm(vec))
+    if norm > 0:
+        vec /= norm
+    return [round(float(x), 6) for x in vec]
+
+
+def _error(rng: random.Random) -> JSONResponse:
+    status = rng.choice([429, 500, 503])
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": "injected failure", "type": "fake_error", "code": status}},
+    )
+
+
+def create_app(cfg: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="fake-openai")
+    rng = random.Random(cfg.seed)
+    stats = {"chat": 0, "stream": 0, "embeddings": 0, "errors": 0}
+
+    @app.get("/stats")
+    def get_stats():
+        return stats
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if rng.random() < cfg.error_rate:
+            stats["errors"] += 1
+            return _error(rng)
+
+        model = body.get("model", "gpt-4o-mini")
+        text = _answer(body.get("messages", []), cfg, rng)
+        words = re.findall(r"\S+\s*", text)
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        first_token = _latency(cfg, rng)
+
+        if not body.get("stream"):
+            stats["chat"] += 1
+            await asyncio.sleep(first_token + len(words) / cfg.tokens_per_sec)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+            }
+
+        stats["stream"] += 1
+
+        async def events():
+            await asyncio.sleep(first_token)
+            for i, w in enumerate(words):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "delta": {"role": "assistant", "content": w} if i == 0 else {"content": w},
+                            "finish_reason": None,
+                        }
+                    ],
+                }
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(1.0 / cfg.tokens_per_sec)
+            done = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+            }
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        if rng.random() < cfg.error_rate:
+            stats["errors"] += 1
+            return _error(rng)
+
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        stats["embeddings"] += 1
+        await asyncio.sleep(_latency(cfg, rng) * cfg.embedding_latency_factor)
+        return {
+            "object": "list",
+            "model": body.get("model", "text-embedding-3-small"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": _embed(t, cfg.embedding_dim)}
+                for i, t in enumerate(inputs)
+            ],
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        }
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency-median-ms", type=float, default=600.0)
+    parser.add_argument("--latency-sigma", type=float, default=0.4, help="lognormal shape")
+    parser.add_argument("--tail-prob", type=float, default=0.02, help="chance of an extra tail delay")
+    parser.add_argument("--tail-ms", type=float, default=4000.0)
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0)
+    parser.add_argument("--embedding-latency-factor", type=float, default=0.15)
+    parser.add_argument("--embedding-dim", type=int, default=256)
+    parser.add_argument("--answer-sentences", type=int, default=4)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--bad-citation-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=7)
+    return parser.parse_args(argv)
+
+
+def main() -> None:
+    cfg = parse_args()
+    uvicorn.run(create_app(cfg), host=cfg.host, port=cfg.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
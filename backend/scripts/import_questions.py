@@ -0,0 +1,54 @@
+"""
+Import historical student questions from newline-delimited JSON.
+
+    cd backend && python -m scripts.import_questions questions.jsonl
+
+One object per line with course_id, user_id, question and timestamp (unix
+seconds), optionally lecture_id and confusion; missing confusion scores are
+computed with the current model. Pass - to read from stdin.
+"""
+import argparse
+import json
+import sys
+import time
+
+from app.services.confusion_model import confusion_model
+from app.services.db import init_db
+from app.services.question_log import import_questions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("path", help="JSONL file, or - for stdin")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    init_db()
+    # Score with the model, not the heuristic fallback used while it trains.
+    confusion_model.get(wait=True)
+    t0 = time.perf_counter()
+    total = 0
+    batch = []
+    f = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8")
+    with f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                sys.exit(f"line {line_no}: {e}")
+            missing = [k for k in ("course_id", "user_id", "question", "timestamp") if k not in item]
+            if missing:
+                sys.exit(f"line {line_no}: missing {', '.join(missing)}")
+            batch.append(item)
+            if len(batch) >= args.batch_size:
+                total += import_questions(batch, batch_size=args.batch_size)
+                batch = []
+        if batch:
+            total += import_questions(batch, batch_size=args.batch_size)
+    print(f"imported {total} questions in {time.perf_counter() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+End-to-end load test: simulated students chatting, instructors uploading
+PDFs and polling recommendations, against a running backend.
+
+    cd backend && python -m scripts.fake_openai --port 8100 &
+    OPENAI_API_KEY=fake OPENAI_BASE_URL=http://127.0.0.1:8100/v1 \\
+        uvicorn app.main:app --port 8000 &
+    python -m scripts.load_test --base-url http://127.0.0.1:8000 --students 50 --duration 60
+
+Reports requests, errors, throughput and latency percentiles per endpoint;
+/chat/stream also gets a row for the time to its first `data:` event.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import httpx
+
+
+TOPICS = [
+    ("gradient descent", "moves parameters against the gradient of the loss"),
+    ("learning rate", "controls the step size of each parameter update"),
+    ("overfitting", "happens when a model memorizes noise in the training data"),
+    ("regularization", "adds a penalty on weight magnitude to reduce variance"),
+    ("cross validation", "estimates generalization by rotating held-out folds"),
+    ("backpropagation", "applies the chain rule to compute gradients layer by layer"),
+    ("batch normalization", "rescales activations to stabilize training"),
+    ("dropout", "randomly zeroes activations so units do not co-adapt"),
+]
+
+QUESTION_TEMPLATES = [
+    "What is {topic}?",
+    "Why does {topic} matter?",
+    "I'm confused about {topic}, can you explain it simply?",
+    "How is {topic} used in practice?",
+    "Can you give an example of {topic}?",
+]
+
+
+def _lecture_text(course: str, lecture: str, rng: random.Random) -> str:
+    parts = []
+    for topic, fact in rng.sample(TOPICS, 4):
+        parts.append(
+            f"In {course} {lecture} we study {topic}. The idea is that {topic} {fact}. "
+            f"Remember that {topic} interacts with the rest of the pipeline."
+        )
+    return " ".join(parts * 3)
+
+
+def make_pdf(pages: List[str]) -> bytes:
+    """
+    Minimal valid PDF with one text line per page (Helvetica), enough for
+    pypdf's text extraction.
+    """
+    objects: List[bytes] = []
+    page_ids = [4 + 2 * i for i in range(len(pages))]
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {len(pages)} >>".encode())
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    for i, text in enumerate(pages):
+        safe = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+        stream = f"BT /F1 10 Tf 40 750 Td ({safe}) Tj ET".encode("latin-1", "replace")
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {page_ids[i] + 1} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for n, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{n} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for off in offsets:
+        out += f"{off:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    async def timed(self, name: str, coro) -> None:
+        t0 = time.perf_counter()
+        try:
+            resp = await coro
+            ok = resp.status_code < 400 and '"error":' not in resp.text[:200]
+        except httpx.HTTPError:
+            ok = False
+        self.latencies[name].append(time.perf_counter() - t0)
+        if not ok:
+            self.errors[name] += 1
+
+    async def streamed(self, name: str, client: httpx.AsyncClient, url: str, body: Dict) -> None:
+        """
+        Time an SSE request twice: to its first `data:` event (recorded as
+        "<name> first data") and to the end of the stream.
+        """
+        t0 = time.perf_counter()
+        first = None
+        try:
+            async with client.stream("POST", url, json=body) as resp:
+                ok = resp.status_code < 400
+                async for line in resp.aiter_lines():
+                    if first is None and line.startswith("data:"):
+                        first = time.perf_counter() - t0
+        except httpx.HTTPError:
+            ok = False
+        self.latencies[name].append(time.perf_counter() - t0)
+        if first is not None:
+            self.latencies[f"{name} first data"].append(first)
+        if not ok or first is None:
+            self.errors[name] += 1
+
+    def report(self, elapsed: float) -> None:
+        print(f"\n{'endpoint':34} {'reqs':>6} {'errs':>5} {'rps':>7} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+        for name in sorted(self.latencies):
+            xs = sorted(self.latencies[name])
+            pct = lambda p: 1000 * xs[min(len(xs) - 1, int(p * len(xs)))]
+            print(
+                f"{name:34} {len(xs):>6} {self.errors[name]:>5} {len(xs) / elapsed:>7.1f} "
+                f"{pct(0.50):>6.0f}ms {pct(0.90):>6.0f}ms {pct(0.95):>6.0f}ms {pct(0.99):>6.0f}ms "
+                f"{1000 * xs[-1]:>6.0f}ms"
+            )
+        total = sum(len(v) for k, v in self.latencies.items() if not k.endswith(" first data"))
+        print(f"\n{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s)")
+        chat = self.latencies.get("POST /chat/")
+        if chat:
+            print(f"chat mean {1000 * statistics.mean(chat):.0f}ms")
+
+
+async def setup(client: httpx.AsyncClient, keys: List[Tuple[str, str]], rng: random.Random) -> None:
+    for course, lecture in keys:
+        r = await client.post(
+            "/ingest/",
+            json={
+                "course_id": course,
+                "lecture_id": lecture,
+                "source_name": f"{lecture}-notes",
+                "text": _lecture_text(course, lecture, rng),
+            },
+        )
+        r.raise_for_status()
+
+
+async def student(client, rec, keys, deadline, rng, think_ms, stream_share) -> None:
+    user = f"student-{rng.randrange(10**6)}"
+    course, lecture = rng.choice(keys)
+    while time.perf_counter() < deadline:
+        topic, _ = rng.choice(TOPICS)
+        body = {
+            "course_id": course,
+            "lecture_id": lecture,
+            "user_id": user,
+            "message": rng.choice(QUESTION_TEMPLATES).format(topic=topic),
+            "mode": rng.choice(["normal", "normal", "simple", "practice"]),
+        }
+        if rng.random() < stream_share:
+            await rec.streamed("POST /chat/stream", client, "/chat/stream", body)
+        else:
+            await rec.timed("POST /chat/", client.post("/chat/", json=body))
+        await asyncio.sleep(rng.expovariate(1000.0 / think_ms))
+
+
+async def instructor(client, rec, keys, deadline, rng, interval_s) -> None:
+    n = 0
+    while time.perf_counter() < deadline:
+        course, lecture = rng.choice(keys)
+        n += 1
+        pages = [
+            f"Upload {n}: {topic} {fact}." for topic, fact in rng.sample(TOPICS, 3)
+        ]
+        files = {"file": (f"slides-{n}.pdf", make_pdf(pages), "application/pdf")}
+        data = {"course_id": course, "lecture_id": lecture, "source_name": f"slides-{n % 5}"}
+        await rec.timed("POST /ingest/pdf", client.post("/ingest/pdf", data=data, files=files))
+        await rec.timed(
+            "GET /instructor/recommendations",
+            client.get("/instructor/recommendations", params={"course_id": course, "lecture_id": lecture}),
+        )
+        await asyncio.sleep(rng.expovariate(1.0 / interval_s))
+
+
+async def run(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    keys = [
+        (f"course-{c}", f"lecture-{l}")
+        for c in range(args.courses)
+        for l in range(args.lectures)
+    ]
+    limits = httpx.Limits(max_connections=args.students + args.instructors + 8)
+    timeout = httpx.Timeout(args.timeout)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=timeout) as client:
+        t0 = time.perf_counter()
+        await setup(client, keys, rng)
+        print(f"ingested {len(keys)} lectures in {time.perf_counter() - t0:.1f}s")
+
+        rec = Recorder()
+        start = time.perf_counter()
+        deadline = start + args.duration
+        tasks = [
+            student(client, rec, keys, deadline, random.Random(rng.random()), args.think_ms, args.stream_share)
+            for _ in range(args.students)
+        ] + [
+            instructor(client, rec, keys, deadline, random.Random(rng.random()), args.instructor_interval)
+            for _ in range(args.instructors)
+        ]
+        await asyncio.gather(*tasks)
+        rec.report(time.perf_counter() - start)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--students", type=int, default=50)
+    parser.add_argument("--instructors", type=int, default=2)
+    parser.add_argument("--courses", type=int, default=3)
+    parser.add_argument("--lectures", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=60.0, help="seconds")
+    parser.add_argument("--think-ms", type=float, default=1500.0, help="mean pause between questions")
+    parser.add_argument("--stream-share", type=float, default=0.3, help="fraction of chats via /chat/stream")
+    parser.add_argument("--instructor-interval", type=float, default=10.0, help="mean seconds between uploads")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=11)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
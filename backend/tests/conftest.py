@@ -0,0 +1,87 @@
+"""
+The suite runs against the backend named by DATABASE_URL:
+
+    cd backend && python -m pytest -q tests
+    cd backend && DATABASE_URL=postgresql+psycopg://postgres@localhost:5432/copilot python -m pytest -q tests
+
+It never touches that database itself: for PostgreSQL it creates a scratch
+database on the same server (the user needs CREATEDB) and drops it at the
+end; otherwise it uses a throwaway SQLite file.
+"""
+import os
+import sys
+import tempfile
+import uuid
+import warnings
+from pathlib import Path
+
+import pytest
+from sqlalchemy import MetaData, create_engine, text
+from sqlalchemy.engine import make_url
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+_CONFIGURED_URL = os.getenv("DATABASE_URL", "")
+_SCRATCH_DB = None
+
+if _CONFIGURED_URL.startswith("postgresql"):
+    _url = make_url(_CONFIGURED_URL)
+    _SCRATCH_DB = f"copilot_test_{uuid.uuid4().hex[:12]}"
+    _admin = create_engine(_url, isolation_level="AUTOCOMMIT")
+    with _admin.connect() as conn:
+        conn.execute(text(f'CREATE DATABASE "{_SCRATCH_DB}"'))
+    _admin.dispose()
+    os.environ["DATABASE_URL"] = _url.set(database=_SCRATCH_DB).render_as_string(hide_password=False)
+else:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp(prefix='copilot_test_')}/app.db"
+
+
+def pytest_sessionfinish(session, exitstatus):
+    if _SCRATCH_DB is None:
+        return
+    from app.services.db import engine
+
+    engine.dispose()
+    admin = create_engine(make_url(_CONFIGURED_URL), isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        conn.execute(text(f'DROP DATABASE IF EXISTS "{_SCRATCH_DB}" WITH (FORCE)'))
+    admin.dispose()
+
+
+def drop_all_tables(engine) -> None:
+    """
+    Drop every table (including ones only older schemas had) and forget
+    the courses/lectures the registry has seen.
+    """
+    from app.services import db
+
+    existing = MetaData()
+    with warnings.catch_warnings():
+        # Expression (COALESCE) indexes can't be reflected; they go with their tables.
+        warnings.simplefilter("ignore")
+        existing.reflect(engine)
+    existing.drop_all(engine)
+    with db._registry_lock:
+        db._known_courses.clear()
+        db._known_lectures.clear()
+
+
+@pytest.fixture
+def engine():
+    """
+    A freshly initialised database with the current schema.
+    """
+    from app.services import db
+
+    drop_all_tables(db.engine)
+    db.init_db()
+    return db.engine
+
+
+@pytest.fixture(autouse=True)
+def no_openai(monkeypatch):
+    """
+    Keep the suite offline: embeddings and LLM calls take their
+    no-provider paths.
+    """
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
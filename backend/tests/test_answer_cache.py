@@ -0,0 +1,74 @@
+"""
+Answer cache: exact and semantic hits, misses, and entries going stale
+when the lecture's content version changes (e.g. another worker ingested).
+"""
+from app.services.answer_cache import AnswerCache
+from app.services.store import course_store
+
+
+def _store(cache, question, embedding, version=None, lecture_id="l1"):
+    cache.store(
+        "c1",
+        lecture_id,
+        "normal",
+        question,
+        embedding,
+        f"answer to {question}",
+        [{"source_name": "notes", "chunk_id": "abc123", "preview": "..."}],
+        "LLM enabled: RAG (retrieve + generate)",
+        ["context"],
+        version,
+    )
+
+
+def test_exact_semantic_hit_and_miss():
+    cache = AnswerCache(threshold=0.9)
+    _store(cache, "What is dropout?", [1.0, 0.0, 0.0])
+
+    # Same text up to case and punctuation: exact hit, embedding not needed.
+    hit = cache.lookup("c1", "l1", "normal", "what is DROPOUT", None)
+    assert hit is not None and hit.answer == "answer to What is dropout?"
+    # A paraphrase with a nearby embedding: semantic hit.
+    assert cache.lookup("c1", "l1", "normal", "Explain dropout", [0.98, 0.1, 0.0]) is hit
+    # Too far away, another mode, or another lecture: miss.
+    assert cache.lookup("c1", "l1", "normal", "What is momentum?", [0.0, 1.0, 0.0]) is None
+    assert cache.lookup("c1", "l1", "simple", "What is dropout?", [1.0, 0.0, 0.0]) is None
+    assert cache.lookup("c1", "l2", "normal", "What is dropout?", [1.0, 0.0, 0.0]) is None
+
+    stats = cache.stats()
+    assert (stats["exact_hits"], stats["semantic_hits"], stats["misses"]) == (1, 1, 3)
+    assert hit.hits == 2
+
+
+def test_invalidate_drops_lecture_and_course_wide_entries():
+    cache = AnswerCache()
+    _store(cache, "What is dropout?", None, lecture_id="l1")
+    _store(cache, "What is dropout?", None, lecture_id=None)
+    _store(cache, "What is dropout?", None, lecture_id="l2")
+
+    cache.invalidate("c1", "l1")
+    assert cache.lookup("c1", "l1", "normal", "What is dropout?") is None
+    assert cache.lookup("c1", None, "normal", "What is dropout?") is None
+    assert cache.lookup("c1", "l2", "normal", "What is dropout?") is not None
+
+
+def test_entry_goes_stale_when_content_version_changes(engine):
+    # A separate cache stands in for another worker's: CourseStore's
+    # in-process invalidation never reaches it, only the version does.
+    cache = AnswerCache()
+    course_store.add_documents(
+        [{"course_id": "c1", "lecture_id": "l1", "source_name": "notes", "chunks": ["dropout zeroes activations"]}]
+    )
+    v1 = course_store.content_version("c1", "l1")
+    _store(cache, "What is dropout?", None, version=v1)
+    assert cache.lookup("c1", "l1", "normal", "What is dropout?", version=v1) is not None
+
+    course_store.add_documents(
+        [{"course_id": "c1", "lecture_id": "l1", "source_name": "slides", "chunks": ["dropout is a regularizer"]}]
+    )
+    v2 = course_store.content_version("c1", "l1")
+    assert v2 != v1
+    assert cache.lookup("c1", "l1", "normal", "What is dropout?", version=v2) is None
+    # The stale entry is gone for good, even for a caller without a version.
+    assert cache.lookup("c1", "l1", "normal", "What is dropout?") is None
+    assert cache.stats()["stale"] == 1
@@ -0,0 +1,44 @@
+"""
+StreamingCitationChecker: citations are reported once, when their closing
+bracket arrives, however the deltas split them.
+"""
+from app.services.citation_guard import StreamingCitationChecker, needs_fix
+
+ALLOWED = {"abc123", "def456"}
+
+
+def test_citation_split_across_deltas():
+    checker = StreamingCitationChecker(ALLOWED)
+    assert checker.feed("Dropout zeroes activations [lec") == []
+    assert checker.feed("ture 1 | abc") == []
+    assert checker.feed("123") == []
+    assert checker.feed("]. Gradients flow") == [("lecture 1", "abc123", True)]
+    assert not checker.needs_fix()
+    assert checker.text == "Dropout zeroes activations [lecture 1 | abc123]. Gradients flow"
+
+
+def test_id_prefix_is_not_reported_before_the_bracket_closes():
+    # "abc123" alone would be a valid id; the full "abc12345" is not.
+    checker = StreamingCitationChecker(ALLOWED)
+    assert checker.feed("See [notes | abc123") == []
+    assert checker.feed("45].") == [("notes", "abc12345", False)]
+    assert checker.needs_fix()
+
+
+def test_several_citations_in_one_delta_and_no_repeats():
+    checker = StreamingCitationChecker(ALLOWED)
+    found = checker.feed("A [notes | abc123] and B [slides | zzz999] and C [notes | def4")
+    assert found == [("notes", "abc123", True), ("slides", "zzz999", False)]
+    assert checker.feed("56].") == [("notes", "def456", True)]
+    assert checker.feed(" Done.") == []
+    assert checker.valid == [("notes", "abc123"), ("notes", "def456")]
+    assert checker.invalid == [("slides", "zzz999")]
+    # The incremental verdict matches checking the whole text at the end.
+    assert checker.needs_fix() == needs_fix(checker.text, ALLOWED) is True
+
+
+def test_answer_without_citations_needs_fix():
+    checker = StreamingCitationChecker(ALLOWED)
+    checker.feed("No citations ")
+    checker.feed("here.")
+    assert checker.needs_fix() == needs_fix(checker.text, ALLOWED) is True
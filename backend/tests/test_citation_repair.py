@@ -0,0 +1,61 @@
+"""
+Local citation repair: bogus or missing chunk ids are replaced by the
+best-matching retrieved chunk, valid citations are kept.
+"""
+from app.services.citation_guard import all_citations_valid, extract_citations
+from app.services.citation_repair import repair_citations
+from app.services.store import course_store
+
+DROPOUT = "Dropout randomly zeroes activations during training so units do not co-adapt."
+BACKPROP = "Backpropagation applies the chain rule to compute gradients layer by layer."
+LEARNING_RATE = "The learning rate controls the step size of each parameter update."
+
+
+def _hits():
+    course_store.add_documents(
+        [
+            {"course_id": "c1", "lecture_id": "l1", "source_name": "notes", "chunks": [DROPOUT, BACKPROP]},
+            {"course_id": "c1", "lecture_id": "l1", "source_name": "slides", "chunks": [LEARNING_RATE]},
+        ]
+    )
+    hits = course_store.search("c1", "dropout chain rule learning rate", k=5, lecture_id="l1")
+    assert len(hits) == 3
+    return {h.text: h for h in hits}
+
+
+def test_bogus_and_missing_ids_go_to_best_matching_chunk(engine):
+    hits = _hits()
+    dropout, backprop = hits[DROPOUT], hits[BACKPROP]
+    answer = (
+        "Dropout zeroes activations at random during training [notes | bogus999].\n"
+        "Gradients come from applying the chain rule layer by layer. Want an example?"
+    )
+
+    repaired = repair_citations(answer, "c1", list(hits.values()), lecture_id="l1")
+
+    assert repaired is not None
+    assert all_citations_valid(repaired, {h.chunk_id for h in hits.values()})
+    assert "bogus999" not in repaired
+    first, second = repaired.split("\n")
+    assert extract_citations(first) == [("notes", dropout.chunk_id)]
+    assert extract_citations(second) == [("notes", backprop.chunk_id)]
+    # The citation goes before the sentence's own punctuation, and short
+    # follow-ups stay uncited.
+    assert second.startswith(f"Gradients come from applying the chain rule layer by layer [notes | {backprop.chunk_id}].")
+    assert second.endswith("Want an example?")
+
+
+def test_valid_citations_are_kept(engine):
+    hits = _hits()
+    rate = hits[LEARNING_RATE]
+    answer = f"The step size of every update is set by the learning rate [slides | {rate.chunk_id}]."
+
+    assert repair_citations(answer, "c1", list(hits.values()), lecture_id="l1") == answer
+
+
+def test_nothing_attributable_returns_none(engine):
+    hits = _hits()
+    answer = "Photosynthesis converts sunlight into chemical energy in plants [notes | bogus999]."
+
+    assert repair_citations(answer, "c1", list(hits.values()), lecture_id="l1") is None
+    assert repair_citations(answer, "c1", [], lecture_id="l1") is None
@@ -0,0 +1,252 @@
+"""
+Dialect-sensitive write paths: ON CONFLICT upserts on COALESCE keys,
+insert_ignore, the conversation trim and concurrent migrations.
+"""
+import threading
+
+from sqlalchemy import func, select
+
+from app.services import db
+from app.services.backfill_confusion import _save_checkpoint, load_checkpoint
+from app.services.confusion_rollups import ROLLUP_RESOLUTIONS, upsert_rollups
+from app.services.db import (
+    confusion_rollups,
+    conversation_turns,
+    courses,
+    db_conn,
+    ensure_course,
+    ensure_lecture,
+    insert_ignore,
+    lectures,
+    questions,
+    schema_migrations,
+    student_concepts,
+)
+from app.services.mastery import _apply_mastery
+from app.services.memory import _insert_turns
+from app.services.migrations import MIGRATIONS, run_migrations
+from app.services.question_log import _insert_questions
+from app.services.summaries import upsert_summaries
+
+
+def _count(table, *conds) -> int:
+    stmt = select(func.count()).select_from(table)
+    for c in conds:
+        stmt = stmt.where(c)
+    with db_conn() as conn:
+        return conn.execute(stmt).scalar()
+
+
+def test_insert_ignore_skips_existing_rows(engine):
+    with db_conn() as conn:
+        ensure_lecture(conn, "c1", "l1")
+    with db_conn() as conn:
+        conn.execute(insert_ignore(conn, courses).values(course_id="c1", created_at=1.0))
+        conn.execute(
+            insert_ignore(conn, lectures).values(course_id="c1", lecture_id="l1", created_at=1.0)
+        )
+        conn.execute(insert_ignore(conn, courses).values(course_id="c2", created_at=1.0))
+    assert _count(courses) == 2
+    assert _count(lectures) == 1
+
+
+def test_ensure_course_is_safe_without_the_registry(engine):
+    # Another worker (or a cold registry) inserting the same course must not fail.
+    with db_conn() as conn:
+        ensure_course(conn, "c1")
+    db._known_courses.clear()
+    with db_conn() as conn:
+        ensure_course(conn, "c1")
+    assert _count(courses) == 1
+
+
+def _mastery(user_id, lecture_id, concepts, confusion, ts):
+    return {
+        "course_id": "c1",
+        "lecture_id": lecture_id,
+        "user_id": user_id,
+        "concepts": concepts,
+        "confusion": confusion,
+        "timestamp": ts,
+    }
+
+
+def test_mastery_upsert_merges_on_coalesced_lecture(engine):
+    with db_conn() as conn:
+        ensure_lecture(conn, "c1", "l1")
+        _apply_mastery(
+            conn,
+            [
+                _mastery("u1", None, ["gradient", "loss"], 0.5, 10.0),
+                # Repeats within one batch are merged before the statement.
+                _mastery("u1", None, ["gradient"], 0.25, 20.0),
+                _mastery("u1", "l1", ["gradient"], 1.0, 15.0),
+            ],
+        )
+    with db_conn() as conn:
+        _apply_mastery(conn, [_mastery("u1", None, ["gradient"], 0.125, 30.0)])
+
+    with db_conn() as conn:
+        rows = {
+            (r.lecture_id, r.concept): r
+            for r in conn.execute(select(student_concepts).where(student_concepts.c.user_id == "u1"))
+        }
+    assert set(rows) == {(None, "gradient"), (None, "loss"), ("l1", "gradient")}
+    course_wide = rows[(None, "gradient")]
+    assert course_wide.count == 3
+    assert abs(course_wide.confusion_sum - 0.875) < 1e-9
+    assert course_wide.last_updated == 30.0
+    assert rows[("l1", "gradient")].count == 1
+
+
+def _question(lecture_id, ts, confusion):
+    return {"course_id": "c1", "lecture_id": lecture_id, "timestamp": ts, "confusion": confusion}
+
+
+def _rollups():
+    with db_conn() as conn:
+        return {
+            (r.lecture_id, r.resolution, r.bucket_start): (r.count, round(r.confusion_sum, 9))
+            for r in conn.execute(select(confusion_rollups))
+        }
+
+
+def test_rollup_upsert_adds_and_removes(engine):
+    with db_conn() as conn:
+        upsert_rollups(conn, [_question(None, 100.0, 0.5), _question(None, 101.0, 0.25)])
+    with db_conn() as conn:
+        upsert_rollups(conn, [_question(None, 102.0, 0.125), _question("l1", 100.0, 1.0)])
+
+    rollups = _rollups()
+    assert rollups[(None, 15, 90)] == (3, 0.875)
+    assert rollups[("l1", 15, 90)] == (1, 1.0)
+    assert rollups[(None, 3600, 0)] == (3, 0.875)
+    assert len(rollups) == 2 * len(ROLLUP_RESOLUTIONS)
+
+    # A rescore moves the sum only; removing the last question drops the bucket.
+    with db_conn() as conn:
+        upsert_rollups(conn, [{**_question(None, 100.0, 0.5), "count": 0}])
+        upsert_rollups(conn, [_question("l1", 100.0, 1.0)], sign=-1)
+    rollups = _rollups()
+    assert rollups[(None, 15, 90)] == (3, 1.375)
+    assert not any(key[0] == "l1" for key in rollups)
+
+
+def test_checkpoint_upsert_replaces_the_row(engine):
+    ckpt = {
+        "job": "confusion",
+        "last_id": 0,
+        "target_id": 10,
+        "rows_done": 0,
+        "status": "running",
+        "started_at": 1.0,
+        "updated_at": 1.0,
+    }
+    with db_conn() as conn:
+        _save_checkpoint(conn, ckpt)
+    with db_conn() as conn:
+        _save_checkpoint(conn, {**ckpt, "last_id": 7, "rows_done": 7, "updated_at": 2.0})
+    saved = load_checkpoint("confusion")
+    assert (saved["last_id"], saved["rows_done"], saved["updated_at"]) == (7, 7, 2.0)
+    assert saved["started_at"] == 1.0
+
+
+def _turn(lecture_id, i, max_turns, trim):
+    return {
+        "course_id": "c1",
+        "lecture_id": lecture_id,
+        "user_id": "u1",
+        "role": "user",
+        "content": f"turn {i}",
+        "timestamp": float(i),
+        "max_turns": max_turns,
+        "trim": trim,
+    }
+
+
+def test_insert_turns_trims_summarized_turns(engine):
+    with db_conn() as conn:
+        ensure_lecture(conn, "c1", "l1")
+        _insert_turns(conn, [_turn("l1", i, 4, False) for i in range(5)])
+        _insert_turns(conn, [_turn(None, i, 4, False) for i in range(5)])
+        # The summary covers turns 0 and 1 only.
+        upsert_summaries(
+            conn,
+            [
+                {
+                    "course_id": "c1",
+                    "lecture_id": "l1",
+                    "user_id": "u1",
+                    "summary": "turns 0-1",
+                    "covered_until": 1.0,
+                    "updated_at": 1.0,
+                }
+            ],
+        )
+    with db_conn() as conn:
+        _insert_turns(conn, [_turn("l1", 5, 4, False), _turn("l1", 6, 4, True)])
+
+    with db_conn() as conn:
+        kept = [
+            r[0]
+            for r in conn.execute(
+                select(conversation_turns.c.content)
+                .where(conversation_turns.c.lecture_id == "l1")
+                .order_by(conversation_turns.c.id)
+            )
+        ]
+    # Beyond the newest four, only what the summary covers is deleted.
+    assert kept == ["turn 2", "turn 3", "turn 4", "turn 5", "turn 6"]
+    # The course-wide conversation of the same student is a different key,
+    # and has no summary yet.
+    assert _count(conversation_turns, conversation_turns.c.lecture_id.is_(None)) == 5
+
+
+def test_concurrent_migrations_apply_once(engine):
+    with db_conn() as conn:
+        ensure_lecture(conn, "c1", "l1")
+        _insert_questions(
+            conn,
+            [
+                {
+                    "course_id": "c1",
+                    "lecture_id": "l1" if i % 2 else None,
+                    "user_id": "u1",
+                    "question": f"q{i}",
+                    "confusion": 0.5,
+                    "timestamp": 1000.0 + 7 * i,
+                }
+                for i in range(50)
+            ],
+        )
+    expected = _rollups()
+    # Pretend the last two migrations are pending, then start several
+    # "workers" at once, as a multi-worker deploy does.
+    with db_conn() as conn:
+        conn.execute(schema_migrations.delete().where(schema_migrations.c.version >= 4))
+
+    errors, applied = [], []
+    barrier = threading.Barrier(4)
+
+    def worker():
+        try:
+            barrier.wait()
+            applied.append(run_migrations(db.engine))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    if engine.dialect.name == "postgresql":
+        # The advisory lock lets exactly one worker apply each migration.
+        assert sorted(v for versions in applied for v in versions) == [4, 5]
+    with db_conn() as conn:
+        versions = [r[0] for r in conn.execute(select(schema_migrations.c.version))]
+    assert sorted(versions) == [v for v, _, _ in MIGRATIONS]
+    assert _rollups() == expected
+    assert _count(questions) == 50
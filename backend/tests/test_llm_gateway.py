@@ -0,0 +1,135 @@
+"""
+LLM gateway: single-flight coalescing, deadlines, cancelling the upstream
+call once nobody waits for it, and hedging.
+"""
+import asyncio
+import threading
+import time
+
+from app.services.llm_gateway import LLMGateway
+
+
+class FakeCall:
+    """
+    An upstream call that counts starts and cancellations.
+    """
+    def __init__(self, result="answer", delay=0.05):
+        self.result = result
+        self.delay = delay
+        self.started = 0
+        self.cancelled = 0
+
+    async def __call__(self):
+        self.started += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        return self.result
+
+
+def test_identical_requests_are_coalesced():
+    gw = LLMGateway(deadline=5.0)
+    call = FakeCall()
+
+    async def main():
+        return await asyncio.gather(*[gw.run("k", call) for _ in range(5)], gw.run("other", call))
+
+    results = asyncio.run(main())
+    assert results == ["answer"] * 6
+    assert call.started == 2
+    stats = gw.stats()
+    assert (stats["calls"], stats["upstream"], stats["coalesced"]) == (6, 2, 4)
+
+
+def test_deadline_returns_none_and_cancels_upstream():
+    gw = LLMGateway(deadline=0.05)
+    call = FakeCall(delay=5.0)
+
+    async def main():
+        result = await gw.run("k", call)
+        await asyncio.sleep(0.01)  # let the cancellation land
+        return result, call.cancelled
+
+    # Checked inside the loop: asyncio.run cancels leftover tasks on exit.
+    assert asyncio.run(main()) == (None, 1)
+    assert gw.stats()["deadline_exceeded"] == 1
+
+
+def test_errors_return_none():
+    gw = LLMGateway(deadline=5.0)
+
+    async def failing():
+        raise RuntimeError("provider down")
+
+    assert asyncio.run(gw.run("k", failing)) is None
+    assert gw.stats()["errors"] == 1
+
+
+def test_upstream_cancelled_only_when_last_waiter_leaves():
+    gw = LLMGateway(deadline=5.0)
+    call = FakeCall(delay=5.0)
+
+    async def main():
+        a = asyncio.ensure_future(gw.run("k", call))
+        b = asyncio.ensure_future(gw.run("k", call))
+        await asyncio.sleep(0.01)
+
+        a.cancel()
+        await asyncio.sleep(0.01)
+        # b still waits: the shared call keeps running.
+        assert call.cancelled == 0 and not b.done()
+
+        b.cancel()
+        await asyncio.sleep(0.01)
+        assert call.cancelled == 1
+        # A new request afterwards starts a fresh call.
+        call.delay = 0.0
+        return await gw.run("k", call)
+
+    assert asyncio.run(main()) == "answer"
+    assert call.started == 2
+
+
+def test_hedge_wins_when_first_attempt_is_slow():
+    gw = LLMGateway(deadline=5.0, hedge=True, hedge_min_delay=0.02, hedge_min_samples=1)
+    gw._observe(0.01)
+    delays = iter([5.0, 0.0])
+    starts = []
+
+    async def call():
+        starts.append(1)
+        await asyncio.sleep(next(delays))
+        return "answer"
+
+    assert asyncio.run(gw.run("k", call)) == "answer"
+    assert len(starts) == 2
+    stats = gw.stats()
+    assert (stats["hedged"], stats["hedge_wins"]) == (1, 1)
+
+
+def test_run_sync_coalesces_and_times_out():
+    gw = LLMGateway(deadline=5.0)
+    started = []
+    release = threading.Event()
+
+    def call():
+        started.append(1)
+        release.wait(5)
+        return "answer"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(gw.run_sync("k", call))) for _ in range(4)]
+    for t in threads:
+        t.start()
+    time.sleep(0.05)
+    release.set()
+    for t in threads:
+        t.join()
+    assert results == ["answer"] * 4
+    assert len(started) == 1
+
+    slow = LLMGateway(deadline=0.05)
+    assert slow.run_sync("k", lambda: time.sleep(0.5) or "late") is None
+    assert slow.stats()["deadline_exceeded"] == 1
@@ -0,0 +1,257 @@
+"""
+Upgrading a database created by the original schema: m1-m5 on real data,
+including m4's merge of duplicate mastery rows and m5's rollup rebuild.
+"""
+import pytest
+from sqlalchemy import (
+    Column,
+    Float,
+    ForeignKey,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    Text,
+    func,
+    inspect,
+    select,
+)
+from sqlalchemy.exc import IntegrityError
+
+from app.services import db
+from app.services.confusion_rollups import ROLLUP_RESOLUTIONS
+from app.services.db import confusion_rollups, db_conn, schema_migrations, student_concepts
+from app.services.mastery import _apply_mastery
+from app.services.migrations import MIGRATIONS, run_migrations
+
+from conftest import drop_all_tables
+
+
+def _baseline_metadata() -> MetaData:
+    # The tables as the first release created them: no chunk content_hash,
+    # no indexes beyond the keys, no unique mastery key, no rollups.
+    m = MetaData()
+    Table(
+        "courses", m,
+        Column("course_id", String, primary_key=True),
+        Column("created_at", Float, nullable=False),
+    )
+    Table(
+        "lectures", m,
+        Column("course_id", String, ForeignKey("courses.course_id"), primary_key=True),
+        Column("lecture_id", String, primary_key=True),
+        Column("created_at", Float, nullable=False),
+    )
+    Table(
+        "documents", m,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("course_id", String, ForeignKey("courses.course_id"), nullable=False),
+        Column("lecture_id", String, nullable=True),
+        Column("source_name", String, nullable=False),
+        Column("created_at", Float, nullable=False),
+    )
+    Table(
+        "chunks", m,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("document_id", Integer, ForeignKey("documents.id"), nullable=False),
+        Column("chunk_id", String, nullable=False, unique=True),
+        Column("text", Text, nullable=False),
+        Column("created_at", Float, nullable=False),
+    )
+    Table(
+        "questions", m,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("course_id", String, ForeignKey("courses.course_id"), nullable=False),
+        Column("lecture_id", String, nullable=True),
+        Column("user_id", String, nullable=False),
+        Column("question", Text, nullable=False),
+        Column("confusion", Float, nullable=False),
+        Column("timestamp", Float, nullable=False),
+    )
+    Table(
+        "student_concepts", m,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("course_id", String, ForeignKey("courses.course_id"), nullable=False),
+        Column("lecture_id", String, nullable=True),
+        Column("user_id", String, nullable=False),
+        Column("concept", String, nullable=False),
+        Column("count", Integer, nullable=False),
+        Column("confusion_sum", Float, nullable=False),
+        Column("last_updated", Float, nullable=False),
+    )
+    Table(
+        "conversation_turns", m,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("course_id", String, ForeignKey("courses.course_id"), nullable=False),
+        Column("lecture_id", String, nullable=True),
+        Column("user_id", String, nullable=False),
+        Column("role", String, nullable=False),
+        Column("content", Text, nullable=False),
+        Column("timestamp", Float, nullable=False),
+    )
+    Table(
+        "alerts", m,
+        Column("id", Integer, primary_key=True, autoincrement=True),
+        Column("course_id", String, ForeignKey("courses.course_id"), nullable=False),
+        Column("lecture_id", String, nullable=True),
+        Column("type", String, nullable=False),
+        Column("message", Text, nullable=False),
+        Column("severity", String, nullable=False),
+        Column("created_at", Float, nullable=False),
+    )
+    return m
+
+
+# (lecture_id, user_id, concept, count, confusion_sum, last_updated); the
+# old SELECT-then-INSERT path could leave several rows per key.
+CONCEPT_ROWS = [
+    (None, "u1", "gradient", 1, 0.5, 10.0),
+    (None, "u1", "gradient", 2, 0.25, 30.0),
+    (None, "u1", "gradient", 3, 1.0, 20.0),
+    ("l1", "u1", "gradient", 1, 0.75, 5.0),
+    ("l1", "u1", "gradient", 4, 2.0, 6.0),
+    ("l1", "u2", "loss", 2, 1.5, 7.0),
+]
+
+# Expected merged rows: key -> (count, confusion_sum, last_updated)
+MERGED = {
+    (None, "u1", "gradient"): (6, 1.75, 30.0),
+    ("l1", "u1", "gradient"): (5, 2.75, 6.0),
+    ("l1", "u2", "loss"): (2, 1.5, 7.0),
+}
+
+QUESTIONS = [
+    ("l1" if i % 3 else None, 1000.0 + 11.0 * i, round(0.1 * (i % 7), 2))
+    for i in range(400)
+]
+
+
+@pytest.fixture
+def baseline_engine():
+    drop_all_tables(db.engine)
+    baseline = _baseline_metadata()
+    baseline.create_all(db.engine)
+    t = baseline.tables
+    with db.engine.begin() as conn:
+        conn.execute(t["courses"].insert().values(course_id="c1", created_at=1.0))
+        conn.execute(t["lectures"].insert().values(course_id="c1", lecture_id="l1", created_at=1.0))
+        conn.execute(
+            t["student_concepts"].insert(),
+            [
+                {
+                    "course_id": "c1",
+                    "lecture_id": lecture_id,
+                    "user_id": user_id,
+                    "concept": concept,
+                    "count": count,
+                    "confusion_sum": confusion_sum,
+                    "last_updated": last_updated,
+                }
+                for lecture_id, user_id, concept, count, confusion_sum, last_updated in CONCEPT_ROWS
+            ],
+        )
+        conn.execute(
+            t["questions"].insert(),
+            [
+                {
+                    "course_id": "c1",
+                    "lecture_id": lecture_id,
+                    "user_id": "u1",
+                    "question": f"q{i}",
+                    "confusion": confusion,
+                    "timestamp": ts,
+                }
+                for i, (lecture_id, ts, confusion) in enumerate(QUESTIONS)
+            ],
+        )
+    return db.engine
+
+
+def _concepts():
+    with db_conn() as conn:
+        return {
+            (r.lecture_id, r.user_id, r.concept): (r.count, round(r.confusion_sum, 9), r.last_updated)
+            for r in conn.execute(select(student_concepts))
+        }
+
+
+def _expected_rollups():
+    out = {}
+    for lecture_id, ts, confusion in QUESTIONS:
+        for r in ROLLUP_RESOLUTIONS:
+            acc = out.setdefault((lecture_id, r, int(ts // r) * r), [0, 0.0])
+            acc[0] += 1
+            acc[1] += confusion
+    return {k: (n, round(s, 6)) for k, (n, s) in out.items()}
+
+
+def _rollups():
+    with db_conn() as conn:
+        return {
+            (r.lecture_id, r.resolution, r.bucket_start): (r.count, round(r.confusion_sum, 6))
+            for r in conn.execute(select(confusion_rollups))
+        }
+
+
+def test_upgrade_from_baseline(baseline_engine):
+    db.init_db()
+
+    with db_conn() as conn:
+        versions = sorted(r[0] for r in conn.execute(select(schema_migrations.c.version)))
+    assert versions == [v for v, _, _ in MIGRATIONS]
+
+    # m2, m3
+    insp = inspect(baseline_engine)
+    assert "content_hash" in {c["name"] for c in insp.get_columns("chunks")}
+    assert "ix_questions_course_timestamp" in {i["name"] for i in insp.get_indexes("questions")}
+
+    # m4: duplicates merged, counts and sums added, newest timestamp kept.
+    assert _concepts() == MERGED
+
+    # m5: rollups rebuilt from the existing questions.
+    assert _rollups() == _expected_rollups()
+
+
+def test_unique_concept_key_after_upgrade(baseline_engine):
+    db.init_db()
+
+    for lecture_id in (None, "l1"):
+        with pytest.raises(IntegrityError):
+            with db_conn() as conn:
+                conn.execute(
+                    student_concepts.insert().values(
+                        course_id="c1",
+                        lecture_id=lecture_id,
+                        user_id="u1",
+                        concept="gradient",
+                        count=1,
+                        confusion_sum=0.0,
+                        last_updated=0.0,
+                    )
+                )
+
+    # The mastery upsert now lands on the merged rows.
+    with db_conn() as conn:
+        _apply_mastery(
+            conn,
+            [
+                {
+                    "course_id": "c1",
+                    "lecture_id": None,
+                    "user_id": "u1",
+                    "concepts": ["gradient"],
+                    "confusion": 0.25,
+                    "timestamp": 40.0,
+                }
+            ],
+        )
+    assert _concepts()[(None, "u1", "gradient")] == (7, 2.0, 40.0)
+    with db_conn() as conn:
+        assert conn.execute(select(func.count()).select_from(student_concepts)).scalar() == len(MERGED)
+
+
+def test_migrations_run_once(baseline_engine):
+    db.init_db()
+    before = (_concepts(), _rollups())
+    assert run_migrations(baseline_engine) == []
+    assert (_concepts(), _rollups()) == before
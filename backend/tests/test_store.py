@@ -0,0 +1,53 @@
+"""
+CourseStore re-ingest: chunk diffs by content hash, and an emptied
+document taking its chunks out of the DB and the search index.
+"""
+from sqlalchemy import func, select
+
+from app.services.db import chunks as chunks_table, db_conn, documents
+from app.services.store import course_store
+
+
+def _doc(course_id, chunks, source_name="notes"):
+    return {"course_id": course_id, "lecture_id": "l1", "source_name": source_name, "chunks": chunks}
+
+
+def _stored(course_id):
+    with db_conn() as conn:
+        n_docs = conn.execute(
+            select(func.count()).select_from(documents).where(documents.c.course_id == course_id)
+        ).scalar()
+        n_chunks = conn.execute(
+            select(func.count())
+            .select_from(chunks_table.join(documents, chunks_table.c.document_id == documents.c.id))
+            .where(documents.c.course_id == course_id)
+        ).scalar()
+    return n_docs, n_chunks
+
+
+def test_reingest_diffs_chunks(engine):
+    course_store.add_documents([_doc("diff", ["alpha gradients", "beta momentum"])])
+    [diff] = course_store.add_documents([_doc("diff", ["alpha gradients", "gamma dropout"])])
+    assert diff == {"added": 1, "removed": 1, "unchanged": 1}
+    assert _stored("diff") == (1, 2)
+
+
+def test_reingest_empty_document_removes_it(engine):
+    course_store.add_documents(
+        [
+            _doc("empty", ["backpropagation applies the chain rule"]),
+            _doc("empty", ["dropout zeroes activations"], source_name="other"),
+        ]
+    )
+    assert course_store.search("empty", "chain rule", lecture_id="l1")
+
+    [diff] = course_store.add_documents([_doc("empty", [])])
+    assert diff == {"added": 0, "removed": 1, "unchanged": 0}
+    assert _stored("empty") == (1, 1)
+    hits = course_store.search("empty", "chain rule", lecture_id="l1")
+    assert all(h.source_name == "other" for h in hits)
+
+    # An empty document that was never stored is a no-op.
+    [diff] = course_store.add_documents([_doc("empty", [], source_name="missing")])
+    assert diff == {"added": 0, "removed": 0, "unchanged": 0}
+    assert _stored("empty") == (1, 1)